@@ -7,7 +7,7 @@ import re
 import shlex
 import inspect
 import sys
-from typing import Callable, Any, Tuple
+from typing import Callable, Any, Hashable, Tuple
 
 from .core_plugins.wsview import WebView
 from .backends.base import Message, ONLINE, OFFLINE, AWAY, DND  # noqa
@@ -34,6 +34,7 @@ sys.modules["errbot.errBot"] = core
 # complex strings in arguments
 # Map of characters to sanitized equivalents
 ARG_BOTCMD_CHARACTER_REPLACEMENTS = {'—': '--', '“': '"', '”': '"'}
+ARG_BOTCMD_SANITIZER_RE = re.compile('|'.join(re.escape(ii) for ii in ARG_BOTCMD_CHARACTER_REPLACEMENTS))
 
 
 class ArgumentParseError(Exception):
@@ -76,7 +77,9 @@ def _tag_botcmd(func,
                 prefixed=True,  # re_cmd_only
                 _arg=False,
                 command_parser=None,  # arg_cmd only
-                re_cmd_name_help=None):  # re_cmd_only
+                re_cmd_name_help=None,  # re_cmd_only
+                cache_ttl=None,
+                cache_key=None):
     """
     Mark a method as a bot command.
     """
@@ -90,6 +93,8 @@ def _tag_botcmd(func,
         func._err_command_syntax = syntax
         func._err_command_flow_only = flow_only
         func._err_command_hidden = hidden if hidden is not None else flow_only
+        func._err_command_cache_ttl = cache_ttl
+        func._err_command_cache_key = cache_key
 
         # re_cmd
         func._err_re_command = _re
@@ -116,7 +121,9 @@ def botcmd(*args,
            historize: bool = True,
            template: str = None,
            flow_only: bool = False,
-           syntax: str = None) -> Callable[[BotPlugin, Message, Any], Any]:
+           syntax: str = None,
+           cache_ttl: float = None,
+           cache_key: Callable[[Message, Any], Hashable] = None) -> Callable[[BotPlugin, Message, Any], Any]:
     """
     Decorator for bot command functions
 
@@ -131,6 +138,11 @@ def botcmd(*args,
     :param syntax: The argument syntax you expect for example: '[name] <mandatory>'.
     :param flow_only: Flag this command to be available only when it is part of a flow.
                        If True and hidden is None, it will switch hidden to True.
+    :param cache_ttl: Serve the result of the command from a cache for this number of seconds.
+        Only use it on commands without side effects: identical invocations running at the same time
+        are executed only once and the cached replies are sent back to whoever asks within the ttl.
+    :param cache_key: A callable taking the message and the arguments of the command and returning
+        a hashable key identifying its result. By default the result only depends on the arguments.
 
     This decorator should be applied to methods of :class:`~errbot.botplugin.BotPlugin`
     classes to turn them into commands that can be given to the bot. These methods are
@@ -157,7 +169,9 @@ def botcmd(*args,
                            historize=historize,
                            template=template,
                            syntax=syntax,
-                           flow_only=flow_only)
+                           flow_only=flow_only,
+                           cache_ttl=cache_ttl,
+                           cache_key=cache_key)
 
     return decorator(args[0]) if args else decorator
 
@@ -173,7 +187,9 @@ def re_botcmd(*args,
               matchall: bool = False,
               prefixed: bool = True,
               flow_only: bool = False,
-              re_cmd_name_help: str = None) -> Callable[[BotPlugin, Message, Any], Any]:
+              re_cmd_name_help: str = None,
+              cache_ttl: float = None,
+              cache_key: Callable[[Message, Any], Hashable] = None) -> Callable[[BotPlugin, Message, Any], Any]:
     """
     Decorator for regex-based bot command functions
 
@@ -195,6 +211,10 @@ def re_botcmd(*args,
     :param template: The template to use when using markdown output
     :param flow_only: Flag this command to be available only when it is part of a flow.
                        If True and hidden is None, it will switch hidden to True.
+    :param cache_ttl: Serve the result of the command from a cache for this number of seconds,
+        see :func:`botcmd`. By default the result only depends on the matched text.
+    :param cache_key: A callable taking the message and the match and returning a hashable key
+        identifying the result of the command.
 
     This decorator should be applied to methods of :class:`~errbot.botplugin.BotPlugin`
     classes to turn them into commands that can be given to the bot. These methods are
@@ -224,7 +244,9 @@ def re_botcmd(*args,
                            matchall=matchall,
                            prefixed=prefixed,
                            flow_only=flow_only,
-                           re_cmd_name_help=re_cmd_name_help)
+                           re_cmd_name_help=re_cmd_name_help,
+                           cache_ttl=cache_ttl,
+                           cache_key=cache_key)
 
     return decorator(args[0]) if args else decorator
 
@@ -249,6 +271,9 @@ def botmatch(*args, **kwargs):
     :param template: The template to use when using Markdown output.
     :param flow_only: Flag this command to be available only when it is part of a flow.
                        If True and hidden is None, it will switch hidden to True.
+    :param cache_ttl: Serve the result from a cache for this number of seconds, see :func:`re_botcmd`.
+    :param cache_key: A callable taking the message and the match and returning a hashable key
+        identifying the result.
 
     For example::
 
@@ -270,7 +295,9 @@ def botmatch(*args, **kwargs):
                            template=kwargs.get('template', None),
                            pattern=pattern,
                            flags=kwargs.get('flags', 0),
-                           matchall=kwargs.get('matchall', False))
+                           matchall=kwargs.get('matchall', False),
+                           cache_ttl=kwargs.get('cache_ttl', None),
+                           cache_key=kwargs.get('cache_key', None))
 
     if len(args) == 2:
         return decorator(*args)
@@ -287,6 +314,8 @@ def arg_botcmd(*args,
                template: str = None,
                flow_only: bool = False,
                unpack_args: bool = True,
+               cache_ttl: float = None,
+               cache_key: Callable[[Message, Any], Hashable] = None,
                **kwargs) -> Callable[[BotPlugin, Message, Any], Any]:
     """
     Decorator for argparse-based bot command functions
@@ -312,6 +341,10 @@ def arg_botcmd(*args,
         command individually? If this is True (the default) you must define all arguments in the
         function separately. If this is False you must define a single argument `args` (or
         whichever name you prefer) to receive the result of `ArgumentParser.parse_args()`.
+    :param cache_ttl: Serve the result of the command from a cache for this number of seconds,
+        see :func:`botcmd`.
+    :param cache_key: A callable taking the message and the unparsed arguments and returning a
+        hashable key identifying the result of the command.
 
     This decorator should be applied to methods of :class:`~errbot.botplugin.BotPlugin`
     classes to turn them into commands that can be given to the bot. The methods will be called
@@ -355,8 +388,7 @@ def arg_botcmd(*args,
 
                 # Attempt to sanitize arguments of bad characters
                 try:
-                    sanitizer_re = re.compile('|'.join(re.escape(ii) for ii in ARG_BOTCMD_CHARACTER_REPLACEMENTS))
-                    args = sanitizer_re.sub(lambda mm: ARG_BOTCMD_CHARACTER_REPLACEMENTS[mm.group()], args)
+                    args = ARG_BOTCMD_SANITIZER_RE.sub(lambda mm: ARG_BOTCMD_CHARACTER_REPLACEMENTS[mm.group()], args)
                     args = shlex.split(args)
                     parsed_args = err_command_parser.parse_args(args)
                 except ArgumentParseError as e:
@@ -393,7 +425,9 @@ def arg_botcmd(*args,
                         historize=historize,
                         template=template,
                         flow_only=flow_only,
-                        command_parser=err_command_parser)
+                        command_parser=err_command_parser,
+                        cache_ttl=cache_ttl,
+                        cache_key=cache_key)
         else:
             # the function has already been wrapped
             # alias it so we can update it's arguments below
@@ -409,12 +443,13 @@ def arg_botcmd(*args,
     return decorator
 
 
-def _tag_webhook(func, uri_rule, methods, form_param, raw):
+def _tag_webhook(func, uri_rule, methods, form_param, raw, async_ack=False):
     log.info("webhooks:  Flag to bind %s to %30s" % (uri_rule, getattr(func, '__name__', func)))
     func._err_webhook_uri_rule = uri_rule
     func._err_webhook_methods = methods
     func._err_webhook_form_param = form_param
     func._err_webhook_raw = raw
+    func._err_webhook_async_ack = async_ack
     return func
 
 
@@ -425,7 +460,8 @@ def _uri_from_func(func):
 def webhook(*args,
             methods: Tuple[str] = ('POST', 'GET'),
             form_param: str = None,
-            raw: bool = False) -> Callable[[BotPlugin, Any], str]:
+            raw: bool = False,
+            async_ack: bool = False) -> Callable[[BotPlugin, Any], str]:
     """
     Decorator for webhooks
 
@@ -447,6 +483,11 @@ def webhook(*args,
         passes the raw http request to your method's `payload` parameter.
         The value of payload will be a Bottle
         `BaseRequest <http://bottlepy.org/docs/dev/api.html#bottle.BaseRequest>`_.
+    :param async_ack:
+        When set to true, the request is decoded and answered right away with a 202, your method
+        is called later by a worker of the Webserver plugin and its return value is ignored.
+        If too many requests are waiting, the new ones are answered with a 503.
+        It cannot be combined with raw.
 
     This decorator should be applied to methods of :class:`~errbot.botplugin.BotPlugin`
     classes to turn them into webhooks which can be reached on Err's built-in webserver.
@@ -464,7 +505,8 @@ def webhook(*args,
                                          _uri_from_func(func),
                                          methods=methods,
                                          form_param=form_param,
-                                         raw=raw)
+                                         raw=raw,
+                                         async_ack=async_ack)
 
     if isinstance(args[0], str):  # first param is uri_rule.
         return lambda func: _tag_webhook(func,
@@ -472,12 +514,14 @@ def webhook(*args,
                                          else args[0].rstrip('/'),  # trailing / is also be stripped on incoming.
                                          methods=methods,
                                          form_param=form_param,
-                                         raw=raw)
+                                         raw=raw,
+                                         async_ack=async_ack)
     return _tag_webhook(args[0],  # naked decorator so the first parameter is a function.
                         _uri_from_func(args[0]),
                         methods=methods,
                         form_param=form_param,
-                        raw=raw)
+                        raw=raw,
+                        async_ack=async_ack)
 
 
 def cmdfilter(*args, **kwargs):
@@ -526,18 +570,23 @@ def cmdfilter(*args, **kwargs):
     return lambda func: decorate(func)
 
 
-def botflow(*args, **kwargs):
+def botflow(*args, idle_timeout: float = None, max_lifetime: float = None):
     """
     Decorator for flow of commands.
 
     TODO(gbin): example / docs
+
+    :param idle_timeout: stop the flows idle for more than this number of seconds (default: FLOW_IDLE_TIMEOUT).
+    :param max_lifetime: stop the flows running for more than this number of seconds (default: FLOW_MAX_LIFETIME).
     """
 
     def decorate(func):
         if not hasattr(func, '_err_flow'):  # don't override generated functions
             func._err_flow = True
+            func._err_flow_idle_timeout = idle_timeout
+            func._err_flow_max_lifetime = max_lifetime
         return func
 
     if len(args):
-        return decorate(args[0], **kwargs)
+        return decorate(args[0])
     return lambda func: decorate(func)
@@ -628,6 +628,16 @@ class Stream(io.BufferedReader):
         """ Acknowledge data has been transfered. """
         self._transfered = length
 
+    def getbuffer(self) -> memoryview:
+        """
+            The whole content without copy, only for the incoming transfers spooled to disk
+            (see BOT_STREAM_SPOOL).
+        """
+        getbuffer = getattr(self.raw, 'getbuffer', None)
+        if getbuffer is None:
+            raise io.UnsupportedOperation('This stream is sequential, see BOT_STREAM_SPOOL.')
+        return getbuffer()
+
 
 class Backend(ABC):
     """
@@ -14,6 +14,7 @@ from errbot.backends.base import Message, Room, RoomError, \
     RoomOccupant, ONLINE, Person
 from errbot.core import ErrBot
 from errbot.utils import rate_limited
+from errbot.rendering import CachedConverter
 from errbot.rendering.ansiext import AnsiExtension, enable_format, \
     CharacterTable, NSC
 
@@ -448,6 +449,8 @@ class IRCConnection(SingleServerIRCBot):
         self.bot.disconnect_callback()
 
     def send_stream_request(self, identifier, fsource, name=None, size=None, stream_type=None):
+        if not isinstance(identifier, Person):
+            raise ValueError('DCC transfers can only be sent to a person, not to %s.' % identifier)
         # Creates a new connection
         dcc = self.dcc_listen("raw")
         msg_parts = map(str, (
@@ -623,6 +626,7 @@ class IRCConnection(SingleServerIRCBot):
 
 
 class IRCBackend(ErrBot):
+    BROADCAST_MIN_INTERVAL = 0  # the connection paces the messages with IRC_PRIVATE_RATE and IRC_CHANNEL_RATE
     aclpattern = '{nick}!{user}@{host}'
 
     def __init__(self, config):
@@ -665,7 +669,7 @@ class IRCBackend(ErrBot):
                                   reconnect_on_kick=reconnect_on_kick,
                                   reconnect_on_disconnect=reconnect_on_disconnect,
                                   )
-        self.md = irc_md()
+        self.md = CachedConverter(irc_md())
         config.MESSAGE_SIZE_LIMIT = IRC_MESSAGE_SIZE_LIMIT
 
     def send_message(self, msg):
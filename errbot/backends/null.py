@@ -17,6 +17,7 @@ class ConnectionMock(object):
 
 
 class NullBackend(ErrBot):
+    BROADCAST_MIN_INTERVAL = 0
     conn = ConnectionMock()
     running = True
 
@@ -14,7 +14,9 @@ from markdown.preprocessors import Preprocessor
 from errbot.backends.base import Message, Presence, ONLINE, AWAY, Room, RoomError, RoomDoesNotExistError, \
     UserDoesNotExistError, RoomOccupant, Person, Card, Stream
 from errbot.core import ErrBot
+from errbot.streaming import upload_multipart
 from errbot.utils import split_string_after
+from errbot.rendering import CachedConverter
 from errbot.rendering.ansiext import AnsiExtension, enable_format, IMTEXT_CHRS
 
 log = logging.getLogger(__name__)
@@ -38,6 +40,8 @@ SLACK_CLIENT_CHANNEL_HYPERLINK = re.compile(r'^<#(?P<id>(C|G)[0-9A-Z]+)>$')
 # Empirically determined message size limit.
 SLACK_MESSAGE_LIMIT = 4096
 
+SLACK_API_URL = 'https://slack.com/api/'
+
 USER_IS_BOT_HELPTEXT = (
     "Connected to Slack using a bot account, which cannot manage "
     "channels itself (you must invite the bot to channels instead, "
@@ -263,6 +267,9 @@ class SlackRoomBot(RoomOccupant, SlackBot):
 
 
 class SlackBackend(ErrBot):
+    # the limit of 1 message per second is per channel, the workspace accepts several hundred per minute.
+    BROADCAST_MIN_INTERVAL = 0.2
+    BROADCAST_BURST = 50
 
     @staticmethod
     def _unpickle_identifier(identifier_str):
@@ -298,7 +305,7 @@ class SlackBackend(ErrBot):
             sys.exit(1)
         self.sc = None  # Will be initialized in serve_once
         compact = config.COMPACT_OUTPUT if hasattr(config, 'COMPACT_OUTPUT') else False
-        self.md = slack_markdown_converter(compact)
+        self.md = CachedConverter(slack_markdown_converter(compact))
         self._register_identifiers_pickling()
 
     def api_call(self, method, data=None, raise_errors=True):
@@ -689,17 +696,21 @@ class SlackBackend(ErrBot):
         """Perform upload defined in a stream."""
         try:
             stream.accept()
-            resp = self.api_call('files.upload', data={
-                'channels': stream.identifier.channelid,
-                'filename': stream.name,
-                'file': stream
-            })
+            # streamed from the source, slackclient would load the whole file in memory.
+            status, body = upload_multipart(SLACK_API_URL + 'files.upload',
+                                            {'token': self.token,
+                                             'channels': stream.identifier.channelid,
+                                             'filename': stream.name},
+                                            'file', stream, stream.name, stream.stream_type,
+                                            proxies=self.proxies)
+            resp = json.loads(body.decode('utf-8')) if status == 200 else {}
             if "ok" in resp and resp["ok"]:
                 stream.success()
             else:
                 stream.error()
         except Exception:
             log.exception("Upload of {0} to {1} failed.".format(stream.name, stream.identifier.channelname))
+            stream.error()
 
     def send_stream_request(self, identifier, fsource, name='file', size=None, stream_type=None):
         """Starts a file transfer. For Slack, the size and stream_type are unsupported"""
@@ -1,15 +1,19 @@
+import json
 import logging
 import sys
 
 from errbot.backends.base import RoomError, Identifier, Person, RoomOccupant, Stream, ONLINE, Room
 from errbot.core import ErrBot
-from errbot.rendering import text
+from errbot.rendering import text, CachedConverter
 from errbot.rendering.ansiext import enable_format, TEXT_CHRS
+from errbot.streaming import upload_multipart
 
 log = logging.getLogger(__name__)
 
 TELEGRAM_MESSAGE_SIZE_LIMIT = 1024
 UPDATES_OFFSET_KEY = '_telegram_updates_offset'
+TELEGRAM_API_URL = 'https://api.telegram.org/bot'
+TELEGRAM_UPLOAD_TYPES = ('document', 'photo', 'audio', 'video', 'voice', 'sticker')
 
 try:
     import telegram
@@ -174,6 +178,9 @@ class TelegramMUCOccupant(TelegramPerson, RoomOccupant):
 
 
 class TelegramBackend(ErrBot):
+    BROADCAST_MIN_INTERVAL = 1 / 30  # the bots can send 30 messages per second to different chats
+    BROADCAST_BURST = 30
+
     def __init__(self, config):
         super().__init__(config)
         config.MESSAGE_SIZE_LIMIT = TELEGRAM_MESSAGE_SIZE_LIMIT
@@ -192,7 +199,7 @@ class TelegramBackend(ErrBot):
 
         compact = config.COMPACT_OUTPUT if hasattr(config, 'COMPACT_OUTPUT') else False
         enable_format('text', TEXT_CHRS, borders=not compact)
-        self.md_converter = text()
+        self.md_converter = CachedConverter(text())
 
     def serve_once(self):
         log.info("Initializing connection")
@@ -373,22 +380,28 @@ class TelegramBackend(ErrBot):
         return msg
 
     def _telegram_upload_stream(self, stream, **kwargs):
-        """Perform upload defined in a stream."""
-        msg = None
+        """Perform upload defined in a stream, streamed from the source instead of loaded in memory."""
         try:
             stream.accept()
-            msg = self._telegram_special_message(chat_id=stream.identifier.id,
-                                                 content=stream.raw,
-                                                 msg_type=stream.stream_type,
-                                                 **kwargs)
+            if stream.stream_type not in TELEGRAM_UPLOAD_TYPES:
+                raise ValueError('Expected a valid choice for `msg_type`, '
+                                 'got: {}.'.format(stream.stream_type))
+            fields = {key: str(value) for key, value in kwargs.items()}
+            fields['chat_id'] = stream.identifier.id
+            url = '{0}{1}/send{2}'.format(TELEGRAM_API_URL, self.token, stream.stream_type.capitalize())
+            status, body = upload_multipart(url, fields, stream.stream_type, stream, stream.name)
+            resp = json.loads(body.decode('utf-8')) if body else {}
         except Exception:
             log.exception("Upload of {0} to {1} failed.".format(stream.name,
                                                                 stream.identifier))
+            stream.error()
         else:
-            if msg is None:
-                stream.error()
-            else:
+            if resp.get('ok'):
                 stream.success()
+            else:
+                log.error("Upload of {0} to {1} failed: {2}".format(stream.name, stream.identifier,
+                                                                    resp.get('description', status)))
+                stream.error()
 
     def send_stream_request(self, identifier, fsource, name='file', size=None, stream_type=None):
         """Starts a file transfer.
@@ -410,6 +423,7 @@ class TelegramBackend(ErrBot):
 
         :param stream_type: str, optional
             Type of the stream. Choices: 'document', 'photo', 'audio', 'video', 'sticker', 'location'.
+            A mimetype like 'text/plain' (or None) is sent as a 'document'.
 
             If 'video', a dict is optional as {'content': fsource, 'duration': str}.
             If 'voice', a dict is optional as {'content': fsource, 'duration': str}.
@@ -437,6 +451,8 @@ class TelegramBackend(ErrBot):
             return bool(urlparse(url).scheme)
 
         content, meta = _telegram_metadata(fsource)
+        if stream_type is None or '/' in stream_type:
+            stream_type = 'document'
         if isinstance(content, str):
             if not _is_valid_url(content):
                 raise ValueError("Not valid URL: {}".format(content))
@@ -455,7 +471,7 @@ class TelegramBackend(ErrBot):
             log.debug("Requesting upload of {0} to {1} (size hint: {2}, stream type: {3})".format(name,
                                                                                                   identifier, size,
                                                                                                   stream_type))
-            self.thread_pool.apply_async(self._telegram_upload_stream, (stream,))
+            self.thread_pool.apply_async(self._telegram_upload_stream, (stream,), meta or {})
 
         return stream
 
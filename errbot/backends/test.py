@@ -9,7 +9,7 @@ from threading import Thread
 
 import pytest
 
-from errbot.rendering import text
+from errbot.rendering import text, CachedConverter
 from errbot.backends.base import Message, Room, Person, RoomOccupant, ONLINE
 from errbot.core_plugins.wsview import reset_app
 from errbot.core import ErrBot
@@ -209,6 +209,8 @@ class TestRoom(Room):
 
 
 class TestBackend(ErrBot):
+    BROADCAST_MIN_INTERVAL = 0
+
     def change_presence(self, status: str = ONLINE, message: str = '') -> None:
         pass
 
@@ -223,7 +225,7 @@ class TestBackend(ErrBot):
         self.outgoing_message_queue = Queue()
         self.sender = self.build_identifier(config.BOT_ADMINS[0])  # By default, assume this is the admin talking
         self.reset_rooms()
-        self.md = text()
+        self.md = CachedConverter(text())
 
     def send_message(self, msg):
         log.info("\n\n\nMESSAGE:\n%s\n\n\n", msg.body)
@@ -182,6 +182,8 @@ You start as a **bot admin in a one-on-one conversation** with the bot.
 
 
 class TextBackend(ErrBot):
+    BROADCAST_MIN_INTERVAL = 0
+
     def __init__(self, config):
         super().__init__(config)
         log.debug("Text Backend Init.")
@@ -0,0 +1,228 @@
+"""
+Streaming backups of the storages.
+
+A backup file is MAGIC followed by records and a trailer:
+
+- a record is its type (1 byte), the length of its payload (4 bytes), the payload and the CRC32 of the payload
+  (4 bytes), so a corrupted or truncated backup is detected while reading it.
+- the first record is the header, a json object with the version, the creation time and for an incremental
+  backup the file name of the backup it is based on.
+- then for each namespace, a NAMESPACE record followed by its ENTRY and REMOVED records.
+- the last record is the MANIFEST: a BLAKE2b digest of every value of every namespace at the time of the backup,
+  an incremental backup only writes the entries whose digest changed since its base. The CRC32 of the records
+  only detects corruption, two different values could have the same one.
+- the trailer is the offset of the manifest record (8 bytes), to read it without reading the whole file.
+
+The values are the raw values of the storages, encoded with pickle: unlike repr, it round-trips any value
+a storage can hold.
+"""
+import hashlib
+import json
+import logging
+import os
+import struct
+import zlib
+from glob import glob
+from multiprocessing.pool import ThreadPool
+from time import time
+from typing import BinaryIO, Callable, Dict, Iterable, Iterator, Mapping, Optional, Tuple
+
+from errbot.storage.base import StorageBase
+from errbot.storage.serialization import Codec
+
+log = logging.getLogger(__name__)
+
+MAGIC = b'ERRBACKUP\x01'
+BACKUP_EXTENSION = '.errbak'
+VERSION = 1
+
+HEADER, NAMESPACE, ENTRY, REMOVED, MANIFEST = b'H', b'N', b'E', b'R', b'M'
+
+_RECORD = struct.Struct('>cI')  # type, payload length
+_CRC = struct.Struct('>I')
+_KEY_LENGTH = struct.Struct('>I')
+_TRAILER = struct.Struct('>Q')  # offset of the manifest record
+
+RESTORE_CHUNK_SIZE = 1000  # entries written at once to a storage while restoring
+
+Manifest = Dict[str, Dict[str, str]]  # namespace -> key -> digest of the encoded value
+
+_codec = Codec('pickle')
+
+
+class BackupError(Exception):
+    pass
+
+
+def _write_record(f: BinaryIO, record_type: bytes, payload: bytes) -> None:
+    f.write(_RECORD.pack(record_type, len(payload)))
+    f.write(payload)
+    f.write(_CRC.pack(zlib.crc32(payload)))
+
+
+def _read_record(f: BinaryIO) -> Tuple[bytes, bytes]:
+    head = f.read(_RECORD.size)
+    if len(head) < _RECORD.size:
+        raise BackupError('The backup %s is truncated.' % f.name)
+    record_type, length = _RECORD.unpack(head)
+    payload = f.read(length)
+    crc = f.read(_CRC.size)
+    if len(crc) < _CRC.size:
+        raise BackupError('The backup %s is truncated.' % f.name)
+    if _CRC.unpack(crc)[0] != zlib.crc32(payload):
+        raise BackupError('The backup %s is corrupted at offset %d.' % (f.name, f.tell() - length - _CRC.size))
+    return record_type, payload
+
+
+def _open(filename: str) -> BinaryIO:
+    f = open(filename, 'rb')
+    if f.read(len(MAGIC)) != MAGIC:
+        f.close()
+        raise BackupError('%s is not a backup.' % filename)
+    return f
+
+
+def is_backup(filename: str) -> bool:
+    """
+    :return: True if the file is in the backup format, False for example for a backup.py of an older version.
+    """
+    with open(filename, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def latest_backup(directory: str) -> Optional[str]:
+    """
+    :return: the most recent backup in directory, or None.
+    """
+    backups = sorted(glob(os.path.join(directory, 'backup-*' + BACKUP_EXTENSION)))
+    return backups[-1] if backups else None
+
+
+def read_header(filename: str) -> dict:
+    with _open(filename) as f:
+        record_type, payload = _read_record(f)
+    if record_type != HEADER:
+        raise BackupError('The backup %s has no header.' % filename)
+    return json.loads(payload.decode())
+
+
+def read_manifest(filename: str) -> Manifest:
+    """
+    :return: the digest of every value at the time of the backup, read without going through the entries.
+    """
+    with _open(filename) as f:
+        f.seek(-_TRAILER.size, os.SEEK_END)
+        f.seek(_TRAILER.unpack(f.read(_TRAILER.size))[0])
+        record_type, payload = _read_record(f)
+    if record_type != MANIFEST:
+        raise BackupError('The backup %s has no manifest.' % filename)
+    return json.loads(payload.decode())
+
+
+def write_backup(filename: str, namespaces: Mapping[str, StorageBase], base: str = None) -> int:
+    """
+    Write a backup of the given storages, streaming their entries.
+
+    :param filename: the file to write.
+    :param namespaces: the storages to back up by namespace.
+    :param base: the previous backup, to only write what changed since then. It needs to be kept
+                 in the same directory to restore this one.
+    :return: the number of entries and removals written.
+    """
+    previous = read_manifest(base) if base else {}
+    manifest = dict(previous)  # the namespaces not backed up this time are still in the base
+    written = 0
+    tmp = filename + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(MAGIC)
+        header = {'version': VERSION, 'created': time(), 'base': os.path.basename(base) if base else None}
+        _write_record(f, HEADER, json.dumps(header).encode())
+        for namespace, storage in namespaces.items():
+            _write_record(f, NAMESPACE, namespace.encode())
+            before = previous.get(namespace, {})
+            digests = {}
+            for key, value in storage.items():
+                encoded = _codec.encode(value)
+                digests[key] = digest = hashlib.blake2b(encoded, digest_size=16).hexdigest()
+                if before.get(key) != digest:
+                    _write_record(f, ENTRY, _KEY_LENGTH.pack(len(key.encode())) + key.encode() + encoded)
+                    written += 1
+            for key in before.keys() - digests.keys():
+                _write_record(f, REMOVED, key.encode())
+                written += 1
+            manifest[namespace] = digests
+        offset = f.tell()
+        _write_record(f, MANIFEST, json.dumps(manifest).encode())
+        f.write(_TRAILER.pack(offset))
+    os.replace(tmp, filename)  # a failed backup never replaces a good one
+    return written
+
+
+def _read_namespaces(f: BinaryIO) -> Iterator[Tuple[str, bytes, bytes]]:
+    """ Yields (namespace, record type, payload) for the entries and removals of the backup. """
+    _read_record(f)  # the header
+    namespace = None
+    while True:
+        record_type, payload = _read_record(f)
+        if record_type == MANIFEST:
+            return
+        if record_type == NAMESPACE:
+            namespace = payload.decode()
+        elif record_type in (ENTRY, REMOVED) and namespace is not None:
+            yield namespace, record_type, payload
+        else:
+            raise BackupError('Unexpected record %r in the backup %s.' % (record_type, f.name))
+
+
+def _decode_entry(payload: bytes) -> Tuple[str, object]:
+    key_length = _KEY_LENGTH.unpack_from(payload)[0]
+    key_end = _KEY_LENGTH.size + key_length
+    return payload[_KEY_LENGTH.size:key_end].decode(), _codec.decode(memoryview(payload)[key_end:])
+
+
+def _apply(storage: StorageBase, entries: Dict[str, object], removed: Iterable[str]) -> None:
+    storage.remove_many(removed)
+    storage.set_many(entries)
+
+
+def restore_backup(filename: str, storage: Callable[[str], StorageBase], poolsize: int = 4) -> int:
+    """
+    Restore a backup, after the backups it is based on. The entries are decoded while the previous chunks
+    are written to the storages in parallel.
+
+    :param filename: the backup to restore.
+    :param storage: gives the storage to restore a namespace into.
+    :param poolsize: the number of chunks written at the same time.
+    :return: the number of entries and removals restored.
+    """
+    base = read_header(filename)['base']
+    restored = restore_backup(os.path.join(os.path.dirname(filename), base), storage, poolsize) if base else 0
+    log.info('Restoring %s.', filename)
+    pool = ThreadPool(poolsize)
+    try:
+        pending = []
+        chunks = {}  # namespace -> (entries, removed)
+
+        def send(namespace):
+            entries, removed = chunks.pop(namespace)
+            pending.append(pool.apply_async(_apply, (storage(namespace), entries, removed)))
+
+        with _open(filename) as f:
+            for namespace, record_type, payload in _read_namespaces(f):
+                entries, removed = chunks.setdefault(namespace, ({}, []))
+                if record_type == ENTRY:
+                    key, value = _decode_entry(payload)
+                    entries[key] = value
+                else:
+                    removed.append(payload.decode())
+                restored += 1
+                if len(entries) + len(removed) >= RESTORE_CHUNK_SIZE:
+                    send(namespace)
+        for namespace in list(chunks):
+            send(namespace)
+        for result in pending:
+            result.get()  # raises the errors of the workers
+    finally:
+        pool.close()
+        pool.join()
+    return restored
@@ -2,12 +2,15 @@ from os import path, makedirs
 import importlib
 import logging
 import sys
+from types import SimpleNamespace
 
+from errbot.backup import is_backup, restore_backup
 from errbot.core import ErrBot
 from errbot.plugin_manager import BotPluginManager
 from errbot.repo_manager import BotRepoManager
 from errbot.backend_plugin_manager import BackendPluginManager
 from errbot.storage.base import StoragePluginBase
+from errbot.storage.caching import CachingStoragePlugin
 from errbot.utils import PLUGINS_SUBDIR
 from errbot.logs import format_logs
 
@@ -45,6 +48,8 @@ def bot_config_defaults(config):
         config.DIVERT_TO_THREAD = ()
     if not hasattr(config, 'MESSAGE_SIZE_LIMIT'):
         config.MESSAGE_SIZE_LIMIT = 10000  # Corresponds with what HipChat accepts
+    if not hasattr(config, 'MESSAGE_UPLOAD_THRESHOLD'):
+        config.MESSAGE_UPLOAD_THRESHOLD = None
     if not hasattr(config, 'GROUPCHAT_NICK_PREFIXED'):
         config.GROUPCHAT_NICK_PREFIXED = False
     if not hasattr(config, 'AUTOINSTALL_DEPS'):
@@ -55,6 +60,34 @@ def bot_config_defaults(config):
         config.BOT_ASYNC = True
     if not hasattr(config, 'BOT_ASYNC_POOLSIZE'):
         config.BOT_ASYNC_POOLSIZE = 10
+    if not hasattr(config, 'BOT_BROADCAST_POOLSIZE'):
+        config.BOT_BROADCAST_POOLSIZE = 5
+    if not hasattr(config, 'BOT_BROADCAST_MIN_INTERVAL'):
+        config.BOT_BROADCAST_MIN_INTERVAL = None
+    if not hasattr(config, 'BOT_BROADCAST_BURST'):
+        config.BOT_BROADCAST_BURST = None
+    if not hasattr(config, 'BOT_COMMAND_CACHE_SIZE'):
+        config.BOT_COMMAND_CACHE_SIZE = 1024
+    if not hasattr(config, 'BOT_STREAM_SPOOL'):
+        config.BOT_STREAM_SPOOL = False
+    if not hasattr(config, 'BOT_POLLER_POOLSIZE'):
+        config.BOT_POLLER_POOLSIZE = 10
+    if not hasattr(config, 'STORAGE_COMPACTION_INTERVAL'):
+        config.STORAGE_COMPACTION_INTERVAL = 3600
+    if not hasattr(config, 'FLOW_EXECUTOR_THREADS'):
+        config.FLOW_EXECUTOR_THREADS = 5
+    if not hasattr(config, 'FLOW_BRANCH_THREADS'):
+        config.FLOW_BRANCH_THREADS = 5
+    if not hasattr(config, 'FLOW_IDLE_TIMEOUT'):
+        config.FLOW_IDLE_TIMEOUT = None
+    if not hasattr(config, 'FLOW_MAX_LIFETIME'):
+        config.FLOW_MAX_LIFETIME = None
+    if not hasattr(config, 'FLOW_MAX_IN_FLIGHT'):
+        config.FLOW_MAX_IN_FLIGHT = None
+    if not hasattr(config, 'FLOW_MAX_IN_FLIGHT_PER_USER'):
+        config.FLOW_MAX_IN_FLIGHT_PER_USER = None
+    if not hasattr(config, 'FLOW_SPILL_AFTER'):
+        config.FLOW_SPILL_AFTER = None
     if not hasattr(config, 'CHATROOM_PRESENCE'):
         config.CHATROOM_PRESENCE = ()
     if not hasattr(config, 'CHATROOM_RELAY'):
@@ -177,32 +210,74 @@ def setup_bot(backend_name: str, logger, config, restore=None) -> ErrBot:
 
 
 def restore_bot_from_backup(backup_filename, *, bot, log):
-    """Restores the given bot by executing the 'backup' script.
+    """Restores the given bot from a backup made with !backup, then installs its plugins.
 
-    The backup file is a python script which manually execute a series of commands on the bot to restore it
-    to its previous state.
+    The backup.py scripts of the previous versions are executed: they manually execute a series of commands
+    on the bot to restore it to its previous state.
 
-    :param backup_filename: the full path to the backup script.
+    :param backup_filename: the full path to the backup.
     :param bot: the bot instance to restore
     :param log: logger to use during the restoration process
     """
-    with open(backup_filename) as f:
-        exec(f.read(), {'log': log, 'bot': bot})
+    if not is_backup(backup_filename):
+        log.warning('%s is an old backup script, executing it.' % backup_filename)
+        with open(backup_filename) as f:
+            exec(f.read(), {'log': log, 'bot': bot})
+        bot.close_storage()
+        return
+
+    # the namespaces already open are restored through their storage, the others are opened for the restore.
+    stores = {store.namespace: store._store for store in (bot, bot.repo_manager, bot.plugin_manager)}
+    opened = {}
+
+    def storage(namespace):
+        if namespace in stores:
+            return stores[namespace]
+        if namespace not in opened:
+            opened[namespace] = bot.storage_plugin.open(namespace)
+        return opened[namespace]
+
+    try:
+        restored = restore_backup(backup_filename, storage)
+    finally:
+        for namespace_storage in opened.values():
+            namespace_storage.close()
+    log.info('Restored %d entries.' % restored)
+
+    if 'installed_repos' in bot.repo_manager:
+        log.info('Installing plugins.')
+        for repo in bot.repo_manager['installed_repos']:
+            try:
+                log.info('Installed %s in %s.' % (repo, bot.repo_manager.install_repo(repo)))
+            except Exception:
+                log.exception('Failed to install %s.' % repo)
     bot.close_storage()
+    bot.storage_plugin.flush()
 
 
-def get_storage_plugin(config):
+def get_storage_plugin(config, storage_name=None, storage_config=None):
     """
     Find and load the storage plugin
     :param config: the bot configuration.
+    :param storage_name: the name of the storage plugin, config.STORAGE by default.
+    :param storage_config: the STORAGE_CONFIG of the plugin, config.STORAGE_CONFIG by default.
     :return: the storage plugin
     """
-    storage_name = getattr(config, 'STORAGE', 'Shelf')
+    storage_name = storage_name or getattr(config, 'STORAGE', 'Shelf')
+    if storage_config is not None:
+        config = SimpleNamespace(**{name: getattr(config, name) for name in dir(config) if name.isupper()})
+        config.STORAGE_CONFIG = storage_config
     extra_storage_plugins_dir = getattr(config, 'BOT_EXTRA_STORAGE_PLUGINS_DIR', None)
     spm = BackendPluginManager(config, 'errbot.storage', storage_name, StoragePluginBase,
                                CORE_STORAGE, extra_storage_plugins_dir)
     log.info('Found Storage plugin: %s.' % spm.plugin_info.name)
-    return spm.load_plugin()
+    storage_plugin = spm.load_plugin()
+    cache_size = getattr(config, 'STORAGE_CACHE_SIZE', 0)
+    if cache_size:
+        flush_interval = getattr(config, 'STORAGE_FLUSH_INTERVAL', 0)
+        log.info('Caching %d entries per storage, writes flushed every %ss.' % (cache_size, flush_interval))
+        storage_plugin = CachingStoragePlugin(storage_plugin, cache_size, flush_interval)
+    return storage_plugin
 
 
 def bootstrap(bot_class, logger, config, restore=None):
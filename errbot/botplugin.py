@@ -1,8 +1,7 @@
 import logging
 import shlex
-from threading import Timer, current_thread
 from types import ModuleType
-from typing import Tuple, Callable, Mapping, Sequence
+from typing import Tuple, Callable, Mapping, Sequence, List, Optional
 from io import IOBase
 import re
 
@@ -113,8 +112,6 @@ class BotPluginBase(StoreMixin):
 
     def __init__(self, bot, name=None):
         self.is_activated = False
-        self.current_pollers = []
-        self.current_timers = []
         self.dependencies = []
         self._dynamic_plugins = {}
         self.log = logging.getLogger("errbot.plugins.%s" % name)
@@ -182,11 +179,8 @@ class BotPluginBase(StoreMixin):
         """
             Override if you want to do something at tear down phase (don't forget to super(Gnagna, self).deactivate())
         """
-        if self.current_pollers:
+        if self._bot.poller_scheduler.stop_all(self):
             log.debug('You still have active pollers at deactivation stage, I cleaned them up for you.')
-            self.current_pollers = []
-            for timer in self.current_timers:
-                timer.cancel()
 
         try:
             self.close_storage()
@@ -205,7 +199,9 @@ class BotPluginBase(StoreMixin):
                      method: Callable[..., None],
                      times: int = None,
                      args: Tuple = None,
-                     kwargs: Mapping = None):
+                     kwargs: Mapping = None,
+                     jitter: float = 0,
+                     overlap: str = 'skip'):
         """ Starts a poller that will be called at a regular interval
 
         :param interval: interval in seconds
@@ -215,20 +211,17 @@ class BotPluginBase(StoreMixin):
             causes the polling to happen indefinitely)
         :param args: args for the targetted method
         :param kwargs: kwargs for the targetting method
+        :param jitter: maximum random delay in seconds added to each call
+        :param overlap: 'skip', 'queue' or 'allow' a call due while the previous one is still running
         """
         if not kwargs:
             kwargs = {}
         if not args:
-            args = []
+            args = ()
 
         log.debug('Programming the polling of %s every %i seconds with args %s and kwargs %s' % (
             method.__name__, interval, str(args), str(kwargs)))
-        # noinspection PyBroadException
-        try:
-            self.current_pollers.append((method, args, kwargs))
-            self.program_next_poll(interval, method, times, args, kwargs)
-        except Exception:
-            log.exception('failed')
+        self._bot.poller_scheduler.start(self, interval, method, times, args, kwargs, jitter, overlap)
 
     def stop_poller(self,
                     method: Callable[..., None],
@@ -237,49 +230,17 @@ class BotPluginBase(StoreMixin):
         if not kwargs:
             kwargs = {}
         if not args:
-            args = []
+            args = ()
         log.debug('Stop polling of %s with args %s and kwargs %s' % (method, args, kwargs))
-        self.current_pollers.remove((method, args, kwargs))
-
-    def program_next_poll(self,
-                          interval: float,
-                          method: Callable[..., None],
-                          times: int = None,
-                          args: Tuple = None,
-                          kwargs: Mapping = None):
-        if times is not None and times <= 0:
-            return
-
-        t = Timer(interval=interval, function=self.poller,
-                  kwargs={'interval': interval, 'method': method,
-                          'times': times, 'args': args, 'kwargs': kwargs})
-        self.current_timers.append(t)  # save the timer to be able to kill it
-        t.setName('Poller thread for %s' % type(method.__self__).__name__)
-        t.setDaemon(True)  # so it is not locking on exit
-        t.start()
-
-    def poller(self,
-               interval: float,
-               method: Callable[..., None],
-               times: int = None,
-               args: Tuple = None,
-               kwargs: Mapping = None):
-        previous_timer = current_thread()
-        if previous_timer in self.current_timers:
-            log.debug('Previous timer found and removed')
-            self.current_timers.remove(previous_timer)
-
-        if (method, args, kwargs) in self.current_pollers:
-            # noinspection PyBroadException
-            try:
-                method(*args, **kwargs)
-            except Exception:
-                log.exception('A poller crashed')
-
-            if times is not None:
-                times -= 1
-
-            self.program_next_poll(interval, method, times, args, kwargs)
+        if not self._bot.poller_scheduler.stop(self, method, args, kwargs):
+            raise ValueError('No poller found for %s with args %s and kwargs %s' % (method, args, kwargs))
+
+    @property
+    def current_pollers(self) -> List[Tuple[Callable[..., None], Tuple, Mapping]]:
+        """
+        The (method, args, kwargs) of the running pollers of this plugin.
+        """
+        return [(poller.method, poller.args, poller.kwargs) for poller in self._bot.poller_scheduler.pollers(self)]
 
     def create_dynamic_plugin(self, name: str, commands: Tuple[Command], doc: str = ''):
         """
@@ -528,6 +489,24 @@ class BotPlugin(BotPluginBase):
             raise ValueError("identifier needs to be of type Identifier, the old string behavior is not supported")
         return self._bot.send(identifier, text, in_reply_to, groupchat_nick_reply)
 
+    def broadcast(self,
+                  identifiers: Sequence[Identifier],
+                  text: str) -> List[Tuple[Identifier, Optional[Exception]]]:
+        """
+            Send the same message to many rooms or users.
+
+            The message is rendered once and sent concurrently to all the recipients,
+            callback_botmessage is triggered only once for the whole broadcast.
+            The messages are paced to the rate limits of the chat service (see BOT_BROADCAST_BURST and
+            BOT_BROADCAST_MIN_INTERVAL in config.py), this returns once all of them are sent.
+
+            :param identifiers: the Identifiers of the users or rooms to message.
+            :param text: markdown formatted text to send.
+            :return: a list of (identifier, error) tuples in the same order as identifiers,
+                     error is None if the message has been sent.
+        """
+        return self._bot.broadcast(identifiers, text)
+
     def send_card(self,
                   body: str = '',
                   to: Identifier = None,
@@ -648,13 +627,19 @@ class BotPlugin(BotPluginBase):
                      method: Callable[..., None],
                      times: int = None,
                      args: Tuple = None,
-                     kwargs: Mapping = None):
+                     kwargs: Mapping = None,
+                     jitter: float = 0,
+                     overlap: str = 'skip'):
         """
             Start to poll a method at specific interval in seconds.
 
             Note: it will call the method with the initial interval delay for
             the first time
 
+            The pollers of all the plugins are called at a fixed rate from a shared
+            pool of BOT_POLLER_POOLSIZE threads. By default, a poller still running
+            when it is due again is skipped this time, see overlap.
+
             Also, you can program
             for example : self.program_poller(self, 30, fetch_stuff)
             where you have def fetch_stuff(self) in your plugin
@@ -666,9 +651,15 @@ class BotPlugin(BotPluginBase):
                 which causes the polling to happen indefinitely)
             :param args: args for the targetted method
             :param kwargs: kwargs for the targetting method
+            :param jitter: maximum random delay in seconds added to each call,
+                           to spread the pollers started at the same time.
+            :param overlap: what to do when the poller is due while its previous
+                            call is still running: 'skip' this call, 'queue' it
+                            to run right after (at most one call waits) or
+                            'allow' it to run concurrently.
 
         """
-        super().start_poller(interval, method, times, args, kwargs)
+        super().start_poller(interval, method, times, args, kwargs, jitter, overlap)
 
     def stop_poller(self,
                     method: Callable[..., None],
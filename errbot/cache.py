@@ -0,0 +1,115 @@
+import logging
+from collections import OrderedDict
+from threading import Event, Lock
+from time import monotonic
+from typing import Any, Callable, Dict, Hashable
+
+log = logging.getLogger(__name__)
+
+
+class _Call(object):
+    """ An execution in progress other threads can wait on.
+    """
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = Event()
+        self.result = None
+        self.error = None
+
+    def wait(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class ResultCache(object):
+    """ A bounded, thread safe, in memory cache for command results.
+
+    Entries expire after their ttl and the least recently used ones are evicted when the cache is full.
+    Concurrent computations of the same key are collapsed into one: the first caller executes it and
+    the others wait for its result.
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        """
+        :param maxsize: the maximum number of results kept at any given time.
+        """
+        self.maxsize = maxsize
+        self._lock = Lock()
+        self._entries = OrderedDict()  # (name, key) -> (expiry, result)
+        self._in_flight = {}  # (name, key) -> _Call
+        self._stats = {}  # name -> {'hits': int, 'misses': int}
+
+    def _count(self, name: str, counter: str):
+        self._stats.setdefault(name, {'hits': 0, 'misses': 0})[counter] += 1
+
+    def get_or_compute(self, name: str, key: Hashable, ttl: float, compute: Callable[[], Any]) -> Any:
+        """
+        Returns the cached result for this key or compute it.
+
+        :param name: the name of the cache user (for example a command), used for the statistics.
+        :param key: what identifies the result for this user.
+        :param ttl: how long in seconds the computed result should be served from the cache.
+        :param compute: the function computing the result. If it raises, nothing is cached and
+                        the exception is raised for every caller waiting on this computation.
+        """
+        full_key = (name, key)
+        with self._lock:
+            entry = self._entries.get(full_key)
+            if entry is not None:
+                expiry, result = entry
+                if expiry > monotonic():
+                    self._entries.move_to_end(full_key)
+                    self._count(name, 'hits')
+                    return result
+                del self._entries[full_key]
+            call = self._in_flight.get(full_key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._in_flight[full_key] = call
+                self._count(name, 'misses')
+            else:
+                self._count(name, 'hits')
+
+        if not leader:
+            log.debug('Waiting on the in flight execution of %s %s.', name, key)
+            return call.wait()
+
+        try:
+            call.result = compute()
+        except Exception as e:
+            call.error = e
+            raise
+        else:
+            with self._lock:
+                self._entries[full_key] = (monotonic() + ttl, call.result)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+            return call.result
+        finally:
+            with self._lock:
+                del self._in_flight[full_key]
+            call.done.set()
+
+    def invalidate(self, name: str):
+        """
+        Drops all the cached results of the given user.
+
+        :param name: the name given to get_or_compute.
+        """
+        with self._lock:
+            for full_key in [full_key for full_key in self._entries if full_key[0] == name]:
+                del self._entries[full_key]
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """
+        :return: the number of hits and misses per name, for example {'weather': {'hits': 3, 'misses': 1}}.
+        """
+        with self._lock:
+            return {name: dict(counters) for name, counters in self._stats.items()}
+
+    def __len__(self):
+        return len(self._entries)
@@ -91,6 +91,16 @@ def _read_dict():
     return new_dict
 
 
+def _dict_argument(value):
+    try:
+        new_dict = ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        new_dict = None
+    if not isinstance(new_dict, dict):
+        raise argparse.ArgumentTypeError('a dictionary written in python is needed, got %r' % value)
+    return new_dict
+
+
 def main():
 
     execution_dir = getcwd()
@@ -106,7 +116,8 @@ def main():
     mode_selection = parser.add_mutually_exclusive_group()
     mode_selection.add_argument('-v', '--version', action='version', version='Errbot version {}'.format(VERSION))
     mode_selection.add_argument('-r', '--restore', nargs='?', default=None, const='default',
-                                help='restore a bot from backup.py (default: backup.py from the bot data directory)')
+                                help='restore a bot from a backup made with !backup '
+                                     '(default: the latest backup in the bot data directory)')
     mode_selection.add_argument('-l', '--list', action='store_true', help='list all available backends')
     mode_selection.add_argument('--new-plugin', nargs='?', default=None, const='current_dir',
                                 help='create a new plugin in the specified directory')
@@ -127,6 +138,20 @@ def main():
     mode_selection.add_argument('--storage-get', nargs=1, help='Dump the given storage namespace in a '
                                                                'format compatible for --storage-set and '
                                                                '--storage-merge.')
+    mode_selection.add_argument('--storage-export', nargs='*', metavar='NAMESPACE',
+                                help='Stream the given storage namespaces (all of them by default) to stdout '
+                                     'in the format given by --storage-format.')
+    mode_selection.add_argument('--storage-import', action='store_true',
+                                help='Set the entries of an export read from stdin, in the format given by '
+                                     '--storage-format.')
+    mode_selection.add_argument('--storage-migrate', nargs=2, metavar=('FROM', 'TO'),
+                                help='Copy all the storage namespaces from a storage plugin to another one, '
+                                     'for example Shelf Sqlite.')
+    parser.add_argument('--storage-target-config', type=_dict_argument, metavar='DICT',
+                        help='The STORAGE_CONFIG of the TO storage of --storage-migrate, as a python dictionary '
+                             'expression (default: STORAGE_CONFIG, the same as FROM).')
+    parser.add_argument('--storage-format', choices=('jsonl', 'msgpack'), default='jsonl',
+                        help='The format of --storage-export and --storage-import (default: jsonl).')
 
     mode_selection.add_argument('-T', '--text', dest="backend", action='store_const', const="Text",
                                 help='force local text backend')
@@ -227,10 +252,54 @@ def main():
 
     if args['storage_get']:
         def p(sdm):
-            print(repr(dict(sdm)))
+            # one entry at a time, it is still a python dictionary expression.
+            print('{')
+            for key, value in sdm.items():
+                print('    %r: %r,' % (key, value))
+            print('}')
         err_value = storage_action(args['storage_get'][0], p)
         sys.exit(err_value)
 
+    def progress(namespace, count):
+        print('%s: %d entries' % (namespace, count), file=sys.stderr)
+
+    def storage_stream_action(fn):
+        from errbot.bootstrap import get_storage_plugin
+        from errbot.storage import export
+        try:
+            count = fn(export, get_storage_plugin)
+            print('%d entries in total.' % count, file=sys.stderr)
+            return 0
+        except Exception as e:
+            print(str(e), file=sys.stderr)
+            return -3
+
+    if args['storage_export'] is not None:
+        def export_namespaces(export, get_storage_plugin):
+            storage_plugin = get_storage_plugin(config)
+            namespaces = args['storage_export'] or storage_plugin.namespaces()
+            return export.export_storage(storage_plugin, namespaces, sys.stdout.buffer, args['storage_format'],
+                                         progress)
+        sys.exit(storage_stream_action(export_namespaces))
+
+    if args['storage_import']:
+        def import_namespaces(export, get_storage_plugin):
+            return export.import_storage(get_storage_plugin(config), sys.stdin.buffer, args['storage_format'],
+                                         progress)
+        sys.exit(storage_stream_action(import_namespaces))
+
+    if args['storage_migrate']:
+        def migrate(export, get_storage_plugin):
+            source_name, target_name = args['storage_migrate']
+            target_config = args['storage_target_config']
+            if target_config is None and source_name == target_name:
+                raise ValueError('%s would be copied onto itself, give the STORAGE_CONFIG of the target with '
+                                 '--storage-target-config.' % source_name)
+            source = get_storage_plugin(config, source_name)
+            target = get_storage_plugin(config, target_name, target_config)
+            return export.migrate_storage(source, target, progress=progress)
+        sys.exit(storage_stream_action(migrate))
+
     if args['storage_set']:
         def replace(sdm):
             new_dict = _read_dict()  # fail early and don't erase the storage if the input is invalid.
@@ -290,9 +359,10 @@ def main():
             log.exception('Failed to daemonize the process')
         exit(0)
     from errbot.bootstrap import bootstrap
+    from errbot.backup import latest_backup
     restore = args['restore']
-    if restore == 'default':  # restore with no argument, get the default location
-        restore = path.join(config.BOT_DATA_DIR, 'backup.py')
+    if restore == 'default':  # restore with no argument, get the latest backup or the backup.py of older versions
+        restore = latest_backup(config.BOT_DATA_DIR) or path.join(config.BOT_DATA_DIR, 'backup.py')
 
     bootstrap(backend, root_logger, config, restore)
     log.info('Process exiting')
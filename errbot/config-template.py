@@ -56,11 +56,39 @@ import logging
 
 # Filesystem:
 # 'Shelf'         - python shelf (default)
+# 'Sqlite'        - all the namespaces in one SQLite database, safe to use with BOT_ASYNC.
+#                   STORAGE_CONFIG = {'file': '/var/lib/err/storage.sqlite', 'timeout': 5}
+# 'LMDB'          - all the namespaces in one memory-mapped LMDB environment, fast reads
+#                   that several bot processes can share (pip install errbot[lmdb]).
+#                   STORAGE_CONFIG = {'path': '/var/lib/err/storage.lmdb', 'map_size': 1 << 30}
 
 # STORAGE = 'Shelf'  # defaults to filestorage (python shelf).
 
+# The filesystem storages encode the values with a codec set in STORAGE_CONFIG:
+# the serializer is 'pickle' (default, any python object), 'json' or 'msgpack'
+# (portable, basic types only, msgpack needs to be installed) and the values bigger
+# than compression_threshold bytes can be compressed with 'zlib' or 'zstd' (needs
+# zstandard). Every value records how it was encoded, so you can change the codec
+# at any time: the existing values stay readable and are converted as they are written.
+# STORAGE_CONFIG = {
+#     'codec': {'serializer': 'pickle', 'compression': 'zlib', 'compression_threshold': 1024},
+#     'namespace_codecs': {'core': {'serializer': 'pickle', 'compression': None}},  # per namespace overrides
+# }
+
 # BOT_EXTRA_STORAGE_PLUGINS_DIR = None  # extra search path to find custom storage plugins
 
+# Keep up to STORAGE_CACHE_SIZE decoded values per namespace in memory on top of
+# the selected storage (0 disables the cache).
+# With STORAGE_FLUSH_INTERVAL > 0, the writes are also kept in memory and written
+# in batches every STORAGE_FLUSH_INTERVAL seconds: it is the window of data you can
+# lose if the bot crashes. A clean shutdown always writes everything.
+# STORAGE_CACHE_SIZE = 0
+# STORAGE_FLUSH_INTERVAL = 0
+
+# Every STORAGE_COMPACTION_INTERVAL seconds, a background thread removes the keys
+# plugins have set with set_with_ttl once they have expired (0 disables it).
+# STORAGE_COMPACTION_INTERVAL = 3600
+
 # The location where all of Err's data should be stored. Make sure to set
 # this to a directory that is writable by the user running the bot.
 BOT_DATA_DIR = '/var/lib/err'
@@ -146,6 +174,53 @@ SENTRY_LOGLEVEL = BOT_LOG_LEVEL
 # Size of the thread pool for the asynchronous mode.
 # BOT_ASYNC_POOLSIZE = 10
 
+# Number of messages sent in parallel by a broadcast (self.broadcast from a plugin).
+# To stay under the rate limits of your chat service, a broadcast sends
+# BOT_BROADCAST_BURST messages at once, then one every BOT_BROADCAST_MIN_INTERVAL
+# seconds, and the plugin waits until all of them are sent. By default (None) they
+# are set by the backend: 20 at once then 1 per second, 5 per second on Slack, 30
+# per second on Telegram, and no delay on IRC, which has its own rate limits
+# (IRC_PRIVATE_RATE and IRC_CHANNEL_RATE), and on the local backends.
+# BOT_BROADCAST_POOLSIZE = 5
+# BOT_BROADCAST_MIN_INTERVAL = None
+# BOT_BROADCAST_BURST = None
+
+# Maximum number of results kept in memory for the commands declared with
+# a cache_ttl (for example @botcmd(cache_ttl=60)).
+# BOT_COMMAND_CACHE_SIZE = 1024
+
+# Receive the incoming file transfers in a temporary file under BOT_DATA_DIR
+# before calling callback_stream: the plugins then get seekable streams
+# sharing a memory map of the file (see Stream.getbuffer) instead of reading
+# the transfer as it arrives.
+# BOT_STREAM_SPOOL = False
+
+# Number of plugin pollers (self.start_poller from a plugin) that can run at
+# the same time.
+# BOT_POLLER_POOLSIZE = 10
+
+# Number of flows executing their automatic steps at the same time, and
+# number of steps executed at the same time when the predicates of several
+# steps of a flow are true.
+# FLOW_EXECUTOR_THREADS = 5
+# FLOW_BRANCH_THREADS = 5
+
+# Flows (conversations) left unfinished are stopped after FLOW_IDLE_TIMEOUT
+# seconds without progress or FLOW_MAX_LIFETIME seconds after they started
+# (None to keep them, a flow can override these with
+# @botflow(idle_timeout=..., max_lifetime=...)).
+# FLOW_IDLE_TIMEOUT = None
+# FLOW_MAX_LIFETIME = None
+
+# Maximum number of flows running at the same time, overall and per user
+# (or per room for the flows bound to a room). None for no limit.
+# FLOW_MAX_IN_FLIGHT = None
+# FLOW_MAX_IN_FLIGHT_PER_USER = None
+
+# The context of a flow idle for more than FLOW_SPILL_AFTER seconds is moved
+# to the storage until the flow continues (None to keep them all in memory).
+# FLOW_SPILL_AFTER = None
+
 ##########################################################################
 # Account and chatroom (MUC) configuration                               #
 ##########################################################################
@@ -333,6 +408,13 @@ REVERSE_CHATROOM_RELAY = {}
 # shorter messages that do fit.
 #MESSAGE_SIZE_LIMIT = 10000
 
+# Replies longer than this number of characters are sent once as a file
+# (on the backends supporting file transfers, for example Slack, Telegram and
+# IRC through DCC) with a short summary in the chat instead of being broken up
+# in many messages. Backends without file transfers keep splitting the replies.
+# None disables this behavior.
+#MESSAGE_UPLOAD_THRESHOLD = None
+
 # XMPP TLS certificate verification. In order to validate offered certificates,
 # you must supply a path to a file containing certificate authorities. By
 # default, "/etc/ssl/certs/ca-certificates.crt" is used, which on most Linux
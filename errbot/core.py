@@ -19,7 +19,10 @@ import logging
 import re
 import traceback
 from datetime import datetime
-from threading import RLock
+from io import BytesIO
+from threading import Event, RLock, Lock, Thread, local
+from time import monotonic, sleep
+from typing import Any, Callable, Hashable, NamedTuple, Optional, Pattern
 
 import collections
 from multiprocessing.pool import ThreadPool
@@ -27,14 +30,62 @@ from multiprocessing.pool import ThreadPool
 from errbot import CommandError
 from errbot.flow import FlowExecutor, FlowRoot
 from .backends.base import Backend, Room, Identifier, Message
+from .cache import ResultCache
+from .scheduler import PollerScheduler
 from .storage import StoreMixin
 from .streaming import Tee
 from .templating import tenv
-from .utils import split_string_after
+from .utils import split_string_after, decorated_members
 
 log = logging.getLogger(__name__)
 
 
+class CommandPlan(NamedTuple):
+    """ Everything needed to invoke a command, resolved once when the command is injected.
+    """
+    method: Callable
+    admin_only: bool
+    historize: bool
+    split_args: Optional[Callable[[str], Any]]  # None when the arguments are given as a string.
+    generator: bool
+    template: Optional[str]
+    flow_only: bool
+    cache_ttl: Optional[float]
+    cache_key: Optional[Callable[[Message, Any], Hashable]]
+    re_pattern: Optional[Pattern]  # re commands only
+    matchall: bool  # re commands only
+    prefix_required: bool  # re commands only
+
+    @classmethod
+    def build(cls, method) -> 'CommandPlan':
+        """
+        :param method: the bound method tagged by one of the botcmd decorators, the tags it lacks take the
+                       defaults of botcmd.
+        """
+        separator = getattr(method, '_err_command_split_args_with', '')
+        if separator == '':
+            split_args = None
+        elif hasattr(separator, 'parse_args'):
+            split_args = separator.parse_args
+        elif callable(separator):
+            split_args = separator
+        else:
+            def split_args(args):
+                return args.split(separator)
+        return cls(method=method,
+                   admin_only=getattr(method, '_err_command_admin_only', False),
+                   historize=getattr(method, '_err_command_historize', True),
+                   split_args=split_args,
+                   generator=inspect.isgeneratorfunction(method),
+                   template=getattr(method, '_err_command_template', None),
+                   flow_only=getattr(method, '_err_command_flow_only', False),
+                   cache_ttl=getattr(method, '_err_command_cache_ttl', None),
+                   cache_key=getattr(method, '_err_command_cache_key', None),
+                   re_pattern=getattr(method, '_err_command_re_pattern', None),
+                   matchall=getattr(method, '_err_command_matchall', False),
+                   prefix_required=getattr(method, '_err_command_prefix_required', True))
+
+
 # noinspection PyAbstractClass
 class ErrBot(Backend, StoreMixin):
     """ ErrBot is the layer taking care of commands management and dispatching.
@@ -42,17 +93,29 @@ class ErrBot(Backend, StoreMixin):
     __errdoc__ = """ Commands related to the bot administration """
     MSG_ERROR_OCCURRED = 'Computer says nooo. See logs for details'
     MSG_UNKNOWN_COMMAND = 'Unknown command: "%(command)s". '
+    MSG_UPLOAD_SUMMARY = 'This reply is too long to be displayed here (%(lines)d lines, %(size)d characters), ' \
+                         'it has been sent as the file "%(filename)s".'
+    MSG_UPLOAD_FILENAME = 'reply.txt'
+    # the pace of the broadcasts the backend can sustain, if BOT_BROADCAST_MIN_INTERVAL and BOT_BROADCAST_BURST
+    # are None: BROADCAST_BURST messages at once, then one every BROADCAST_MIN_INTERVAL seconds.
+    BROADCAST_MIN_INTERVAL = 1.0
+    BROADCAST_BURST = 20
     startup_time = datetime.now()
 
     def __init__(self, bot_config):
         log.debug("ErrBot init.")
         super().__init__(bot_config)
+        # if BOT_ADMINS is just an unique string make it a tuple for backwards compatibility
+        if isinstance(bot_config.BOT_ADMINS, str):
+            bot_config.BOT_ADMINS = (bot_config.BOT_ADMINS,)
         self.prefix = bot_config.BOT_PREFIX
         if bot_config.BOT_ASYNC:
             self.thread_pool = ThreadPool(bot_config.BOT_ASYNC_POOLSIZE)
             log.debug('created a thread pool of size %d.', bot_config.BOT_ASYNC_POOLSIZE)
         self.commands = {}  # the dynamically populated list of commands available on the bot
         self.re_commands = {}  # the dynamically populated list of regex-based commands available on the bot
+        self._command_plans = {}  # name -> CommandPlan of the commands
+        self._re_command_plans = {}  # name -> CommandPlan of the regex-based commands
         self.command_filters = []  # the dynamically populated list of filters
         self.MSG_UNKNOWN_COMMAND = 'Unknown command: "%(command)s". ' \
                                    'Type "' + bot_config.BOT_PREFIX + 'help" for available commands.'
@@ -66,6 +129,11 @@ class ErrBot(Backend, StoreMixin):
         self._plugin_errors_during_startup = None
         self.flow_executor = FlowExecutor(self)
         self._gbl = RLock()  # this protects internal structures of this class
+        self._broadcasting = local()  # flags the threads sending the parts of a broadcast
+        self.command_cache = ResultCache(bot_config.BOT_COMMAND_CACHE_SIZE)  # results of the cache_ttl commands
+        self.poller_scheduler = PollerScheduler(bot_config.BOT_POLLER_POOLSIZE)
+        self._compactor = None
+        self._compaction_stopped = Event()
 
     def attach_repo_manager(self, repo_manager):
         self.repo_manager = repo_manager
@@ -87,6 +155,26 @@ class ErrBot(Backend, StoreMixin):
         assert self.storage_plugin is not None
         self.open_storage(self.storage_plugin, '%s_backend' % self.mode)
 
+    def compact_storages(self):
+        """
+        Remove the expired keys from the storages of the bot, its managers and its active plugins.
+        """
+        stores = [self, self.plugin_manager, self.repo_manager] + self.plugin_manager.get_all_active_plugin_objects()
+        for store in stores:
+            if getattr(store, '_store', None) is None:
+                continue  # closed in the meantime
+            try:
+                removed = store.compact_storage()
+            except Exception:
+                log.exception('Failed to compact the storage %s.', store.namespace)
+                continue
+            if removed:
+                log.info('Removed %d expired keys from the storage %s.', removed, store.namespace)
+
+    def _compact_storages_periodically(self):
+        while not self._compaction_stopped.wait(self.bot_config.STORAGE_COMPACTION_INTERVAL):
+            self.compact_storages()
+
     @property
     def all_commands(self):
         """Return both commands and re_commands together."""
@@ -95,6 +183,21 @@ class ErrBot(Backend, StoreMixin):
             newd.update(self.re_commands)
         return newd
 
+    def _command_plan(self, cmd, re_command=False):
+        """Get the invocation plan of a command, (re)building it if the command has been changed directly.
+
+        :param cmd: the name of the command.
+        :param re_command: True to look for it in the regex-based commands.
+        """
+        with self._gbl:
+            commands, plans = (self.re_commands, self._re_command_plans) if re_command \
+                else (self.commands, self._command_plans)
+            method = commands[cmd]
+            plan = plans.get(cmd)
+            if plan is None or plan.method is not method:
+                plan = plans[cmd] = CommandPlan.build(method)
+            return plan
+
     def _dispatch_to_plugins(self, method, *args, **kwargs):
         """
         Dispatch the given method to all active plugins.
@@ -141,6 +244,74 @@ class ErrBot(Backend, StoreMixin):
 
         self.split_and_send_message(msg)
 
+    def broadcast(self, identifiers, text):
+        """ Sends the same message to many users or rooms at once.
+
+            The plugins are notified only once by callback_botmessage (with the first recipient as `to`)
+            and the messages are sent concurrently by BOT_BROADCAST_POOLSIZE threads: BOT_BROADCAST_BURST
+            messages at once, then at most one every BOT_BROADCAST_MIN_INTERVAL seconds (BROADCAST_BURST and
+            BROADCAST_MIN_INTERVAL of the backend by default). The call returns once all of them are sent, after
+            about (len(identifiers) - burst) * interval seconds.
+
+            :param identifiers:
+                the identifiers from build_identifier or from incoming messages.
+            :param text:
+                the markdown text you want to send
+            :return:
+                a list of (identifier, error) tuples in the same order as the identifiers,
+                error is None if the message has been delivered to the backend.
+        """
+        identifiers = list(identifiers)
+        for identifier in identifiers:
+            if not isinstance(identifier, Identifier):
+                raise ValueError("identifiers should only contain Identifiers")
+        if not identifiers:
+            return []
+
+        msg = self.build_message(text)
+        msg.frm = self.bot_identifier
+        msg.to = identifiers[0]
+        self._dispatch_botmessage(msg)
+
+        interval = self.bot_config.BOT_BROADCAST_MIN_INTERVAL
+        if interval is None:
+            interval = self.BROADCAST_MIN_INTERVAL
+        burst = self.bot_config.BOT_BROADCAST_BURST
+        if burst is None:
+            burst = self.BROADCAST_BURST
+        pace_lock = Lock()
+        # the time the next message would be sent at without the burst allowance.
+        next_slot = [monotonic()]
+
+        def deliver(identifier):
+            if interval:
+                with pace_lock:
+                    now = monotonic()
+                    next_slot[0] = max(now, next_slot[0])
+                    slot = max(now, next_slot[0] - max(burst - 1, 0) * interval)
+                    next_slot[0] += interval
+                if slot > now:
+                    sleep(slot - now)
+            part = self.build_message(text)
+            part.frm = self.bot_identifier
+            part.to = identifier
+            self._broadcasting.active = True
+            try:
+                self.split_and_send_message(part)
+                return identifier, None
+            except Exception as e:
+                log.exception('Broadcasting to %s failed.', identifier)
+                return identifier, e
+            finally:
+                self._broadcasting.active = False
+
+        pool = ThreadPool(min(self.bot_config.BOT_BROADCAST_POOLSIZE, len(identifiers)))
+        try:
+            return pool.map(deliver, identifiers)
+        finally:
+            pool.close()
+            pool.join()
+
     def send_templated(self, identifier, template_name, template_parameters, in_reply_to=None,
                        groupchat_nick_reply=False):
         """ Sends a simple message to the specified user using a template.
@@ -158,12 +329,44 @@ class ErrBot(Backend, StoreMixin):
         return self.send(identifier, text, in_reply_to, groupchat_nick_reply)
 
     def split_and_send_message(self, msg):
+        threshold = self.bot_config.MESSAGE_UPLOAD_THRESHOLD
+        if threshold and len(msg.body) > threshold and self.upload_message(msg):
+            return
         for part in split_string_after(msg.body, self.bot_config.MESSAGE_SIZE_LIMIT):
             partial_message = msg.clone()
             partial_message.body = part
             partial_message.partial = True
             self.send_message(partial_message)
 
+    def upload_message(self, msg) -> bool:
+        """
+        Sends the body of a message as a file through the backend stream support
+        and replaces it in the chat by a short summary.
+
+        :param msg: the message to upload.
+        :return: True if the upload has been requested, False if the backend cannot do it
+                 and the message needs to be sent inline.
+        """
+        send_stream_request = getattr(self, 'send_stream_request', None)
+        if send_stream_request is None:
+            return False
+
+        content = msg.body.encode('utf-8')
+        try:
+            send_stream_request(msg.to, BytesIO(content), name=self.MSG_UPLOAD_FILENAME, size=len(content),
+                                stream_type='text/plain')
+        except Exception:
+            log.exception('Could not upload a message of %d characters to %s, sending it inline.',
+                          len(msg.body), msg.to)
+            return False
+
+        summary = msg.clone()
+        summary.body = self.MSG_UPLOAD_SUMMARY % {'size': len(msg.body),
+                                                  'lines': msg.body.count('\n') + 1,
+                                                  'filename': self.MSG_UPLOAD_FILENAME}
+        self.send_message(summary)
+        return True
+
     def send_message(self, msg):
         """
         This needs to be overridden by the backends with a super() call.
@@ -171,6 +374,11 @@ class ErrBot(Backend, StoreMixin):
         :param msg: the message to send.
         :return: None
         """
+        if getattr(self._broadcasting, 'active', False):
+            return  # the plugins have already been notified once for the whole broadcast.
+        self._dispatch_botmessage(msg)
+
+    def _dispatch_botmessage(self, msg):
         for bot in self.plugin_manager.get_all_active_plugin_objects():
             # noinspection PyBroadException
             try:
@@ -302,25 +510,23 @@ class ErrBot(Backend, StoreMixin):
         matched_on_re_command = False
         if not cmd:
             with self._gbl:
-                if prefixed or (msg.is_direct and self.bot_config.BOT_PREFIX_OPTIONAL_ON_CHAT):
-                    commands = dict(self.re_commands)
-                else:
-                    commands = {k: self.re_commands[k] for k in self.re_commands
-                                if not self.re_commands[k]._err_command_prefix_required}
+                plans = [(name, self._command_plan(name, re_command=True)) for name in self.re_commands]
+            if not (prefixed or (msg.is_direct and self.bot_config.BOT_PREFIX_OPTIONAL_ON_CHAT)):
+                plans = [(name, plan) for name, plan in plans if not plan.prefix_required]
 
-            for name, func in commands.items():
-                if func._err_command_matchall:
-                    match = list(func._err_command_re_pattern.finditer(text))
+            for name, plan in plans:
+                if plan.matchall:
+                    match = list(plan.re_pattern.finditer(text))
                 else:
-                    match = func._err_command_re_pattern.search(text)
+                    match = plan.re_pattern.search(text)
                 if match:
                     log.debug("Matching '{}' against '{}' produced a match"
-                              .format(text, func._err_command_re_pattern.pattern))
+                              .format(text, plan.re_pattern.pattern))
                     matched_on_re_command = True
                     self._process_command(msg, name, text, match)
                 else:
                     log.debug("Matching '{}' against '{}' produced no match"
-                              .format(text, func._err_command_re_pattern.pattern))
+                              .format(text, plan.re_pattern.pattern))
         if matched_on_re_command:
             return True
 
@@ -368,29 +574,21 @@ class ErrBot(Backend, StoreMixin):
         if (cmd, args) in user_cmd_history:
             user_cmd_history.remove((cmd, args))  # Avoids duplicate history items
 
-        with self._gbl:
-            f = self.re_commands[cmd] if match else self.commands[cmd]
+        plan = self._command_plan(cmd, re_command=bool(match))
 
-        if f._err_command_admin_only and self.bot_config.BOT_ASYNC:
+        if plan.admin_only and self.bot_config.BOT_ASYNC:
             # If it is an admin command, wait until the queue is completely depleted so
             # we don't have strange concurrency issues on load/unload/updates etc...
             self.thread_pool.close()
             self.thread_pool.join()
             self.thread_pool = ThreadPool(self.bot_config.BOT_ASYNC_POOLSIZE)
 
-        if f._err_command_historize:
+        if plan.historize:
             user_cmd_history.append((cmd, args))  # add it to the history only if it is authorized to be so
 
-        # Don't check for None here as None can be a valid argument to str.split.
-        # '' was chosen as default argument because this isn't a valid argument to str.split()
-        if not match and f._err_command_split_args_with != '':
+        if not match and plan.split_args is not None:
             try:
-                if hasattr(f._err_command_split_args_with, "parse_args"):
-                    args = f._err_command_split_args_with.parse_args(args)
-                elif callable(f._err_command_split_args_with):
-                    args = f._err_command_split_args_with(args)
-                else:
-                    args = args.split(f._err_command_split_args_with)
+                args = plan.split_args(args)
             except Exception as e:
                 self.send_simple_reply(
                     msg,
@@ -402,15 +600,15 @@ class ErrBot(Backend, StoreMixin):
             result = self.thread_pool.apply_async(
                 self._execute_and_send,
                 [],
-                {'cmd': cmd, 'args': args, 'match': match, 'msg': msg, 'template_name': f._err_command_template}
+                {'cmd': cmd, 'args': args, 'match': match, 'msg': msg, 'template_name': plan.template}
             )
-            if f._err_command_admin_only:
+            if plan.admin_only:
                 # Again, if it is an admin command, wait until the queue is completely
                 # depleted so we don't have strange concurrency issues.
                 result.wait()
         else:
             self._execute_and_send(cmd=cmd, args=args, match=match, msg=msg,
-                                   template_name=f._err_command_template)
+                                   template_name=plan.template)
 
     @staticmethod
     def process_template(template_name, template_parameters):
@@ -436,29 +634,24 @@ class ErrBot(Backend, StoreMixin):
         """
         private = cmd in self.bot_config.DIVERT_TO_PRIVATE
         threaded = cmd in self.bot_config.DIVERT_TO_THREAD
-        commands = self.re_commands if match else self.commands
         try:
-            with self._gbl:
-                method = commands[cmd]
+            plan = self._command_plan(cmd, re_command=bool(match))
             # first check if we need to reattach a flow context
             flow, _ = self.flow_executor.check_inflight_flow_triggered(cmd, msg.frm)
             if flow:
                 log.debug("Reattach context from flow %s to the message", flow._root.name)
                 msg.ctx = flow.ctx
-            elif method._err_command_flow_only:
+            elif plan.flow_only:
                 # check if it is a flow_only command but we are not in a flow.
                 log.debug("%s is tagged flow_only and we are not in a flow. Ignores the command.", cmd)
                 return
 
-            if inspect.isgeneratorfunction(method):
-                replies = method(msg, match) if match else method(msg, args)
-                for reply in replies:
-                    if reply:
-                        self.send_simple_reply(msg, self.process_template(template_name, reply), private, threaded)
+            if plan.cache_ttl and not flow:
+                replies = self._cached_command_replies(cmd, plan, args, match, msg, template_name)
             else:
-                reply = method(msg, match) if match else method(msg, args)
-                if reply:
-                    self.send_simple_reply(msg, self.process_template(template_name, reply), private, threaded)
+                replies = self._command_replies(plan, args, match, msg, template_name)
+            for reply in replies:
+                self.send_simple_reply(msg, reply, private, threaded)
 
             # The command is a success, check if this has not made a flow progressed
             self.flow_executor.trigger(cmd, msg.frm, msg.ctx)
@@ -476,6 +669,30 @@ class ErrBot(Backend, StoreMixin):
                           (msg.body, tb))
             self.send_simple_reply(msg, self.MSG_ERROR_OCCURRED + ':\n %s' % e, private, threaded)
 
+    def _command_replies(self, plan, args, match, msg, template_name):
+        """Execute a bot command and yield its rendered replies as they come."""
+        replies = plan.method(msg, match) if match else plan.method(msg, args)
+        if not plan.generator:
+            replies = (replies,)
+        for reply in replies:
+            if reply:
+                yield self.process_template(template_name, reply)
+
+    def _cached_command_replies(self, cmd, plan, args, match, msg, template_name):
+        """Get the rendered replies of a command tagged with a cache_ttl from the command cache.
+
+        Identical invocations running concurrently are executed only once.
+        """
+        if plan.cache_key:
+            key = plan.cache_key(msg, match if match else args)
+        elif match:
+            key = tuple(m.group(0) for m in match) if isinstance(match, list) else match.group(0)
+        else:
+            key = tuple(args) if isinstance(args, list) else args
+        return self.command_cache.get_or_compute(
+            cmd, key, plan.cache_ttl,
+            lambda: list(self._command_replies(plan, args, match, msg, template_name)))
+
     def unknown_command(self, _, cmd, args):
         """ Override the default unknown command behavior
         """
@@ -499,69 +716,74 @@ class ErrBot(Backend, StoreMixin):
     def inject_commands_from(self, instance_to_inject):
         with self._gbl:
             plugin_name = instance_to_inject.name
-            for name, value in inspect.getmembers(instance_to_inject, inspect.ismethod):
-                if getattr(value, '_err_command', False):
-                    commands = self.re_commands if getattr(value, '_err_re_command') else self.commands
-                    name = getattr(value, '_err_command_name')
-
-                    if name in commands:
-                        f = commands[name]
-                        new_name = (plugin_name + '-' + name).lower()
-                        self.warn_admins('%s.%s clashes with %s.%s so it has been renamed %s' % (
-                            plugin_name, name, type(f.__self__).__name__, f.__name__, new_name))
-                        name = new_name
-                        value.__func__._err_command_name = new_name  # To keep track of the renaming.
-                    commands[name] = value
-
-                    if getattr(value, '_err_re_command'):
-                        log.debug('Adding regex command : %s -> %s' % (name, value.__name__))
-                        self.re_commands = commands
-                    else:
-                        log.debug('Adding command : %s -> %s' % (name, value.__name__))
-                        self.commands = commands
+            for name in decorated_members(instance_to_inject).commands:
+                value = getattr(instance_to_inject, name)
+                commands = self.re_commands if getattr(value, '_err_re_command') else self.commands
+                name = getattr(value, '_err_command_name')
+
+                if name in commands:
+                    f = commands[name]
+                    new_name = (plugin_name + '-' + name).lower()
+                    self.warn_admins('%s.%s clashes with %s.%s so it has been renamed %s' % (
+                        plugin_name, name, type(f.__self__).__name__, f.__name__, new_name))
+                    name = new_name
+                    value.__func__._err_command_name = new_name  # To keep track of the renaming.
+                commands[name] = value
+                plans = self._re_command_plans if getattr(value, '_err_re_command') else self._command_plans
+                plans[name] = CommandPlan.build(value)
+
+                if getattr(value, '_err_re_command'):
+                    log.debug('Adding regex command : %s -> %s' % (name, value.__name__))
+                    self.re_commands = commands
+                else:
+                    log.debug('Adding command : %s -> %s' % (name, value.__name__))
+                    self.commands = commands
 
     def inject_flows_from(self, instance_to_inject):
         classname = instance_to_inject.__class__.__name__
-        for name, method in inspect.getmembers(instance_to_inject, inspect.ismethod):
-            if getattr(method, '_err_flow', False):
-                log.debug('Found new flow %s: %s', classname, name)
-                flow = FlowRoot(name, method.__doc__)
-                try:
-                    method(flow)
-                except Exception:
-                    log.exception("Exception initializing a flow")
+        for name in decorated_members(instance_to_inject).flows:
+            method = getattr(instance_to_inject, name)
+            log.debug('Found new flow %s: %s', classname, name)
+            flow = FlowRoot(name, method.__doc__,
+                            idle_timeout=getattr(method, '_err_flow_idle_timeout', None),
+                            max_lifetime=getattr(method, '_err_flow_max_lifetime', None))
+            try:
+                method(flow)
+            except Exception:
+                log.exception("Exception initializing a flow")
 
-                self.flow_executor.add_flow(flow)
+            self.flow_executor.add_flow(flow)
 
     def inject_command_filters_from(self, instance_to_inject):
         with self._gbl:
-            for name, method in inspect.getmembers(instance_to_inject, inspect.ismethod):
-                if getattr(method, '_err_command_filter', False):
-                    log.debug('Adding command filter: %s' % name)
-                    self.command_filters.append(method)
+            for name in decorated_members(instance_to_inject).command_filters:
+                log.debug('Adding command filter: %s' % name)
+                self.command_filters.append(getattr(instance_to_inject, name))
 
     def remove_flows_from(self, instance_to_inject):
-        for name, value in inspect.getmembers(instance_to_inject, inspect.ismethod):
-            if getattr(value, '_err_flow', False):
-                log.debug('Remove flow %s', name)
-                # TODO(gbin)
+        for name in decorated_members(instance_to_inject).flows:
+            log.debug('Remove flow %s', name)
+            # TODO(gbin)
 
     def remove_commands_from(self, instance_to_inject):
         with self._gbl:
-            for name, value in inspect.getmembers(instance_to_inject, inspect.ismethod):
-                if getattr(value, '_err_command', False):
-                    name = getattr(value, '_err_command_name')
-                    if getattr(value, '_err_re_command') and name in self.re_commands:
-                        del self.re_commands[name]
-                    elif not getattr(value, '_err_re_command') and name in self.commands:
-                        del self.commands[name]
+            for name in decorated_members(instance_to_inject).commands:
+                value = getattr(instance_to_inject, name)
+                name = getattr(value, '_err_command_name')
+                if getattr(value, '_err_re_command') and name in self.re_commands:
+                    del self.re_commands[name]
+                    self._re_command_plans.pop(name, None)
+                elif not getattr(value, '_err_re_command') and name in self.commands:
+                    del self.commands[name]
+                    self._command_plans.pop(name, None)
+                if getattr(value, '_err_command_cache_ttl', None):
+                    self.command_cache.invalidate(name)
 
     def remove_command_filters_from(self, instance_to_inject):
         with self._gbl:
-            for name, method in inspect.getmembers(instance_to_inject, inspect.ismethod):
-                if getattr(method, '_err_command_filter', False):
-                    log.debug('Removing command filter: %s' % name)
-                    self.command_filters.remove(method)
+            for name in decorated_members(instance_to_inject).command_filters:
+                log.debug('Removing command filter: %s' % name)
+                self.command_filters.remove(getattr(instance_to_inject, name))
 
     def _admins_to_notify(self):
         """
@@ -624,7 +846,8 @@ class ErrBot(Backend, StoreMixin):
 
     def callback_stream(self, stream):
         log.info("Initiated an incoming transfer %s" % stream)
-        Tee(stream, self.plugin_manager.get_all_active_plugin_objects()).start()
+        Tee(stream, self.plugin_manager.get_all_active_plugin_objects(), self.bot_config.BOT_DATA_DIR,
+            spool=self.bot_config.BOT_STREAM_SPOOL).start()
 
     def signal_connect_to_all_plugins(self):
         for bot in self.plugin_manager.get_all_active_plugin_objects():
@@ -651,6 +874,9 @@ class ErrBot(Backend, StoreMixin):
         log.info('Notifying connection to all the plugins...')
         self.signal_connect_to_all_plugins()
         log.info('Plugin activation done.')
+        if self.bot_config.STORAGE_COMPACTION_INTERVAL > 0 and self._compactor is None:
+            self._compactor = Thread(target=self._compact_storages_periodically, name='storage compaction', daemon=True)
+            self._compactor.start()
 
     def disconnect_callback(self):
         log.info('Disconnect callback, deactivating all the plugins.')
@@ -679,9 +905,13 @@ class ErrBot(Backend, StoreMixin):
                 for command in self.all_commands.values())
 
     def shutdown(self):
+        self._compaction_stopped.set()
+        self.flow_executor.shutdown()
+        self.poller_scheduler.shutdown()
         self.close_storage()
         self.plugin_manager.shutdown()
         self.repo_manager.shutdown()
+        self.storage_plugin.flush()
 
     def prefix_groupchat_reply(self, message: Message, identifier: Identifier):
         if message.body.startswith('#'):
@@ -1,2 +1,3 @@
 from flask.app import Flask
 flask_app = Flask(__name__)
+webhook_queue = None  # the WebhookQueue of the async_ack webhooks, set by the Webserver plugin
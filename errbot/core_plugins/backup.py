@@ -1,6 +1,8 @@
 import os
+from datetime import datetime
 
 from errbot import BotPlugin, botcmd
+from errbot.backup import BACKUP_EXTENSION, latest_backup, write_backup
 
 
 class Backup(BotPlugin):
@@ -8,33 +10,22 @@ class Backup(BotPlugin):
     @botcmd(admin_only=True)
     def backup(self, msg, args):
         """Backup everything.
-           Makes a backup script called backup.py in the data bot directory.
-           You can restore the backup from the command line with errbot --restore
+           Writes the storages of the bot and of its plugins in a backup file in the bot data directory,
+           !backup incremental only writes what changed since the latest backup.
+           You can restore the latest backup from the command line with errbot --restore
         """
-        filename = os.path.join(self.bot_config.BOT_DATA_DIR, 'backup.py')
-        with open(filename, 'w') as f:
-            f.write('## This file is not executable on its own. use errbot -r FILE to restore your bot.\n\n')
-            f.write('log.info("Restoring repo_manager.")\n')
-            for key, value in self._bot.repo_manager.items():
-                f.write('bot.repo_manager["' + key + '"] = ' + repr(value) + '\n')
-            f.write('log.info("Restoring plugin_manager.")\n')
-            for key, value in self._bot.plugin_manager.items():  # don't mimic that in real plugins, this is core only.
-                f.write('bot.plugin_manager["' + key + '"] = ' + repr(value) + '\n')
+        args = args.strip()
+        if args not in ('', 'incremental'):
+            return 'Usage: ' + self._bot.prefix + 'backup [incremental]'
+        directory = self.bot_config.BOT_DATA_DIR
+        base = latest_backup(directory) if args == 'incremental' else None
+        filename = os.path.join(directory, 'backup-' + datetime.now().strftime('%Y%m%d-%H%M%S-%f') + BACKUP_EXTENSION)
 
-            f.write('log.info("Installing plugins.")\n')
-            f.write('if "installed_repos" in bot.repo_manager:\n')
-            f.write('  for repo in bot.repo_manager["installed_repos"]:\n')
-            f.write('    log.error(bot.repo_manager.install_repo(repo))\n')
+        stores = [self._bot, self._bot.repo_manager, self._bot.plugin_manager]
+        stores.extend(plugin for plugin in self._bot.plugin_manager.plugins.values() if plugin._store)
+        # don't mimic that in real plugins, this is core only.
+        written = write_backup(filename, {store.namespace: store._store for store in stores}, base)
 
-            f.write('log.info("Restoring plugins data.")\n')
-            f.write('bot.plugin_manager.update_dynamic_plugins()\n')
-            for plugin in self._bot.plugin_manager.plugins.values():
-                if plugin._store:
-                    f.write('pobj = bot.plugin_manager.plugins["' + plugin.name + '"]\n')
-                    f.write('pobj.init_storage()\n')
-
-                    for key, value in plugin:
-                        f.write('pobj["' + key + '"] = ' + repr(value) + '\n')
-                    f.write('pobj.close_storage()\n')
-
-        return "The backup file has been written in '%s'" % filename
+        if base:
+            return "The backup file has been written in '%s' with %d changes since '%s'" % (filename, written, base)
+        return "The backup file has been written in '%s' with %d entries" % (filename, written)
@@ -78,23 +78,24 @@ class Flows(BotPlugin):
     def flows_status(self, msg, args):
         """ Displays the list of started flows.
         """
+        in_flight = self._bot.flow_executor.in_flight.copy()  # the flows can end while we iterate
         with io.StringIO() as response:
-            if not self._bot.flow_executor.in_flight:
+            if not in_flight:
                 response.write('No Flow started.\n')
 
             else:
-                if not [flow for flow in self._bot.flow_executor.in_flight if self.check_user(msg, flow)]:
+                if not [flow for flow in in_flight if self.check_user(msg, flow)]:
                     response.write('No Flow started for current user: \n{}\n'.format(get_acl_usr(msg)))
 
                 else:
                     if args:
-                        for flow in self._bot.flow_executor.in_flight:
+                        for flow in in_flight:
                             if self.check_user(msg, flow):
                                 if flow.name == args:
                                     self.recurse_node(response, [], flow.root, flow)
 
                     else:
-                        for flow in self._bot.flow_executor.in_flight:
+                        for flow in in_flight:
                             if self.check_user(msg, flow):
                                 next_steps = ['\\*{}\\*'.format(str(step[1].command)) for step in
                                               flow._current_step.children if step[1].command]
@@ -120,7 +121,7 @@ class Flows(BotPlugin):
             return
 
         one_stopped = False
-        for flow in self._bot.flow_executor.in_flight:
+        for flow in self._bot.flow_executor.in_flight.copy():  # stop_flow removes them from in_flight
             if flow.requestor == msg.frm:
                 flow = self._bot.flow_executor.stop_flow(flow.name, msg.frm)
                 if flow:
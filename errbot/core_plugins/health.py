@@ -39,6 +39,19 @@ class Health(BotPlugin):
         """
         return {'gc': gc.get_count()}
 
+    @botcmd(template='status_cache')
+    def status_cache(self, _, args):
+        """ shows the hits and misses of the commands served from the command cache
+        """
+        return {'cache': sorted(self._bot.command_cache.stats().items())}
+
+    @botcmd(template='status_pollers')
+    def status_pollers(self, _, args):
+        """ shows the number of calls, durations and failures of the plugin pollers
+        """
+        return {'pollers': sorted(self._bot.poller_scheduler.stats(), key=lambda stats: (stats['plugin'],
+                                                                                         stats['method']))}
+
     @botcmd(template='status_plugins')
     def status_plugins(self, _, args):
         """ shows the plugin status
@@ -1,12 +1,20 @@
+import io
+import logging
 import sys
 import os
-from json import loads
+from json import dumps, loads
+from queue import Full, Queue
 from random import randrange
 from threading import Thread
 
+from flask import Response
 from webtest import TestApp
+import errbot.core_plugins
 from errbot.core_plugins import flask_app
-from werkzeug.serving import ThreadedWSGIServer
+from errbot.core_plugins.wsview import WebhookQueue
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+from werkzeug.wsgi import LimitedStream
 
 from errbot import botcmd, BotPlugin, webhook
 
@@ -20,6 +28,15 @@ Detected your post as : %s
 Status code : %i
 """
 
+DEFAULT_LIMITS = {'WORKERS': 10,  # the number of requests handled at the same time
+                  'QUEUE_SIZE': 100,  # the connections waiting for a worker, the next ones get a 503
+                  'KEEPALIVE_TIMEOUT': 5,  # seconds an idle connection is kept open
+                  'MAX_BODY_SIZE': 10 * 1024 * 1024,  # bigger requests get a 413
+                  'ASYNC_WORKERS': 4,  # the number of async_ack webhooks processed at the same time
+                  'ASYNC_QUEUE_SIZE': 1000}  # the async_ack webhooks waiting for a worker, the next ones get a 503
+
+log = logging.getLogger(__name__)
+
 
 def make_ssl_certificate(key_path, cert_path):
     """
@@ -57,28 +74,175 @@ def make_ssl_certificate(key_path, cert_path):
     f.close()
 
 
+class WorkerPool(object):
+    """
+    A fixed number of threads handling the connections accepted by one or several PooledWSGIServers.
+    """
+
+    def __init__(self, workers: int, queue_size: int):
+        """
+        :param workers: the number of threads.
+        :param queue_size: the number of connections that can wait for a thread.
+        """
+        self._queue = Queue(queue_size)
+        self._threads = [Thread(target=self._work, name='Webserver worker %d' % i, daemon=True)
+                         for i in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, server: BaseWSGIServer, request, client_address) -> bool:
+        """
+        :return: False if the queue is full.
+        """
+        try:
+            self._queue.put_nowait((server, request, client_address))
+            return True
+        except Full:
+            return False
+
+    def _work(self):
+        while True:
+            work = self._queue.get()
+            if work is None:
+                return
+            server, request, client_address = work
+            try:
+                server.finish_request(request, client_address)
+            except Exception:
+                server.handle_error(request, client_address)
+            finally:
+                server.shutdown_request(request)
+
+    def shutdown(self):
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+
+class CappedInput(io.RawIOBase):
+    """
+    A chunked request body, dechunked by werkzeug, raising a 413 once more than limit bytes have been read.
+    """
+
+    def __init__(self, stream, limit: int):
+        super().__init__()
+        self._stream = stream
+        self._limit = limit
+        self.read_bytes = 0
+        self.eof = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, b) -> int:
+        read = self._stream.readinto(b)
+        if not read and len(b):
+            self.eof = True
+        self.read_bytes += read
+        if self.read_bytes > self._limit:
+            raise RequestEntityTooLarge('The request body is bigger than %d bytes' % self._limit)
+        return read
+
+
+class KeepAliveRequestHandler(WSGIRequestHandler):
+    """
+    Keeps the HTTP/1.1 connections open between requests and rejects the bodies bigger than the limit.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        self.timeout = self.server.keepalive_timeout  # an idle connection holds a worker, until this timeout.
+        super().setup()
+
+    def parse_request(self):
+        self._input = None
+        if not super().parse_request():
+            return False
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            length = 0
+        if length > self.server.max_body_size:
+            self.send_error(413, 'The request body is bigger than %d bytes' % self.server.max_body_size)
+            return False
+        return True
+
+    def make_environ(self):
+        environ = super().make_environ()
+        if environ.get('wsgi.input_terminated'):
+            # chunked: the size is only known once read, the bytes read are counted against the limit.
+            self._input = CappedInput(environ['wsgi.input'], self.server.max_body_size)
+        else:
+            # the next request of the connection starts after the body, even if the webhook didn't read it.
+            self._input = LimitedStream(self.rfile, int(environ.get('CONTENT_LENGTH') or 0))
+        environ['wsgi.input'] = self._input
+        return environ
+
+    def end_headers(self):
+        if isinstance(self._input, CappedInput) and not self._input.eof and not self.close_connection:
+            # the rest of the chunked body would be read as the next request.
+            self.send_header('Connection', 'close')
+        super().end_headers()
+
+    def run_wsgi(self):
+        result = super().run_wsgi()
+        if isinstance(self._input, LimitedStream) and not self.close_connection:
+            self._input.exhaust()
+        return result
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """
+    A WSGI server handing its connections to a WorkerPool instead of starting a thread per connection.
+    """
+    multithread = True
+
+    def __init__(self, host: str, port: int, app, pool: WorkerPool, max_body_size: int, keepalive_timeout: float,
+                 ssl_context=None):
+        self.pool = pool
+        self.max_body_size = max_body_size
+        self.keepalive_timeout = keepalive_timeout
+        super().__init__(host, port, app, handler=KeepAliveRequestHandler, ssl_context=ssl_context)
+
+    def process_request(self, request, client_address):
+        if self.pool.submit(self, request, client_address):
+            return
+        log.warning('The webserver is overloaded, rejecting a connection from %s.', client_address[0])
+        try:
+            request.sendall(b'HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+
 class Webserver(BotPlugin):
 
     def __init__(self, *args, **kwargs):
         self.server = None
         self.server_thread = None
+        self.pool = None
         self.ssl_context = None
         self.test_app = TestApp(flask_app)
         super().__init__(*args, **kwargs)
 
     def get_configuration_template(self):
-        return {'HOST': '0.0.0.0',
-                'PORT': 3141,
-                'SSL': {'enabled': False,
-                        'host': '0.0.0.0',
-                        'port': 3142,
-                        'certificate': '',
-                        'key': ''}}
+        return dict({'HOST': '0.0.0.0',
+                     'PORT': 3141,
+                     'SSL': {'enabled': False,
+                             'host': '0.0.0.0',
+                             'port': 3142,
+                             'certificate': '',
+                             'key': ''}},
+                    **DEFAULT_LIMITS)
 
     def check_configuration(self, configuration):
         # it is a pain, just assume a default config if SSL is absent or set to None
         if configuration.get('SSL', None) is None:
             configuration['SSL'] = {'enabled': False, 'host': '0.0.0.0', 'port': 3142, 'certificate': '', 'key': ''}
+        # the configurations made before the limits existed get the defaults.
+        for key, value in DEFAULT_LIMITS.items():
+            configuration.setdefault(key, value)
         super().check_configuration(configuration)
 
     def activate(self):
@@ -104,14 +268,18 @@ class Webserver(BotPlugin):
         super().deactivate()
 
     def run_server(self):
+        config = dict(DEFAULT_LIMITS, **self.config)
+        self.pool = WorkerPool(config['WORKERS'], config['QUEUE_SIZE'])
+        errbot.core_plugins.webhook_queue = WebhookQueue(config['ASYNC_WORKERS'], config['ASYNC_QUEUE_SIZE'])
         try:
-            host = self.config['HOST']
-            port = self.config['PORT']
-            ssl = self.config['SSL']
+            host = config['HOST']
+            port = config['PORT']
+            ssl = config['SSL']
             self.log.info('Starting the webserver on %s:%i' % (host, port))
             ssl_context = (ssl['certificate'], ssl['key']) if ssl['enabled'] else None
-            self.server = ThreadedWSGIServer(host, ssl['port'] if ssl_context else port, flask_app,
-                                             ssl_context=ssl_context)
+            self.server = PooledWSGIServer(host, ssl['port'] if ssl_context else port, flask_app, self.pool,
+                                           config['MAX_BODY_SIZE'], config['KEEPALIVE_TIMEOUT'],
+                                           ssl_context=ssl_context)
             self.server.serve_forever()
             self.log.debug('Webserver stopped')
         except KeyboardInterrupt:
@@ -119,6 +287,15 @@ class Webserver(BotPlugin):
             self.server.shutdown()
         except Exception:
             self.log.exception('The webserver exploded.')
+        finally:
+            if self.server is not None:
+                self.server.server_close()
+                self.server = None
+            self.pool.shutdown()
+            self.pool = None
+            self.log.info('Processing the acknowledged webhooks still in the queue.')
+            errbot.core_plugins.webhook_queue.shutdown()
+            errbot.core_plugins.webhook_queue = None
 
     @botcmd(template='webstatus')
     def webstatus(self, msg, args):
@@ -127,6 +304,20 @@ class Webserver(BotPlugin):
         """
         return {'rules': (((rule.rule, rule.endpoint) for rule in flask_app.url_map._rules))}
 
+    @webhook('/status/pollers', methods=('GET',))
+    def pollers_status(self, _):
+        """
+        The statistics of the plugin pollers, in json
+        """
+        return Response(dumps(self._bot.poller_scheduler.stats()), mimetype='application/json')
+
+    @webhook('/status/webhooks', methods=('GET',))
+    def webhooks_status(self, _):
+        """
+        The depth of the queue of the async_ack webhooks and their processing latency, in json
+        """
+        return Response(dumps(errbot.core_plugins.webhook_queue.stats()), mimetype='application/json')
+
     @webhook
     def echo(self, incoming_request):
         """
@@ -1,11 +1,16 @@
-from inspect import getmembers, ismethod
+from inspect import ismethod
 from json import loads
 import logging
+from queue import Full, Queue
+from threading import Lock, Thread
+from time import monotonic
+from typing import Any, Callable, Dict, Mapping
 
 from flask.app import Flask
 from flask.views import View
-from flask import request
+from flask import request, Response
 import errbot.core_plugins
+from errbot.utils import decorated_members
 
 log = logging.getLogger(__name__)
 
@@ -34,40 +39,132 @@ def route(obj):
     flask_app = errbot.core_plugins.flask_app
     classname = obj.__class__.__name__
     log.info("Checking %s for webhooks", classname)
-    for name, func in getmembers(obj, ismethod):
-        if getattr(func, '_err_webhook_uri_rule', False):
-            log.info("Webhook routing %s", func.__name__)
-            form_param = func._err_webhook_form_param
-            uri_rule = func._err_webhook_uri_rule
-            verbs = func._err_webhook_methods
-            raw = func._err_webhook_raw
+    for name in decorated_members(obj).webhooks:
+        func = getattr(obj, name)
+        log.info("Webhook routing %s", func.__name__)
+        form_param = func._err_webhook_form_param
+        uri_rule = func._err_webhook_uri_rule
+        verbs = func._err_webhook_methods
+        raw = func._err_webhook_raw
+        async_ack = func._err_webhook_async_ack
 
-            callable_view = WebView.as_view(func.__name__ + '_' + '_'.join(verbs), func, form_param, raw)
+        callable_view = WebView.as_view(func.__name__ + '_' + '_'.join(verbs), func, form_param, raw, async_ack)
 
-            # Change existing rule.
-            for rule in flask_app.url_map._rules:
-                if rule.rule == uri_rule:
-                    flask_app.view_functions[rule.endpoint] = callable_view
-                    return
+        # Change existing rule.
+        for rule in flask_app.url_map._rules:
+            if rule.rule == uri_rule:
+                flask_app.view_functions[rule.endpoint] = callable_view
+                return
 
-            # Add a new rule
-            flask_app.add_url_rule(uri_rule, view_func=callable_view, methods=verbs, strict_slashes=False)
+        # Add a new rule
+        flask_app.add_url_rule(uri_rule, view_func=callable_view, methods=verbs, strict_slashes=False)
+
+
+class WebhookQueue(object):
+    """
+    The requests of the async_ack webhooks, acknowledged already, waiting for a worker to process them.
+
+    The queue is bounded, a full queue rejects the new requests. On shutdown, the requests in the queue are
+    processed before the workers stop.
+    """
+
+    def __init__(self, workers: int, size: int):
+        """
+        :param workers: the number of requests processed at the same time.
+        :param size: the number of requests that can wait.
+        """
+        self._queue = Queue(size)
+        self._lock = Lock()
+        self.processed = 0
+        self.failures = 0
+        self.rejected = 0
+        self.total_latency = 0.0  # from the reception of the request to the end of its processing
+        self.max_latency = 0.0
+        self._threads = [Thread(target=self._work, name='Webhook worker %d' % i, daemon=True) for i in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, func: Callable[..., Any], payload: Any, kwargs: Mapping) -> bool:
+        """
+        :return: False if the queue is full.
+        """
+        try:
+            self._queue.put_nowait((monotonic(), func, payload, kwargs))
+            return True
+        except Full:
+            with self._lock:
+                self.rejected += 1
+            return False
+
+    def _work(self):
+        while True:
+            work = self._queue.get()
+            if work is None:
+                return
+            received, func, payload, kwargs = work
+            failed = False
+            try:
+                func(payload, **kwargs)
+            except Exception:
+                log.exception('The webhook %s failed.', func.__name__)
+                failed = True
+            latency = monotonic() - received
+            with self._lock:
+                self.processed += 1
+                self.failures += failed
+                self.total_latency += latency
+                self.max_latency = max(self.max_latency, latency)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'depth': self._queue.qsize(),
+                    'capacity': self._queue.maxsize,
+                    'processed': self.processed,
+                    'failures': self.failures,
+                    'rejected': self.rejected,
+                    'avg_latency': self.total_latency / self.processed if self.processed else None,
+                    'max_latency': self.max_latency}
+
+    def shutdown(self):
+        for _ in self._threads:
+            self._queue.put(None)  # after the requests still waiting
+        for thread in self._threads:
+            thread.join()
 
 
 class WebView(View):
-    def __init__(self, func, form_param, raw):
+    def __init__(self, func, form_param, raw, async_ack=False):
         if form_param is not None and raw:
             raise Exception("Incompatible parameters: form_param cannot be set if raw is True")
+        if async_ack and raw:
+            raise Exception("Incompatible parameters: the request is gone when an async_ack webhook is processed, "
+                            "raw cannot be True")
         self.func = func
         self.raw = raw
         self.form_param = form_param
+        self.async_ack = async_ack
         self.method_filter = lambda obj: ismethod(obj) and self.func.__name__ == obj.__name__
 
     def dispatch_request(self, *args, **kwargs):
 
         if self.raw:  # override and gives the request directly
             response = self.func(request, **kwargs)
-        elif self.form_param:
+        else:
+            payload = self.payload()
+            if self.async_ack:
+                return self.enqueue(payload, kwargs)
+            response = self.func(payload, **kwargs)
+        return response if response else ''  # assume None as an OK response (simplifies the client side)
+
+    def enqueue(self, payload, kwargs):
+        queue = errbot.core_plugins.webhook_queue
+        if queue is None or not queue.submit(self.func, payload, kwargs):
+            log.warning('The webhook queue is full, rejecting a request to %s.', self.func.__name__)
+            return Response('The webhook queue is full.', status=503, headers={'Retry-After': '10'})
+        return Response(status=202)
+
+    def payload(self):
+        if self.form_param:
             content = request.form.get(self.form_param)
             if content is None:
                 raise Exception("Received a request on a webhook with a form_param defined, "
@@ -76,13 +173,11 @@ class WebView(View):
                 content = loads(content)
             except ValueError:
                 log.debug('The form parameter is not JSON, return it as a string')
-            response = self.func(content, **kwargs)
-        else:
-            data = try_decode_json(request)
-            if not data:
-                if hasattr(request, 'forms'):
-                    data = dict(request.forms)  # form encoded
-                else:
-                    data = request.data.decode()
-            response = self.func(data, **kwargs)
-        return response if response else ''  # assume None as an OK response (simplifies the client side)
+            return content
+        data = try_decode_json(request)
+        if not data:
+            if hasattr(request, 'forms'):
+                data = dict(request.forms)  # form encoded
+            else:
+                data = request.data.decode()
+        return data
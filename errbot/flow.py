@@ -1,6 +1,8 @@
 import logging
-from threading import RLock
-from typing import Mapping, List, Tuple, Union, Callable, Any
+from threading import Event, Lock, RLock, Thread
+from time import monotonic
+from typing import Mapping, List, Tuple, Union, Callable, Any, Hashable
+from uuid import uuid4
 
 from multiprocessing.pool import ThreadPool
 
@@ -11,7 +13,41 @@ log = logging.getLogger(__name__)
 
 Predicate = Callable[[Mapping[str, Any]], bool]
 
-EXECUTOR_THREADS = 5  # the maximum number of simultaneous flows in automatic mode at the same time.
+EXECUTOR_THREADS = 5  # the maximum number of simultaneous flows in automatic mode at the same time (default).
+BRANCH_THREADS = 5  # the maximum number of branches of flows executed at the same time (default).
+TIMER_TICK = 1.0  # resolution in seconds of the flow timeouts.
+TIMER_SLOTS = 512
+SPILL_NAMESPACE = 'core_flow_contexts'  # storage of the contexts of the idle flows, no plugin can have this name.
+
+
+_REMOVED = object()
+
+
+def merge_contexts(base: Mapping[str, Any], branches: List[Mapping[str, Any]]) -> dict:
+    """
+    Default merge of the contexts of the branches of a flow executed concurrently.
+
+    Each branch starts from a shallow copy of the context. The keys a branch set, changed or removed are set,
+    changed or removed in the merged context. If several branches changed the same key differently, the branch
+    connected last wins.
+    :param base: the context before the branches.
+    :param branches: the contexts of the branches that succeeded, in the order they were connected.
+    :return: the context to continue the flow with.
+    """
+    merged = dict(base)
+    changed_by = {}  # key -> index of the branch that changed it
+    for index, ctx in enumerate(branches):
+        changes = {key: value for key, value in ctx.items() if key not in base or base[key] != value}
+        removed = base.keys() - ctx.keys()
+        for key in list(changes) + list(removed):
+            if key in changed_by and changes.get(key, _REMOVED) != merged.get(key, _REMOVED):
+                log.warning("The branches %d and %d of the flow both changed %s, keeping the last one.",
+                            changed_by[key], index, key)
+            changed_by[key] = index
+        merged.update(changes)
+        for key in removed:
+            merged.pop(key, None)
+    return merged
 
 
 class FlowNode(object):
@@ -72,18 +108,28 @@ class FlowRoot(FlowNode):
     This represent the entry point of a flow description.
     """
 
-    def __init__(self, name: str, description: str):
+    def __init__(self, name: str, description: str, idle_timeout: float = None, max_lifetime: float = None):
         """
 
         :param name: The name of the conversation/flow.
         :param description:  A human description of what this flow does.
         :param hints: Hints for the next steps when triggered.
+        :param idle_timeout: stop the flows idle for more than this number of seconds (default: FLOW_IDLE_TIMEOUT).
+        :param max_lifetime: stop the flows running for more than this number of seconds
+                             (default: FLOW_MAX_LIFETIME).
+
+        When the predicates of several steps are true at the same time, the steps run concurrently on a copy of
+        the context each, then the flow continues from the step connected first with the contexts merged by
+        self.merge, merge_contexts by default.
         """
         super().__init__()
         self.name = name
         self.description = description
         self.auto_triggers = set()
         self.room_flow = False
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self.merge = merge_contexts  # type: Callable[[Mapping[str, Any], List[Mapping[str, Any]]], dict]
 
     def connect(self,
                 node_or_command: Union['FlowNode', str],
@@ -139,8 +185,59 @@ class Flow(object):
         """
         self._root = root
         self._current_step = self._root
-        self.ctx = dict(initial_context)
+        self._ctx = dict(initial_context)
+        self._spilled = None  # (storage, key) where the context is while the flow is idle
+        self._ctx_lock = Lock()
         self.requestor = requestor
+        self.started = self.last_activity = monotonic()
+
+    @property
+    def ctx(self) -> dict:
+        """
+        The context of the conversation, read back from the storage if it was spilled there.
+        """
+        with self._ctx_lock:
+            if self._spilled is not None:
+                storage, key = self._spilled
+                self._ctx = storage.get(key)
+                storage.remove(key)
+                self._spilled = None
+            return self._ctx
+
+    @ctx.setter
+    def ctx(self, ctx: dict):
+        with self._ctx_lock:
+            self._discard_spilled()
+            self._ctx = ctx
+
+    def spill(self, storage, key: str):
+        """
+        Move the context to a storage until it is needed again, see ctx.
+        """
+        with self._ctx_lock:
+            if self._spilled is None:
+                storage.set(key, self._ctx)
+                self._ctx, self._spilled = None, (storage, key)
+
+    @property
+    def spilled(self) -> bool:
+        return self._spilled is not None
+
+    def _discard_spilled(self):
+        if self._spilled is not None:
+            storage, key = self._spilled
+            self._spilled = None
+            try:
+                storage.remove(key)
+            except KeyError:
+                pass
+
+    def discard(self):
+        """
+        Forget the context, the flow is over.
+        """
+        with self._ctx_lock:
+            self._discard_spilled()
 
     def next_autosteps(self) -> List[FlowNode]:
         """
@@ -171,6 +268,7 @@ class Flow(object):
                 raise InvalidState("It is not possible to advance to this step because its predicate is false")
 
         self._current_step = next_step
+        self.last_activity = monotonic()
 
     @property
     def name(self) -> str:
@@ -200,7 +298,8 @@ class Flow(object):
         return is_room or self.requestor == identifier
 
     def __str__(self):
-        return "%s (%s) with params %s" % (self._root, self.requestor, dict(self.ctx))
+        params = 'spilled to the storage' if self.spilled else dict(self._ctx or {})
+        return "%s (%s) with params %s" % (self._root, self.requestor, params)
 
 
 class BotFlow:
@@ -245,24 +344,127 @@ class BotFlow:
         self._bot.all_commands.get(command_name, None)
 
 
+class TimerWheel(object):
+    """
+    Hashed timing wheel: scheduling and cancelling a timer is O(1), and advancing the wheel only looks at the
+    slots of the ticks elapsed. The timers due after a full turn of the wheel wait in their slot for the next turns.
+    """
+
+    def __init__(self, tick: float = TIMER_TICK, slots: int = TIMER_SLOTS, now: float = None):
+        """
+        :param tick: the resolution of the timers in seconds.
+        :param slots: the number of slots of the wheel.
+        :param now: the current time, from time.monotonic by default.
+        """
+        self._tick = tick
+        self._slots = [{} for _ in range(slots)]  # key -> tick of the deadline
+        self._timers = {}  # key -> tick of the deadline
+        self._current = self._to_tick(monotonic() if now is None else now)
+
+    def _to_tick(self, timestamp: float) -> int:
+        return int(timestamp // self._tick)
+
+    def schedule(self, key: Hashable, deadline: float) -> None:
+        """
+        Schedule or reschedule the timer key, it will be returned by advance once deadline is passed.
+        """
+        self.cancel(key)
+        tick = max(self._to_tick(deadline), self._current + 1)
+        self._slots[tick % len(self._slots)][key] = tick
+        self._timers[key] = tick
+
+    def cancel(self, key: Hashable) -> None:
+        tick = self._timers.pop(key, None)
+        if tick is not None:
+            del self._slots[tick % len(self._slots)][key]
+
+    def advance(self, now: float = None) -> List[Hashable]:
+        """
+        Move the wheel to now.
+        :return: the keys of the timers that expired, they are removed from the wheel.
+        """
+        target = self._to_tick(monotonic() if now is None else now)
+        expired = []
+        # after a long pause, each slot only needs to be looked at once.
+        for tick in range(max(self._current + 1, target - len(self._slots) + 1), target + 1):
+            slot = self._slots[tick % len(self._slots)]
+            for key in [key for key, deadline in slot.items() if deadline <= target]:
+                del slot[key]
+                del self._timers[key]
+                expired.append(key)
+        self._current = max(self._current, target)
+        return expired
+
+    def __len__(self):
+        return len(self._timers)
+
+    def __contains__(self, key: Hashable):
+        return key in self._timers
+
+
+def _identity_key(identifier: Identifier) -> Tuple[str, str]:
+    """
+    Key indexing the flows by requestor: identifiers equal to each other have the same key.
+    Persons (and room occupants) are keyed by person and rooms by name, the candidates found under a key are
+    still checked with Flow.check_identifier.
+    """
+    if isinstance(identifier, Room):
+        return 'room', str(identifier)
+    person = getattr(identifier, 'person', None)
+    if person is not None:
+        return 'person', str(person)
+    return 'other', str(identifier)
+
+
 class FlowExecutor(object):
     """
     This is a instance that can monitor and execute flow instances.
+
+    The flows in flight are indexed by requestor and by the commands their current step waits for,
+    and the flow roots by their auto-triggers, so finding the flow a command belongs to doesn't depend
+    on the number of flows running.
+
+    The idle timeouts, maximum lifetimes and spills of the contexts to the storage are timers of a TimerWheel
+    advanced by a background thread, they are rescheduled every time a flow advances.
     """
 
     def __init__(self, bot):
         self._lock = RLock()
         self.flow_roots = {}
-        self.in_flight = []
-        self._pool = ThreadPool(EXECUTOR_THREADS)
+        self.in_flight = set()
+        self._by_requestor = {}  # identity key -> flows in flight
+        self._by_command = {}  # command -> flows in flight with a next step on this command
+        self._awaited = {}  # flow -> commands it is indexed under in _by_command
+        self._auto_triggers = {}  # command -> flow roots it auto-triggers, in registration order
         self._bot = bot
+        config = getattr(bot, 'bot_config', None)
+        self._pool = ThreadPool(getattr(config, 'FLOW_EXECUTOR_THREADS', EXECUTOR_THREADS))
+        self._branch_threads = getattr(config, 'FLOW_BRANCH_THREADS', BRANCH_THREADS)
+        self._branch_pool = None  # created at the first fork
+        self.idle_timeout = getattr(config, 'FLOW_IDLE_TIMEOUT', None)
+        self.max_lifetime = getattr(config, 'FLOW_MAX_LIFETIME', None)
+        self.max_in_flight = getattr(config, 'FLOW_MAX_IN_FLIGHT', None)
+        self.max_in_flight_per_user = getattr(config, 'FLOW_MAX_IN_FLIGHT_PER_USER', None)
+        self.spill_after = getattr(config, 'FLOW_SPILL_AFTER', None)
+        self._wheel = TimerWheel()  # keys are (kind, flow), kind is 'idle', 'lifetime' or 'spill'
+        self._timers_stopped = Event()
+        self._timer_thread = None
+        self._spill_storage = None
+        self._executing = {}  # flow -> number of executions running its autosteps, they are never spilled
 
     def add_flow(self, flow: FlowRoot):
         """
         Register a flow with this executor.
         """
         with self._lock:
+            previous = self.flow_roots.get(flow.name)
+            if previous is not None:
+                for roots in self._auto_triggers.values():
+                    if previous in roots:
+                        roots.remove(previous)
             self.flow_roots[flow.name] = flow
+            for cmd in flow.auto_triggers:
+                self._auto_triggers.setdefault(cmd, []).append(flow)
 
     def trigger(self, cmd: str, requestor: Identifier, extra_context=None) -> Flow:
         """
@@ -279,19 +481,28 @@ class FlowExecutor(object):
         if not flow:
             return None
 
-        flow.advance(next_step, enforce_predicate=False)
+        self._advance(flow, next_step, enforce_predicate=False)
         if extra_context:
             flow.ctx = dict(extra_context)
         self._enqueue_flow(flow)
         return flow
 
+    def _candidates(self, user: Identifier) -> List[Flow]:
+        """
+        The flows in flight that may match user, see Flow.check_identifier.
+        """
+        flows = list(self._by_requestor.get(_identity_key(user), ()))
+        if isinstance(user, RoomOccupant):
+            flows.extend(self._by_requestor.get(_identity_key(user.room), ()))
+        return flows
+
     def check_inflight_already_running(self, user: Identifier) -> bool:
         """
             Check if user is already running a flow.
         :param user: the user
         """
         with self._lock:
-            for flow in self.in_flight:
+            for flow in self._by_requestor.get(_identity_key(user), ()):
                 if flow.requestor == user:
                     return True
         return False
@@ -305,13 +516,14 @@ class FlowExecutor(object):
         log.debug("Test if the command %s is a trigger for an inflight flow ...", cmd)
         # TODO: What if 2 flows wait for the same command ?
         with self._lock:
-            for flow in self.in_flight:
-                if flow.check_identifier(user):
-                    log.debug("Requestor has a flow %s in flight", flow.name)
-                    for next_step in flow.next_steps():
-                        if next_step.command == cmd:
-                            log.debug("Requestor has a flow in flight waiting for this command !")
-                            return flow, next_step
+            waiting = self._by_command.get(cmd)
+            if waiting:
+                for flow in self._candidates(user):
+                    if flow in waiting and flow.check_identifier(user):
+                        for next_step in flow.next_steps():
+                            if next_step.command == cmd:
+                                log.debug("Requestor has a flow %s in flight waiting for this command !", flow.name)
+                                return flow, next_step
         log.debug("None matched.")
         return None, None
 
@@ -325,10 +537,16 @@ class FlowExecutor(object):
         """
         log.debug("Test if the command %s is an auto-trigger for any flow ...", cmd)
         with self._lock:
-            for name, flow_root in self.flow_roots.items():
-                if cmd in flow_root.auto_triggers and not self.check_inflight_already_running(user):
-                    log.debug("Flow %s has been auto-triggered by the command %s by user %s", name, cmd, user)
-                    return self._create_new_flow(flow_root, user, cmd)
+            roots = self._auto_triggers.get(cmd)
+            if roots and not self.check_inflight_already_running(user):
+                flow_root = roots[0]
+                try:
+                    self._check_capacity(user)
+                except ValueError as e:
+                    log.warning("Flow %s not auto-triggered: %s", flow_root.name, e)
+                    return None, None
+                log.debug("Flow %s has been auto-triggered by the command %s by user %s", flow_root.name, cmd, user)
+                return self._create_new_flow(flow_root, user, cmd)
         return None, None
 
     @staticmethod
@@ -359,40 +577,179 @@ class FlowExecutor(object):
             identity = requestor.room
 
         flow = Flow(self.flow_roots[name], identity, initial_context)
-        self._enqueue_flow(flow)
+        with self._lock:
+            self._check_capacity(identity)
+            self._enqueue_flow(flow)
         return flow
 
+    def _check_capacity(self, identity: Identifier):
+        """
+        :raises ValueError: if there is no room for a new flow of identity.
+        """
+        if self.max_in_flight is not None and len(self.in_flight) >= self.max_in_flight:
+            raise ValueError("Too many flows are running, the maximum is %d." % self.max_in_flight)
+        per_user = self.max_in_flight_per_user
+        if per_user is not None and len(self._by_requestor.get(_identity_key(identity), ())) >= per_user:
+            raise ValueError("%s is running too many flows, the maximum is %d." % (identity, per_user))
+
     def stop_flow(self, name: str, requestor: Identifier) -> Flow:
         """
         Stops a specific flow. It is a no op if the flow doesn't exist.
         Returns the stopped flow if found.
         """
         with self._lock:
-            for flow in self.in_flight:
+            for flow in self._candidates(requestor):
                 if flow.name == name and flow.check_identifier(requestor):
                     log.debug("Removing flow %s." % str(flow))
-                    self.in_flight.remove(flow)
+                    self._remove(flow)
                     return flow
         return None
 
+    def _index_steps(self, flow: Flow):
+        commands = {step.command for step in flow.next_steps() if step.command}
+        self._awaited[flow] = commands
+        for cmd in commands:
+            self._by_command.setdefault(cmd, set()).add(flow)
+
+    def _unindex_steps(self, flow: Flow):
+        for cmd in self._awaited.pop(flow, ()):
+            waiting = self._by_command[cmd]
+            waiting.discard(flow)
+            if not waiting:
+                del self._by_command[cmd]
+
+    def _advance(self, flow: Flow, next_step: FlowNode, enforce_predicate=True):
+        """
+        Flow.advance keeping the index of the awaited commands up to date.
+        """
+        with self._lock:
+            flow.advance(next_step, enforce_predicate)
+            if flow in self.in_flight:
+                self._unindex_steps(flow)
+                self._index_steps(flow)
+                self._schedule_idle_timers(flow)
+
+    def _remove(self, flow: Flow):
+        with self._lock:
+            if flow not in self.in_flight:
+                return  # already stopped
+            self.in_flight.remove(flow)
+            self._unindex_steps(flow)
+            for kind in ('idle', 'lifetime', 'spill'):
+                self._wheel.cancel((kind, flow))
+            flow.discard()
+            key = _identity_key(flow.requestor)
+            flows = self._by_requestor[key]
+            flows.discard(flow)
+            if not flows:
+                del self._by_requestor[key]
+
     def _enqueue_flow(self, flow):
         with self._lock:
             if flow not in self.in_flight:
-                self.in_flight.append(flow)
+                self.in_flight.add(flow)
+                self._by_requestor.setdefault(_identity_key(flow.requestor), set()).add(flow)
+                self._index_steps(flow)
+                max_lifetime = flow.root.max_lifetime if flow.root.max_lifetime is not None else self.max_lifetime
+                if max_lifetime:
+                    self._schedule(('lifetime', flow), flow.started + max_lifetime)
+            self._schedule_idle_timers(flow)
         self._pool.apply_async(self.execute, (flow,))
 
+    def _schedule(self, key: Tuple[str, Flow], deadline: float):
+        self._wheel.schedule(key, deadline)
+        if self._timer_thread is None:
+            self._timer_thread = Thread(target=self._run_timers, name='flow timers', daemon=True)
+            self._timer_thread.start()
+
+    def _schedule_idle_timers(self, flow: Flow):
+        idle_timeout = flow.root.idle_timeout if flow.root.idle_timeout is not None else self.idle_timeout
+        if idle_timeout:
+            self._schedule(('idle', flow), flow.last_activity + idle_timeout)
+        if self.spill_after:
+            self._schedule(('spill', flow), flow.last_activity + self.spill_after)
+
+    def _run_timers(self):
+        while not self._timers_stopped.wait(TIMER_TICK):
+            try:
+                self.expire_flows()
+            except Exception:
+                log.exception('Failed to expire the flows.')
+
+    def expire_flows(self, now: float = None) -> List[Flow]:
+        """
+        Stop the flows idle or running for too long and spill the contexts of the idle flows to the storage.
+        This is done every second by a background thread.
+        :param now: the current time, from time.monotonic by default.
+        :returns: the flows stopped.
+        """
+        with self._lock:
+            timers = self._wheel.advance(now)
+        stopped = []
+        for kind, flow in timers:
+            with self._lock:
+                if flow not in self.in_flight:
+                    continue
+                if kind == 'spill':
+                    if flow in self._executing:  # its steps use the context, try again later
+                        self._schedule(('spill', flow), (monotonic() if now is None else now) + self.spill_after)
+                    else:
+                        self._spill(flow)
+                    continue
+                self._remove(flow)
+            reason = 'it was idle for too long' if kind == 'idle' else 'it ran for too long'
+            log.info("Flow %s stopped: %s.", flow, reason)
+            stopped.append(flow)
+            if self._bot is not None:
+                self._bot.send(flow.requestor, "The flow **%s** has been stopped: %s." % (flow.name, reason))
+        return stopped
+
+    def _spill(self, flow: Flow):
+        if self._spill_storage is None:
+            storage_plugin = getattr(self._bot, 'storage_plugin', None)
+            if storage_plugin is None:
+                return
+            self._spill_storage = storage_plugin.open(SPILL_NAMESPACE)
+            # the contexts spilled by a previous run belong to flows that don't exist anymore.
+            self._spill_storage.remove_many(list(self._spill_storage.keys()))
+        try:
+            flow.spill(self._spill_storage, uuid4().hex)
+        except Exception:
+            log.exception("Could not spill the context of %s, it stays in memory.", flow)
+
+    def shutdown(self):
+        """
+        Stop the timers and close the storage of the spilled contexts.
+        """
+        self._timers_stopped.set()
+        with self._lock:
+            if self._spill_storage is not None:
+                self._spill_storage.close()
+                self._spill_storage = None
+
     def execute(self, flow: Flow):
         """
         This is where the flow execution happens from one of the thread of the pool.
         """
+        with self._lock:
+            self._executing[flow] = self._executing.get(flow, 0) + 1
+        try:
+            self._execute(flow)
+        finally:
+            with self._lock:
+                if self._executing[flow] == 1:
+                    del self._executing[flow]
+                else:
+                    self._executing[flow] -= 1
+
+    def _execute(self, flow: Flow):
         while True:
             autosteps = flow.next_autosteps()
             steps = flow.next_steps()
 
             if not steps:
                 log.debug("Flow ended correctly.Nothing left to do.")
-                with self._lock:
-                    self.in_flight.remove(flow)
+                self._remove(flow)
                 break
 
             if not autosteps and flow.current_step.hints:
@@ -416,21 +773,47 @@ class FlowExecutor(object):
             log.debug("Steps triggered automatically %s", ', '.join(str(node) for node in autosteps))
             log.debug("All possible next steps: %s", ', '.join(str(node) for node in steps))
 
-            for autostep in autosteps:
-                log.debug("Proceeding automatically with step %s", autostep)
-                if autostep == FLOW_END:
-                    log.debug('This flow ENDED.')
-                    with self._lock:
-                        self.in_flight.remove(flow)
-                    return
-                try:
-                    msg = Message(frm=flow.requestor, flow=flow)
-                    result = self._bot.commands[autostep.command](msg, None)
-                    log.debug('Step result %s: %s', flow.requestor, result)
-
-                except Exception as e:
-                    log.exception('%s errored at %s', flow, autostep)
-                    self._bot.send(flow.requestor,
-                                   '%s errored at %s with "%s"' % (flow, autostep, e))
-                flow.advance(autostep)  # TODO: this is only true for a single step, make it forkable.
+            commands = [step for step in autosteps if step is not FLOW_END]
+            if len(commands) > 1:
+                self._execute_branches(flow, commands)
+            elif commands:
+                self._execute_step(flow, commands[0], flow.ctx)
+            if len(commands) < len(autosteps):
+                log.debug('This flow ENDED.')
+                self._remove(flow)
+                return
+            self._advance(flow, commands[0])
         log.debug("Flow execution suspended/ended normally.")
+
+    def _execute_step(self, flow: Flow, step: FlowNode, ctx: dict) -> bool:
+        """
+        Execute the command of a step with ctx as the context of the message.
+        :returns: True if the command succeeded.
+        """
+        log.debug("Proceeding automatically with step %s", step)
+        try:
+            msg = Message(frm=flow.requestor, flow=flow)
+            msg.ctx = ctx
+            result = self._bot.commands[step.command](msg, None)
+            log.debug('Step result %s: %s', flow.requestor, result)
+            return True
+        except Exception as e:
+            log.exception('%s errored at %s', flow, step)
+            self._bot.send(flow.requestor, '%s errored at %s with "%s"' % (flow, step, e))
+            return False
+
+    def _execute_branches(self, flow: Flow, steps: List[FlowNode]):
+        """
+        Fork the flow: execute the steps concurrently, each on its own copy of the context, then merge the
+        contexts of the steps that succeeded.
+        """
+        log.debug("Forking %s in %d branches", flow, len(steps))
+        with self._lock:
+            if self._branch_pool is None:
+                self._branch_pool = ThreadPool(self._branch_threads)
+        base = flow.ctx
+        contexts = [dict(base) for _ in steps]
+        results = [self._branch_pool.apply_async(self._execute_step, (flow, step, ctx))
+                   for step, ctx in zip(steps, contexts)]
+        succeeded = [ctx for ctx, result in zip(contexts, results) if result.get()]
+        flow.ctx = flow.root.merge(base, succeeded)
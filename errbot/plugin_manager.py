@@ -12,14 +12,14 @@ from pathlib import Path
 
 from typing import Tuple, Sequence, Dict, Union, Any, Type, Set, List
 
-from errbot.flow import BotFlow, Flow
+from errbot.flow import BotFlow, Flow, SPILL_NAMESPACE
 from .botplugin import BotPlugin
 from .plugin_info import PluginInfo
 from .utils import version2tuple, collect_roots
 from .templating import remove_plugin_templates_path, add_plugin_templates_path
 from .version import VERSION
 from .core_plugins.wsview import route
-from .storage import StoreMixin
+from .storage import StoreMixin, PersistedDict
 
 log = logging.getLogger(__name__)
 
@@ -189,7 +189,10 @@ class BotPluginManager(StoreMixin):
         self.plugin_places = []
         self.open_storage(storage_plugin, 'core')
         if CONFIGS not in self:
-            self[CONFIGS] = {}
+            self[CONFIGS] = PersistedDict()
+        elif not isinstance(self[CONFIGS], PersistedDict):
+            log.info('Migrating the plugin configurations to one storage entry per plugin.')
+            self[CONFIGS] = PersistedDict(self[CONFIGS])
 
     def attach_bot(self, bot):
         self.bot = bot
@@ -253,6 +256,9 @@ class BotPluginManager(StoreMixin):
             try:
                 plugin_info = PluginInfo.load(plugfile)
                 name = plugin_info.name
+                if name.lower() == SPILL_NAMESPACE:
+                    feedback[path] = 'The name %s is reserved for the storage of the flows.' % name
+                    continue
                 if name in dest_info_dict:
                     log.warning('Plugin %s already loaded.', name)
                     continue
@@ -372,10 +378,8 @@ class BotPluginManager(StoreMixin):
         return configs[name]
 
     def set_plugin_configuration(self, name, obj):
-        # TODO: port to with statement
-        configs = self[CONFIGS]
-        configs[name] = obj
-        self[CONFIGS] = configs
+        with self.mutable(CONFIGS) as configs:
+            configs[name] = obj  # only this configuration is written
 
     # this will load the plugins the admin has setup at runtime
     def update_dynamic_plugins(self):
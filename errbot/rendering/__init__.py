@@ -1,5 +1,7 @@
 # vim: noai:ts=4:sw=4
 import re
+from functools import lru_cache
+from threading import Lock
 
 from markdown import Markdown
 from markdown.extensions.extra import ExtraExtension
@@ -85,6 +87,27 @@ def xhtml():
     return Markdown(output_format='xhtml', extensions=[ExtraExtension()])
 
 
+class CachedConverter(object):
+    """Wraps a converter to render the same text only once, for example when a message
+    is broadcasted to many recipients. It also serializes the calls to the wrapped
+    converter as the Markdown instances are not thread safe.
+
+    from errbot.rendering import text, CachedConverter
+    md_converter = CachedConverter(text())
+    """
+    def __init__(self, converter, maxsize=16):
+        self._converter = converter
+        self._lock = Lock()
+        self.convert = lru_cache(maxsize)(self._convert)
+
+    def _convert(self, mde):
+        with self._lock:
+            return self._converter.convert(mde)
+
+    def __getattr__(self, name):
+        return getattr(self._converter, name)
+
+
 def md_escape(txt):
     """ Call this if you want to be sure your text won't be interpreted as markdown
     :param txt: bare text to escape.
@@ -0,0 +1,272 @@
+import heapq
+import logging
+from multiprocessing.pool import ThreadPool
+from random import uniform
+from threading import Condition, Thread
+from time import monotonic
+from typing import Any, Callable, Dict, List, Mapping, Tuple
+
+log = logging.getLogger(__name__)
+
+# What to do when a poller is due while its previous call is still running.
+SKIP = 'skip'  # skip this call.
+QUEUE = 'queue'  # call it again as soon as the previous call ends, at most one call waits.
+ALLOW = 'allow'  # call it anyway, concurrently.
+OVERLAP_POLICIES = (SKIP, QUEUE, ALLOW)
+
+
+def _method_key(method: Callable[..., None]) -> str:
+    # bound methods of plugins are not hashable, the plugins aren't.
+    return getattr(method, '__qualname__', None) or repr(method)
+
+
+class Poller(object):
+    """ A method called at a regular interval by the PollerScheduler.
+    """
+
+    def __init__(self, owner: Any, interval: float, method: Callable[..., None], times: int = None, args: Tuple = (),
+                 kwargs: Mapping = None, jitter: float = 0, overlap: str = SKIP):
+        self.owner = owner
+        self.interval = interval
+        self.method = method
+        self.times = times  # the number of calls left, None for no limit
+        self.args = tuple(args)
+        self.kwargs = dict(kwargs or {})
+        self.jitter = jitter
+        self.overlap = overlap
+        self.scheduled = None  # the time of the next call without the jitter
+        self.running = 0  # the number of calls in progress
+        self.queued = False
+        self.stopped = False
+        # statistics
+        self.runs = 0
+        self.failures = 0
+        self.skipped = 0  # calls not made because the previous one was still running
+        self.overruns = 0  # calls that took longer than the interval
+        self.last_duration = None
+        self.total_duration = 0.0
+        self.max_duration = 0.0
+
+    def matches(self, method: Callable[..., None], args: Tuple, kwargs: Mapping) -> bool:
+        return self.method == method and self.args == tuple(args) and self.kwargs == dict(kwargs or {})
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'plugin': getattr(self.owner, 'name', str(self.owner)),
+            'method': str(self),
+            'interval': self.interval,
+            'overlap': self.overlap,
+            'running': self.running,
+            'runs': self.runs,
+            'failures': self.failures,
+            'skipped': self.skipped,
+            'overruns': self.overruns,
+            'last_duration': self.last_duration,
+            'avg_duration': self.total_duration / self.runs if self.runs else None,
+            'max_duration': self.max_duration,
+        }
+
+    def __str__(self):
+        return getattr(self.method, '__qualname__', str(self.method))
+
+
+class PollerScheduler(object):
+    """ Calls the pollers of all the plugins from a single thread.
+
+    The deadlines are kept in a min-heap, the due pollers are called by a pool of workers. The pollers run at a
+    fixed rate: the next call is scheduled from the previous deadline, not from the end of the previous call, so they
+    don't drift. When a poller is still running when it is due again, its overlap policy tells if this call is
+    skipped, queued or made concurrently.
+    """
+
+    def __init__(self, poolsize: int = 10):
+        """
+        :param poolsize: the number of pollers that can run at the same time.
+        """
+        self._poolsize = poolsize
+        self._pool = None
+        self._thread = None
+        self._condition = Condition()
+        self._heap = []  # (deadline, sequence, poller)
+        self._sequence = 0  # orders the pollers due at the same time
+        self._stopped_in_heap = 0  # stopped pollers still in the heap, they are removed lazily
+        self._pollers = {}  # id of the owner -> qualified name of the method -> [Poller]
+        self._shutdown = False
+
+    def start(self, owner: Any, interval: float, method: Callable[..., None], times: int = None, args: Tuple = (),
+              kwargs: Mapping = None, jitter: float = 0, overlap: str = SKIP) -> Poller:
+        """
+        Call method every interval seconds, the first time after interval.
+
+        :param owner: what the poller belongs to, a plugin for example, see stop_all.
+        :param interval: interval in seconds.
+        :param method: the method to call.
+        :param times: the number of calls, None to call it until it is stopped.
+        :param args: args for the method.
+        :param kwargs: kwargs for the method.
+        :param jitter: a random delay between 0 and jitter seconds is added to every call, to spread the
+                       pollers started at the same time.
+        :param overlap: SKIP, QUEUE or ALLOW, what to do when the poller is due while still running.
+        """
+        if not interval > 0:
+            raise ValueError('The interval of a poller should be a positive number of seconds, not %r.' % interval)
+        if overlap not in OVERLAP_POLICIES:
+            policies = ', '.join(OVERLAP_POLICIES)
+            raise ValueError('Unknown overlap policy %s, it should be one of %s.' % (overlap, policies))
+        poller = Poller(owner, interval, method, times, args, kwargs, jitter, overlap)
+        if times is not None and times <= 0:
+            return poller
+        with self._condition:
+            self._pollers.setdefault(id(owner), {}).setdefault(_method_key(method), []).append(poller)
+            poller.scheduled = monotonic() + interval
+            self._push(poller)
+            if self._thread is None:
+                self._pool = ThreadPool(self._poolsize)
+                self._thread = Thread(target=self._run, name='poller scheduler', daemon=True)
+                self._thread.start()
+        return poller
+
+    def stop(self, owner: Any, method: Callable[..., None], args: Tuple = (), kwargs: Mapping = None) -> bool:
+        """
+        Stop the poller of owner with these method, args and kwargs.
+
+        :return: True if it was found.
+        """
+        with self._condition:
+            for poller in self._pollers.get(id(owner), {}).get(_method_key(method), ()):
+                if poller.matches(method, args, kwargs):
+                    self._remove(poller)
+                    return True
+        return False
+
+    def stop_all(self, owner: Any) -> int:
+        """
+        Stop all the pollers of owner.
+
+        :return: the number of pollers stopped.
+        """
+        with self._condition:
+            pollers = [poller for pollers in self._pollers.get(id(owner), {}).values() for poller in pollers]
+            for poller in pollers:
+                self._remove(poller)
+        return len(pollers)
+
+    def pollers(self, owner: Any) -> List[Poller]:
+        with self._condition:
+            return [poller for pollers in self._pollers.get(id(owner), {}).values() for poller in pollers]
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """
+        :return: the statistics of the calls of every poller, see Poller.stats.
+        """
+        with self._condition:
+            return [poller.stats() for by_method in self._pollers.values()
+                    for pollers in by_method.values() for poller in pollers]
+
+    def shutdown(self):
+        with self._condition:
+            self._shutdown = True
+            self._condition.notify()
+        if self._pool is not None:
+            self._pool.close()
+
+    def _push(self, poller: Poller):
+        deadline = poller.scheduled + (uniform(0, poller.jitter) if poller.jitter else 0)
+        self._sequence += 1
+        heapq.heappush(self._heap, (deadline, self._sequence, poller))
+        self._condition.notify()
+
+    def _forget(self, poller: Poller):
+        poller.stopped = True
+        by_method = self._pollers[id(poller.owner)]
+        method_key = _method_key(poller.method)
+        by_method[method_key].remove(poller)
+        if not by_method[method_key]:
+            del by_method[method_key]
+        if not by_method:
+            del self._pollers[id(poller.owner)]
+
+    def _remove(self, poller: Poller):
+        """ Stop a poller waiting in the heap, its entry is only skipped when it comes up.
+        """
+        self._forget(poller)
+        poller.queued = False
+        self._stopped_in_heap += 1
+        if self._stopped_in_heap > len(self._heap) // 2:
+            # too many dead entries, rebuilding is cheaper than popping them one by one.
+            self._heap = [entry for entry in self._heap if not entry[2].stopped]
+            heapq.heapify(self._heap)
+            self._stopped_in_heap = 0
+
+    def _run(self):
+        with self._condition:
+            while not self._shutdown:
+                if not self._heap:
+                    self._condition.wait()
+                    continue
+                deadline, _, poller = self._heap[0]
+                now = monotonic()
+                if deadline > now:
+                    self._condition.wait(deadline - now)
+                    continue
+                heapq.heappop(self._heap)
+                if poller.stopped:
+                    self._stopped_in_heap -= 1
+                    continue
+                # noinspection PyBroadException
+                try:
+                    self._dispatch(poller, now)
+                except Exception:
+                    log.exception('Could not schedule the poller %s, it is stopped.', poller)
+                    if not poller.stopped:
+                        self._forget(poller)
+
+    def _dispatch(self, poller: Poller, now: float):
+        if poller.running and poller.overlap == SKIP:
+            log.debug('Poller %s is still running, skipping this call.', poller)
+            poller.skipped += 1
+        elif poller.running and poller.overlap == QUEUE and poller.queued:
+            log.debug('Poller %s is still running and has a call queued already, skipping this call.', poller)
+            poller.skipped += 1
+        else:
+            if poller.running and poller.overlap == QUEUE:
+                poller.queued = True  # called by _call at the end of the current call
+            else:
+                self._start_call(poller)
+            if poller.times is not None:
+                poller.times -= 1
+                if poller.times <= 0:
+                    self._forget(poller)
+                    return
+        poller.scheduled += poller.interval
+        if poller.scheduled <= now:  # late by more than an interval, skip the missed calls
+            missed = (now - poller.scheduled) // poller.interval + 1
+            poller.scheduled += missed * poller.interval
+        self._push(poller)
+
+    def _start_call(self, poller: Poller):
+        poller.running += 1
+        self._pool.apply_async(self._call, (poller,))
+
+    def _call(self, poller: Poller):
+        start = monotonic()
+        failed = False
+        # noinspection PyBroadException
+        try:
+            poller.method(*poller.args, **poller.kwargs)
+        except Exception:
+            log.exception('A poller crashed')
+            failed = True
+        duration = monotonic() - start
+        with self._condition:
+            poller.running -= 1
+            poller.runs += 1
+            poller.failures += failed
+            poller.last_duration = duration
+            poller.total_duration += duration
+            poller.max_duration = max(poller.max_duration, duration)
+            if duration > poller.interval:
+                poller.overruns += 1
+            if poller.queued and not self._shutdown:
+                poller.queued = False
+                self._start_call(poller)
@@ -1,9 +1,15 @@
 import types
-from collections import MutableMapping
+from collections import ItemsView, MutableMapping
 from contextlib import contextmanager
 import logging
+
+from .base import MISSING, Expiring, EXPIRING_INDEX, EXPIRING_MARKER  # noqa
 log = logging.getLogger(__name__)
 
+# The entries of a PersistedDict stored under the key 'foo' are stored under the keys SEPARATOR + 'foo' + SEPARATOR + k.
+# SEPARATOR alone is the key listing the PersistedDicts of the namespace.
+SEPARATOR = '\x00'
+
 
 class StoreException(Exception):
     pass
@@ -17,6 +23,117 @@ class StoreNotOpenError(StoreException):
     pass
 
 
+class PersistedDictMarker(object):
+    """ Stored in place of a PersistedDict, its entries are stored under their own keys.
+    """
+    def __eq__(self, other):
+        return isinstance(other, PersistedDictMarker)
+
+    def __hash__(self):
+        return hash(PersistedDictMarker)
+
+
+class PersistedDict(MutableMapping):
+    """
+    A dictionary persisted with one storage key per entry, to be used for big dictionaries
+    where only a few entries change at a time.
+
+    Store it like any other value, then modify it with mutable: only the entries set, deleted or
+    read within the with block are written back instead of the whole dictionary::
+
+        self['users'] = PersistedDict()
+        with self.mutable('users') as users:
+            users['gbin'] = {'karma': 12}
+
+    Its keys must be strings.
+    """
+
+    def __init__(*args, **kwargs):
+        self, *args = args
+        self._store = None
+        self._prefix = None
+        self._entries = {}  # the entries loaded or set
+        self._complete = True  # True if all the entries are in self._entries
+        self._read, self._dirty, self._removed = set(), set(), set()
+        self.update(*args, **kwargs)
+
+    @classmethod
+    def _bound(cls, store, key):
+        """ The PersistedDict stored under key, its entries are loaded on demand. """
+        persisted_dict = cls()
+        persisted_dict._store = store
+        persisted_dict._prefix = SEPARATOR + key + SEPARATOR
+        persisted_dict._complete = False
+        return persisted_dict
+
+    def __getitem__(self, key):
+        if key not in self._entries:
+            if self._complete or key in self._removed:
+                raise KeyError("%s doesn't exist." % key)
+            self._entries[key] = self._store.get(self._prefix + key)
+        self._read.add(key)
+        return self._entries[key]
+
+    def __setitem__(self, key, value):
+        if not isinstance(key, str) or SEPARATOR in key:
+            raise TypeError('The keys of a PersistedDict need to be strings, got %r.' % key)
+        self._entries[key] = value
+        self._dirty.add(key)
+        self._removed.discard(key)
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError("%s doesn't exist." % key)
+        self._entries.pop(key, None)
+        self._read.discard(key)
+        self._dirty.discard(key)
+        self._removed.add(key)
+
+    def __contains__(self, key):
+        if key in self._entries:
+            return True
+        if self._complete or key in self._removed or not isinstance(key, str):
+            return False
+        return self._store.contains(self._prefix + key)
+
+    def _keys(self):
+        if self._complete:
+            return list(self._entries)
+        size = len(self._prefix)
+        stored = {key[size:] for key in self._store.keys() if key.startswith(self._prefix)}
+        return list((stored - self._removed) | self._entries.keys())
+
+    def __iter__(self):
+        return iter(self._keys())
+
+    def __len__(self):
+        return len(self._keys())
+
+    def sync(self, include_read=False):
+        """
+        Write the changed entries to the storage.
+
+        :param include_read: also write the entries read since the last sync, in case they have been modified.
+        """
+        if self._store is None:
+            return
+        changed = self._dirty | self._read if include_read else self._dirty
+        self._store.remove_many([self._prefix + key for key in self._removed])
+        self._store.set_many({self._prefix + key: self._entries[key] for key in changed})
+        self._read, self._dirty, self._removed = set(), set(), set()
+
+    def __repr__(self):
+        # so it can be backed up and restored as a normal dict.
+        return repr(dict(self))
+
+
+class StoreItemsView(ItemsView):
+    """ Items view streaming the entries from the storage instead of getting them one key at a time.
+    """
+    def __iter__(self):
+        return self._mapping._items()
+
+
 class StoreMixin(MutableMapping):
     """
      This class handle the basic needs of bot plugins and core like loading, unloading and creating a storage
@@ -31,6 +148,8 @@ class StoreMixin(MutableMapping):
             raise StoreAlreadyOpenError("Storage appears to be opened already")
         log.debug("Opening storage '%s'" % namespace)
         self._store = storage_plugin.open(namespace)
+        self._persisted_dicts = None
+        self._expiring = None
         self.namespace = namespace
 
     def close_storage(self):
@@ -40,43 +159,227 @@ class StoreMixin(MutableMapping):
         self._store = None
         log.debug("Closed storage '%s'" % self.namespace)
 
+    def _get_persisted_dicts(self):
+        """ The keys holding a PersistedDict in this namespace, loaded once. """
+        if self._persisted_dicts is None:
+            try:
+                self._persisted_dicts = self._store.get(SEPARATOR)
+            except KeyError:
+                self._persisted_dicts = set()
+        return self._persisted_dicts
+
+    def _has_expiring_keys(self):
+        """ True if set_with_ttl has been used in this namespace, checked once. """
+        if self._expiring is None:
+            self._expiring = self._store.contains(EXPIRING_MARKER)
+        return self._expiring
+
+    def _has_hidden_keys(self):
+        return bool(self._get_persisted_dicts()) or self._has_expiring_keys()
+
+    def _remove_persisted_dict(self, key):
+        persisted_dicts = self._get_persisted_dicts()
+        if key in persisted_dicts:
+            prefix = SEPARATOR + key + SEPARATOR
+            self._store.remove_many([k for k in self._store.keys() if k.startswith(prefix)])
+            persisted_dicts.remove(key)
+            self._store.set(SEPARATOR, persisted_dicts)
+
+    def _set_persisted_dict(self, key, persisted_dict):
+        prefix = SEPARATOR + key + SEPARATOR
+        entries = {prefix + k: v for k, v in persisted_dict.items()}  # before it is removed if it is stored there
+        self._remove_persisted_dict(key)
+        self._store.set_many(entries)
+        self._store.set(key, PersistedDictMarker())
+        persisted_dicts = self._get_persisted_dicts()
+        persisted_dicts.add(key)
+        self._store.set(SEPARATOR, persisted_dicts)
+
+    def _load(self, key, value):
+        if isinstance(value, Expiring):
+            if value.expired():
+                raise KeyError("%s doesn't exist." % key)  # it is removed by the next compaction.
+            return value.value
+        if isinstance(value, PersistedDictMarker):
+            return PersistedDict._bound(self._store, key)
+        return value
+
     # those are the minimal things to behave like a dictionary with the UserDict.DictMixin
     def __getitem__(self, key):
-        return self._store.get(key)
+        return self._load(key, self._store.get(key))
 
     @contextmanager
     def mutable(self, key):
-        obj = self._store.get(key)
-        yield obj
-        # implements autosave for a plugin persistent entry
-        # with self['foo'] as f:
-        #     f[4] = 2
-        # saves the entry !
-        self._store.set(key, obj)
+        # the key is locked so concurrent mutable, atomic_update and compare_and_set on it don't lose updates.
+        with self._store.lock(key):
+            stored = self._store.get(key)
+            obj = self._load(key, stored)
+            yield obj
+            # implements autosave for a plugin persistent entry
+            # with self['foo'] as f:
+            #     f[4] = 2
+            # saves the entry !
+            if isinstance(obj, PersistedDict):
+                obj.sync(include_read=True)  # only the entries touched in the with block are saved
+            elif isinstance(stored, Expiring):
+                self._store.set(key, stored._replace(value=obj))  # keeps its deadline
+            else:
+                self._store.set(key, obj)
+
+    def atomic_update(self, key, fn, default=MISSING):
+        """
+        Atomically replace the value of key by fn(value), for example to increment a counter::
+
+            self.atomic_update('count', lambda count: count + 1, default=0)
+
+        :param key: the key.
+        :param fn: computes the new value from the current one, it can be called with a copy of
+                   the value and should not have side effects.
+        :param default: the value given to fn if the key doesn't exist, a KeyError is raised if not set.
+        :return: the new value.
+        """
+        def update(value):
+            if not isinstance(value, Expiring):
+                return fn(value)
+            if not value.expired():
+                return value._replace(value=fn(value.value))
+            if default is MISSING:
+                raise KeyError("%s doesn't exist." % key)
+            return fn(default)
+
+        value = self._store.update(key, update, default)
+        return value.value if isinstance(value, Expiring) else value
+
+    def set_with_ttl(self, key, value, ttl):
+        """
+        Set a key that expires after ttl seconds, for example to cache the result of an external API::
+
+            self.set_with_ttl('preview:' + url, preview, 24 * 3600)
+
+        An expired key can't be read anymore, and it is removed by the periodic compaction
+        of the storages (see STORAGE_COMPACTION_INTERVAL in config.py).
+
+        :param key: the key.
+        :param value: the value, it can't be a PersistedDict.
+        :param ttl: the number of seconds before the key expires.
+        """
+        if isinstance(value, PersistedDict):
+            raise TypeError('A PersistedDict can\'t expire.')
+        with self._store.lock(key):
+            self._remove_persisted_dict(key)
+            self._store.set_with_ttl(key, value, ttl)
+        self._expiring = True
+
+    def compact_storage(self):
+        """
+        Remove the expired keys from the storage.
+
+        :return: the number of keys removed.
+        """
+        return self._store.compact()
+
+    def compare_and_set(self, key, expected, value):
+        """
+        Atomically set key to value only if its current value is equal to expected.
+
+        :param key: the key.
+        :param expected: the value key should have, errbot.storage.MISSING to set it only if it doesn't exist.
+        :param value: the new value.
+        :return: True if the value has been set.
+        """
+        return self._store.compare_and_set(key, expected, value)
+
+    # the writes take the key lock so they don't interleave with mutable, the atomic operations and the compaction.
 
     def __setitem__(self, key, item):
-        return self._store.set(key, item)
+        with self._store.lock(key):
+            if isinstance(item, PersistedDict):
+                return self._set_persisted_dict(key, item)
+            self._remove_persisted_dict(key)
+            return self._store.set(key, item)
 
     def __delitem__(self, key):
-        return self._store.remove(key)
+        with self._store.lock(key):
+            self._store.remove(key)
+            self._remove_persisted_dict(key)
 
     def keys(self):
+        if self._has_expiring_keys():
+            keys = list(self._store.keys())
+            # only the values of the keys past their deadline in the expiry index are decoded.
+            candidates = [key for key, _ in self._store.expired_keys(keys)]
+            expired = {key for key, value in self._store.get_many(candidates).items()
+                       if isinstance(value, Expiring) and value.expired()}
+            return [key for key in keys if not key.startswith(SEPARATOR) and key not in expired]
+        if self._get_persisted_dicts():
+            return [key for key in self._store.keys() if not key.startswith(SEPARATOR)]
         return self._store.keys()
 
     def __len__(self):
+        if self._has_hidden_keys():
+            return len(self.keys())
         return self._store.len()
 
     def __iter__(self):
-        for i in self._store.keys():
+        for i in self.keys():
             yield i
 
     def __contains__(self, x):
+        if not self._store.contains(x):
+            return False
+        if not self._has_expiring_keys():
+            return True
         try:
-            self._store.get(x)
+            self[x]
             return True
         except KeyError:
             return False
 
+    def items(self):
+        return StoreItemsView(self)
+
+    def _items(self):
+        hidden = self._has_hidden_keys()
+        for key, value in self._store.items():
+            if hidden and key.startswith(SEPARATOR):
+                continue
+            try:
+                yield key, self._load(key, value)
+            except KeyError:
+                pass  # expired
+
+    def get_many(self, keys):
+        """
+        Get the values of several keys at once.
+
+        :param keys: the keys to get.
+        :return: a dictionary of the keys found and their values.
+        """
+        result = {}
+        for key, value in self._store.get_many(keys).items():
+            try:
+                result[key] = self._load(key, value)
+            except KeyError:
+                pass  # expired
+        return result
+
+    def update(*args, **kwds):
+        # same signature as MutableMapping.update, which sets the entries one by one.
+        self, *args = args
+        entries = dict(*args, **kwds)
+        for key in [key for key, value in entries.items() if isinstance(value, PersistedDict)]:
+            self[key] = entries.pop(key)
+        with self._store.lock_many(entries):
+            for key in self._get_persisted_dicts() & entries.keys():
+                self._remove_persisted_dict(key)
+            if entries:
+                self._store.set_many(entries)
+
+    def clear(self):
+        self._store.remove_many(list(self._store.keys()))
+        self._persisted_dicts = set()
+        self._expiring = False
+
     # compatibility with with
     def __enter__(self):
         return self
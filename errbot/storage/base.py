@@ -1,5 +1,31 @@
 from abc import abstractmethod
-from typing import Any, Iterable
+from contextlib import contextmanager, ExitStack
+from threading import Lock, RLock
+from time import time
+from typing import Any, Callable, Dict, Iterable, Iterator, Mapping, NamedTuple, Tuple
+
+from errbot.storage.serialization import Codec
+
+MISSING = object()  # stands for a key that doesn't exist in update and compare_and_set
+
+_key_locks_creation = Lock()
+
+# set in the namespaces having keys with a ttl, so compact can skip the others.
+EXPIRING_MARKER = '\x00ttl'
+# the deadline of a key with a ttl is also stored under EXPIRING_INDEX + key, so the expired keys can be found
+# without decoding all the values.
+EXPIRING_INDEX = EXPIRING_MARKER + '\x00'
+
+
+class Expiring(NamedTuple):
+    """
+    Stored in place of the value of a key with a ttl.
+    """
+    value: Any
+    deadline: float  # in seconds since the epoch, so it survives restarts
+
+    def expired(self, now: float = None) -> bool:
+        return self.deadline <= (time() if now is None else now)
 
 
 class StorageBase(object):
@@ -62,6 +88,213 @@ class StorageBase(object):
         """
         pass
 
+    # The following methods have generic implementations based on the ones above,
+    # override them if your storage can do better.
+
+    @contextmanager
+    def lock(self, key: str) -> Iterator[None]:
+        """
+        A reentrant lock protecting key against the other threads using lock, update, compare_and_set,
+        set_with_ttl, compact or the writes of StoreMixin on it. Every key has its own lock, created when it
+        is needed and dropped when no thread holds it or waits for it anymore, so different keys never wait
+        on each other.
+
+        :param key: the key
+        """
+        locks = getattr(self, '_key_locks', None)
+        if locks is None:
+            with _key_locks_creation:
+                locks = getattr(self, '_key_locks', None)
+                if locks is None:
+                    locks = self._key_locks = ({}, Lock())  # key -> [lock, number of users], guard
+        users, guard = locks
+        with guard:
+            entry = users.get(key)
+            if entry is None:
+                entry = users[key] = [RLock(), 0]
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with guard:
+                entry[1] -= 1
+                if not entry[1]:
+                    del users[key]
+
+    @contextmanager
+    def lock_many(self, keys: Iterable[str]) -> Iterator[None]:
+        """
+        Take the locks of several keys, always in the same order so two threads locking overlapping keys
+        don't deadlock.
+
+        :param keys: the keys
+        """
+        with ExitStack() as stack:
+            for key in sorted(set(keys)):
+                stack.enter_context(self.lock(key))
+            yield
+
+    def update(self, key: str, fn: Callable[[Any], Any], default: Any = MISSING) -> Any:
+        """
+        Atomically replace the value of key by fn(value).
+
+        :param key: the key
+        :param fn: computes the new value from the current one, it should not have side effects.
+        :param default: the value given to fn if the key doesn't exist, a KeyError is raised if not set.
+        :return: the new value.
+        """
+        with self.lock(key):
+            try:
+                value = self.get(key)
+            except KeyError:
+                if default is MISSING:
+                    raise
+                value = default
+            value = fn(value)
+            self.set(key, value)
+            return value
+
+    def compare_and_set(self, key: str, expected: Any, value: Any) -> bool:
+        """
+        Atomically set key to value only if its current value is equal to expected.
+
+        :param key: the key
+        :param expected: the value key should have, MISSING to set it only if it doesn't exist.
+        :param value: the new value
+        :return: True if the value has been set.
+        """
+        with self.lock(key):
+            try:
+                current = self.get(key)
+            except KeyError:
+                current = MISSING
+            if current is MISSING or expected is MISSING:
+                if current is not expected:
+                    return False
+            elif current != expected:
+                return False
+            self.set(key, value)
+            return True
+
+    def set_with_ttl(self, key: str, value: Any, ttl: float) -> None:
+        """
+        Set the key to an Expiring value: StoreMixin ignores it after ttl seconds and compact removes it.
+
+        :param key: the key
+        :param value: the value, it needs to be serializable by the storage codec once wrapped in Expiring,
+                      which is the case with pickle.
+        :param ttl: the number of seconds before the key expires.
+        """
+        if not self.contains(EXPIRING_MARKER):
+            self.set(EXPIRING_MARKER, True)
+        deadline = time() + ttl
+        with self.lock(key):  # so compact can't remove it right after checking it was expired
+            self.set(key, Expiring(value, deadline))
+            self.set(EXPIRING_INDEX + key, deadline)
+
+    def expired_keys(self, keys: Iterable[str] = None, now: float = None) -> Iterator[Tuple[str, float]]:
+        """
+        The keys whose deadline in the expiry index has passed, only their deadlines are read. Their values might
+        have been set again without a ttl since: check them before relying on it.
+
+        :param keys: the keys of the storage if they are already known.
+        :param now: the current time.
+        :return: an iterator on the (key, deadline) pairs.
+        """
+        now = time() if now is None else now
+        index = [key for key in (self.keys() if keys is None else keys) if key.startswith(EXPIRING_INDEX)]
+        for key, deadline in self.get_many(index).items():
+            if deadline <= now:
+                yield key[len(EXPIRING_INDEX):], deadline
+
+    def compact(self) -> int:
+        """
+        Remove the expired keys. Storages can extend it to also reclaim the space left by the removed entries.
+        It is called periodically from a background thread.
+
+        :return: the number of keys removed.
+        """
+        if not self.contains(EXPIRING_MARKER):
+            return 0
+        now = time()
+        removed = 0
+        for key, _ in list(self.expired_keys(now=now)):
+            with self.lock(key):  # checks the value, the writes take this lock
+                try:
+                    value = self.get(key)
+                except KeyError:
+                    value = None
+                if isinstance(value, Expiring) and not value.expired(now):
+                    self.set(EXPIRING_INDEX + key, value.deadline)  # set again with a ttl behind the index
+                    continue
+                if isinstance(value, Expiring):
+                    self.remove(key)
+                    removed += 1
+                self.remove(EXPIRING_INDEX + key)  # the key is gone or doesn't expire anymore
+        return removed
+
+    def contains(self, key: str) -> bool:
+        """
+        Check if the key exists, ideally without fetching the value.
+
+        :param key: the key
+        :return: True if the key is set.
+        """
+        try:
+            self.get(key)
+            return True
+        except KeyError:
+            return False
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        """
+        Get the values of several keys at once.
+
+        :param keys: the keys
+        :return: a dictionary of the keys found and their values, the missing keys are omitted.
+        """
+        result = {}
+        for key in keys:
+            try:
+                result[key] = self.get(key)
+            except KeyError:
+                pass
+        return result
+
+    def set_many(self, entries: Mapping[str, Any]) -> None:
+        """
+        Set several keys at once.
+
+        :param entries: the keys and their values.
+        """
+        for key, value in entries.items():
+            self.set(key, value)
+
+    def remove_many(self, keys: Iterable[str]) -> None:
+        """
+        Remove several keys at once, the missing keys are ignored.
+
+        :param keys: the keys
+        """
+        for key in keys:
+            try:
+                self.remove(key)
+            except KeyError:
+                pass
+
+    def items(self) -> Iterator[Tuple[str, Any]]:
+        """
+        Iterate on the keys and values, one entry at a time.
+
+        :return: an iterator on the (key, value) pairs.
+        """
+        for key in list(self.keys()):
+            try:
+                yield key, self.get(key)
+            except KeyError:
+                pass  # removed in the meantime
+
 
 class StoragePluginBase(object):
     """
@@ -81,3 +314,31 @@ class StoragePluginBase(object):
         :return:
         """
         pass
+
+    def namespaces(self) -> Iterable[str]:
+        """
+        List the namespaces stored, to export or migrate all of them.
+        Override it if your storage can list them.
+
+        :return: the namespaces.
+        """
+        raise NotImplementedError('The storage %s cannot list its namespaces.' % type(self).__name__)
+
+    def codec(self, namespace: str) -> Codec:
+        """
+        The codec configured for a namespace by STORAGE_CONFIG 'codec', overridden per namespace
+        by STORAGE_CONFIG 'namespace_codecs'. Use it if your storage stores bytes.
+
+        :param namespace: the namespace.
+        :return: the codec to encode and decode the values of this namespace.
+        """
+        config = dict(self._storage_config.get('codec', {}))
+        config.update(self._storage_config.get('namespace_codecs', {}).get(namespace, {}))
+        return Codec(**config)
+
+    def flush(self) -> None:
+        """
+        Write out anything still kept in memory, called when the bot shuts down.
+        Override it if your storage delays its writes.
+        """
+        pass
@@ -0,0 +1,246 @@
+import logging
+from collections import OrderedDict
+from threading import Event, RLock, Thread
+from typing import Any, Callable, ContextManager, Dict, Iterable, Iterator, Mapping, Tuple
+from weakref import WeakSet
+
+from errbot.storage.base import StorageBase, StoragePluginBase, MISSING
+
+log = logging.getLogger(__name__)
+
+_REMOVED = object()  # marks a pending removal in the dirty entries
+
+
+class CachingStorage(StorageBase):
+    """
+    Wraps a storage with an LRU cache of the decoded values and optionally delays the writes.
+
+    The values returned by get are shared with the cache: only modify them through StoreMixin.mutable or
+    set them back explicitly.
+    """
+
+    def __init__(self, storage: StorageBase, cache_size: int, write_behind: bool):
+        """
+        :param storage: the wrapped storage.
+        :param cache_size: how many decoded values are kept in memory.
+        :param write_behind: if True, set and remove are kept in memory until flush is called.
+        """
+        self._storage = storage
+        self._cache_size = cache_size
+        self._write_behind = write_behind
+        self._cache = OrderedDict()
+        self._dirty = {}  # key -> value or _REMOVED, waiting to be written to the wrapped storage
+        self._lock = RLock()  # this also serializes the accesses to the wrapped storage
+
+    def _cache_value(self, key: str, value: Any) -> None:
+        self._cache[key] = value
+        self._cache.move_to_end(key)
+        while len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+
+    def get(self, key: str) -> Any:
+        with self._lock:
+            value = self._dirty.get(key, None)
+            if value is _REMOVED:
+                raise KeyError("%s doesn't exist." % key)
+            if key in self._dirty:
+                return value
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+            value = self._storage.get(key)
+            self._cache_value(key, value)
+            return value
+
+    def set(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._cache_value(key, value)
+            if self._write_behind:
+                self._dirty[key] = value
+            else:
+                self._storage.set(key, value)
+
+    def remove(self, key: str) -> None:
+        with self._lock:
+            if self._write_behind:
+                self.get(key)  # raises KeyError if it doesn't exist
+                self._dirty[key] = _REMOVED
+            else:
+                self._storage.remove(key)
+            self._cache.pop(key, None)
+
+    def len(self) -> int:
+        with self._lock:
+            self.flush()
+            return self._storage.len()
+
+    def keys(self) -> Iterable[str]:
+        with self._lock:
+            self.flush()
+            return list(self._storage.keys())
+
+    def contains(self, key: str) -> bool:
+        with self._lock:
+            if key in self._dirty:
+                return self._dirty[key] is not _REMOVED
+            return key in self._cache or self._storage.contains(key)
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        with self._lock:
+            result, missing = {}, []
+            for key in keys:
+                value = self._dirty.get(key, self._cache.get(key, _REMOVED))
+                if key in self._dirty or key in self._cache:
+                    if value is not _REMOVED:
+                        result[key] = value
+                else:
+                    missing.append(key)
+            if missing:
+                found = self._storage.get_many(missing)
+                for key, value in found.items():
+                    self._cache_value(key, value)
+                result.update(found)
+            return result
+
+    def set_many(self, entries: Mapping[str, Any]) -> None:
+        with self._lock:
+            for key, value in entries.items():
+                self._cache_value(key, value)
+            if self._write_behind:
+                self._dirty.update(entries)
+            else:
+                self._storage.set_many(entries)
+
+    def remove_many(self, keys: Iterable[str]) -> None:
+        with self._lock:
+            keys = list(keys)
+            for key in keys:
+                self._cache.pop(key, None)
+            if self._write_behind:
+                self._dirty.update((key, _REMOVED) for key in keys)
+            else:
+                self._storage.remove_many(keys)
+
+    def items(self) -> Iterator[Tuple[str, Any]]:
+        with self._lock:
+            self.flush()
+        return self._storage.items()
+
+    # When writing through, let the wrapped storage do the atomic operations natively.
+    # The key locks are the ones of the wrapped storage, so its native operations and StoreMixin.mutable on the
+    # cache exclude each other. They are always taken before self._lock.
+
+    def lock(self, key: str) -> ContextManager:
+        return self._storage.lock(key)
+
+    def update(self, key: str, fn: Callable[[Any], Any], default: Any = MISSING) -> Any:
+        if self._write_behind:
+            return super().update(key, fn, default)
+        with self.lock(key), self._lock:
+            value = self._storage.update(key, fn, default)
+            self._cache_value(key, value)
+            return value
+
+    def compare_and_set(self, key: str, expected: Any, value: Any) -> bool:
+        if self._write_behind:
+            return super().compare_and_set(key, expected, value)
+        with self.lock(key), self._lock:
+            done = self._storage.compare_and_set(key, expected, value)
+            if done:
+                self._cache_value(key, value)
+            else:
+                self._cache.pop(key, None)  # somebody else changed it
+            return done
+
+    def compact(self) -> int:
+        with self._lock:
+            self.flush()
+            removed = self._storage.compact()
+            if removed:
+                self._cache.clear()  # forgets the removed keys
+            return removed
+
+    def flush(self) -> None:
+        """
+        Write the pending sets and removes to the wrapped storage.
+        """
+        with self._lock:
+            if not self._dirty:
+                return
+            log.debug('Flushing %d entries.', len(self._dirty))
+            dirty, self._dirty = self._dirty, {}
+            try:
+                # remove_many ignores the keys set and removed before they ever reached the storage.
+                self._storage.remove_many([key for key, value in dirty.items() if value is _REMOVED])
+                self._storage.set_many({key: value for key, value in dirty.items() if value is not _REMOVED})
+            except Exception:
+                # kept for the next flush, behind the writes made since.
+                for key, value in dirty.items():
+                    self._dirty.setdefault(key, value)
+                raise
+
+    def close(self) -> None:
+        with self._lock:
+            self.flush()
+            self._cache.clear()
+            self._storage.close()
+
+
+class CachingStoragePlugin(StoragePluginBase):
+    """
+    Wraps a storage plugin so all its storages are cached, see CachingStorage.
+
+    With a flush interval, the writes are batched and written every flush_interval seconds by a background
+    thread: this is the time window in which a crash can lose data. Storages are flushed when closed and when
+    the plugin is flushed on shutdown.
+    """
+
+    def __init__(self, storage_plugin: StoragePluginBase, cache_size: int, flush_interval: float = 0):
+        """
+        :param storage_plugin: the storage plugin to wrap.
+        :param cache_size: how many decoded values are kept in memory per namespace.
+        :param flush_interval: 0 to write through, or the delay in seconds between 2 flushes of the writes.
+        """
+        self._storage_plugin = storage_plugin
+        self._storage_config = storage_plugin._storage_config
+        self.cache_size = cache_size
+        self.flush_interval = flush_interval
+        self._storages = WeakSet()
+        self._stopped = Event()
+        self._flusher = None
+
+    def open(self, namespace: str) -> StorageBase:
+        storage = CachingStorage(self._storage_plugin.open(namespace), self.cache_size, self.flush_interval > 0)
+        if self.flush_interval > 0:
+            self._storages.add(storage)
+            if self._flusher is None:
+                self._flusher = Thread(target=self._flush_periodically, name='storage flusher', daemon=True)
+                self._flusher.start()
+        return storage
+
+    def _flush_periodically(self):
+        while not self._stopped.wait(self.flush_interval):
+            self._flush_all()
+
+    def _flush_all(self):
+        for storage in list(self._storages):
+            try:
+                storage.flush()
+            except Exception:
+                log.exception('Failed to flush a storage.')
+
+    def namespaces(self) -> Iterable[str]:
+        self._flush_all()  # so new namespaces are written
+        return self._storage_plugin.namespaces()
+
+    def flush(self) -> None:
+        """
+        Stop the background flusher, then flush everything. It is restarted if a storage is opened again.
+        """
+        if self._flusher is not None:
+            self._stopped.set()
+            self._flusher.join()
+            self._flusher = None
+            self._stopped = Event()
+        self._flush_all()
+        self._storage_plugin.flush()
@@ -0,0 +1,186 @@
+"""
+Streaming export, import and migration of the storages, one entry at a time so a namespace never needs to fit
+in memory.
+
+An export is a stream of records {'namespace': ..., 'key': ..., 'value': ...}, one json object per line (jsonl)
+or one msgpack map after the other. The values that don't survive a round trip through the format, like tuples
+or any other python object, are stored pickled in 'pickle' instead of 'value': only import exports you trust.
+"""
+import base64
+import json
+import logging
+import pickle
+from typing import BinaryIO, Callable, Dict, Iterable, Iterator, Optional
+
+from errbot.storage.base import StorageBase, StoragePluginBase
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+log = logging.getLogger(__name__)
+
+FORMATS = ('jsonl', 'msgpack')
+BATCH_SIZE = 1000  # entries written at once
+
+Progress = Optional[Callable[[str, int], None]]  # called with a namespace and its number of entries copied so far
+
+
+def _check_format(fmt: str) -> None:
+    if fmt not in FORMATS:
+        raise ValueError('Unknown format %s, it should be one of %s.' % (fmt, ', '.join(FORMATS)))
+    if fmt == 'msgpack' and msgpack is None:
+        raise ValueError('You need to install msgpack to use this format.')
+
+
+def _round_trips(value, fmt: str) -> bool:
+    try:
+        if fmt == 'jsonl':
+            return json.loads(json.dumps(value)) == value
+        return msgpack.unpackb(msgpack.packb(value, use_bin_type=True), raw=False) == value
+    except (TypeError, ValueError, OverflowError):
+        return False
+
+
+def _encode(namespace: str, key: str, value, fmt: str) -> bytes:
+    record = {'namespace': namespace, 'key': key}
+    if _round_trips(value, fmt):
+        record['value'] = value
+    else:
+        pickled = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        record['pickle'] = base64.b64encode(pickled).decode() if fmt == 'jsonl' else pickled
+    if fmt == 'jsonl':
+        return json.dumps(record).encode() + b'\n'
+    return msgpack.packb(record, use_bin_type=True)
+
+
+def _decode(record: dict, fmt: str):
+    if 'value' in record:
+        return record['value']
+    pickled = record['pickle']
+    return pickle.loads(base64.b64decode(pickled) if fmt == 'jsonl' else pickled)
+
+
+def _records(stream: BinaryIO, fmt: str) -> Iterator[dict]:
+    if fmt == 'jsonl':
+        for line in stream:
+            if line.strip():
+                yield json.loads(line.decode())
+    else:
+        yield from msgpack.Unpacker(stream, raw=False)
+
+
+def _batches(items: Iterable, size: int = BATCH_SIZE) -> Iterator[Dict]:
+    batch = {}
+    for key, value in items:
+        batch[key] = value
+        if len(batch) >= size:
+            yield batch
+            batch = {}
+    if batch:
+        yield batch
+
+
+def export_storage(storage_plugin: StoragePluginBase, namespaces: Iterable[str], stream: BinaryIO,
+                   fmt: str = 'jsonl', progress: Progress = None) -> int:
+    """
+    Write the entries of the given namespaces to stream.
+
+    :param storage_plugin: the storage to export from.
+    :param namespaces: the namespaces to export.
+    :param stream: a binary stream.
+    :param fmt: 'jsonl' or 'msgpack'.
+    :param progress: called regularly with the namespace and the number of entries exported so far.
+    :return: the number of entries exported.
+    """
+    _check_format(fmt)
+    total = 0
+    for namespace in namespaces:
+        storage = storage_plugin.open(namespace)
+        try:
+            count = 0
+            for key, value in storage.items():
+                stream.write(_encode(namespace, key, value, fmt))
+                count += 1
+                if progress and count % BATCH_SIZE == 0:
+                    progress(namespace, count)
+        finally:
+            storage.close()
+        if progress:
+            progress(namespace, count)
+        total += count
+    return total
+
+
+def import_storage(storage_plugin: StoragePluginBase, stream: BinaryIO, fmt: str = 'jsonl',
+                   progress: Progress = None) -> int:
+    """
+    Set the entries read from stream, written in batches. The other entries of the namespaces are kept.
+
+    :param storage_plugin: the storage to import into.
+    :param stream: a binary stream in the export format.
+    :param fmt: 'jsonl' or 'msgpack'.
+    :param progress: called regularly with the namespace and the number of entries imported so far.
+    :return: the number of entries imported.
+    """
+    _check_format(fmt)
+    storages = {}  # type: Dict[str, StorageBase]
+    pending = {}  # namespace -> entries waiting to be written
+    counts = {}
+
+    def write(namespace):
+        if namespace not in storages:
+            storages[namespace] = storage_plugin.open(namespace)
+        storages[namespace].set_many(pending.pop(namespace))
+        if progress:
+            progress(namespace, counts[namespace])
+
+    try:
+        for record in _records(stream, fmt):
+            namespace = record['namespace']
+            pending.setdefault(namespace, {})[record['key']] = _decode(record, fmt)
+            counts[namespace] = counts.get(namespace, 0) + 1
+            if len(pending[namespace]) >= BATCH_SIZE:
+                write(namespace)
+        for namespace in list(pending):
+            write(namespace)
+    finally:
+        for storage in storages.values():
+            storage.close()
+        storage_plugin.flush()
+    return sum(counts.values())
+
+
+def migrate_storage(source: StoragePluginBase, target: StoragePluginBase, namespaces: Iterable[str] = None,
+                    progress: Progress = None) -> int:
+    """
+    Copy namespaces from a storage to another one, in batches. The source is only read, so the copy can
+    be done while the bot is running and done again later to catch up with the last changes: the keys of the
+    target that are not in the source anymore are removed.
+
+    :param source: the storage to copy from.
+    :param target: the storage to copy to.
+    :param namespaces: the namespaces to copy, all the namespaces of source by default.
+    :param progress: called regularly with the namespace and the number of entries copied so far.
+    :return: the number of entries copied.
+    """
+    total = 0
+    for namespace in (source.namespaces() if namespaces is None else namespaces):
+        from_storage, to_storage = source.open(namespace), target.open(namespace)
+        try:
+            count = 0
+            copied = set()
+            for batch in _batches(from_storage.items()):
+                to_storage.set_many(batch)
+                copied.update(batch)
+                count += len(batch)
+                if progress:
+                    progress(namespace, count)
+            to_storage.remove_many(set(to_storage.keys()) - copied)
+        finally:
+            from_storage.close()
+            to_storage.close()
+        total += count
+    target.flush()
+    return total
@@ -0,0 +1,163 @@
+import logging
+import os
+import sys
+from typing import Any, Callable, Dict, Iterable, Iterator, Mapping, Tuple
+
+from errbot.storage.base import StorageBase, StoragePluginBase, MISSING
+from errbot.storage.serialization import Codec
+
+log = logging.getLogger('errbot.storage.lmdb')
+
+try:
+    import lmdb
+except ImportError:
+    log.exception("Could not start the LMDB storage")
+    log.fatal(
+        "You need to install the lmdb support in order "
+        "to use the LMDB storage.\n"
+        "You should be able to install this package using:\n"
+        "pip install errbot[lmdb]"
+    )
+    sys.exit(1)
+
+DEFAULT_MAP_SIZE = 1 << 30  # 1GiB, the maximum size of the database, it is only reserved address space.
+DEFAULT_MAX_DBS = 256  # maximum number of namespaces
+
+
+class LMDBStorage(StorageBase):
+    """
+    One namespace of the environment, stored in its own named database.
+
+    Reads are done on buffers pointing directly in the memory map, values are decoded from there
+    without an intermediate copy.
+    """
+
+    def __init__(self, env: 'lmdb.Environment', namespace: str, codec: Codec):
+        self._env = env
+        self._db = env.open_db(namespace.encode())
+        self.namespace = namespace
+        self._codec = codec
+
+    def _read(self):
+        return self._env.begin(db=self._db, buffers=True)
+
+    def _write(self):
+        return self._env.begin(db=self._db, write=True, buffers=True)
+
+    def get(self, key: str) -> Any:
+        with self._read() as txn:
+            value = txn.get(key.encode())
+            if value is None:
+                raise KeyError("%s doesn't exist." % key)
+            # the buffer is only valid within the transaction.
+            return self._codec.decode(value)
+
+    def set(self, key: str, value: Any) -> None:
+        value = self._codec.encode(value)
+        with self._write() as txn:
+            txn.put(key.encode(), value)
+
+    def remove(self, key: str) -> None:
+        with self._write() as txn:
+            if not txn.delete(key.encode()):
+                raise KeyError("%s doesn't exist." % key)
+
+    def len(self) -> int:
+        with self._read() as txn:
+            return txn.stat(self._db)['entries']
+
+    def keys(self) -> Iterable[str]:
+        with self._read() as txn:
+            return [bytes(key).decode() for key in txn.cursor().iternext(keys=True, values=False)]
+
+    def contains(self, key: str) -> bool:
+        with self._read() as txn:
+            return txn.cursor().set_key(key.encode())
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        result = {}
+        with self._read() as txn:
+            for key in keys:
+                value = txn.get(key.encode())
+                if value is not None:
+                    result[key] = self._codec.decode(value)
+        return result
+
+    def set_many(self, entries: Mapping[str, Any]) -> None:
+        entries = [(key.encode(), self._codec.encode(value)) for key, value in entries.items()]
+        with self._write() as txn:
+            txn.cursor().putmulti(entries)
+
+    def remove_many(self, keys: Iterable[str]) -> None:
+        with self._write() as txn:
+            for key in keys:
+                txn.delete(key.encode())
+
+    def items(self) -> Iterator[Tuple[str, Any]]:
+        # decoded eagerly so no read transaction stays open while the caller iterates.
+        with self._read() as txn:
+            items = [(bytes(key).decode(), self._codec.decode(value)) for key, value in txn.cursor()]
+        return iter(items)
+
+    # LMDB has a single writer at a time, across processes: a write transaction makes those atomic.
+    # The key lock makes them atomic against StoreMixin.mutable too.
+
+    def update(self, key: str, fn: Callable[[Any], Any], default: Any = MISSING) -> Any:
+        with self.lock(key), self._write() as txn:
+            value = txn.get(key.encode())
+            if value is not None:
+                value = self._codec.decode(value)
+            elif default is MISSING:
+                raise KeyError("%s doesn't exist." % key)
+            else:
+                value = default
+            value = fn(value)
+            txn.put(key.encode(), self._codec.encode(value))
+            return value
+
+    def compare_and_set(self, key: str, expected: Any, value: Any) -> bool:
+        with self.lock(key), self._write() as txn:
+            current = txn.get(key.encode())
+            if current is None or expected is MISSING:
+                if current is not None or expected is not MISSING:
+                    return False
+            elif self._codec.decode(current) != expected:
+                return False
+            txn.put(key.encode(), self._codec.encode(value))
+            return True
+
+    def close(self) -> None:
+        # The environment is shared by all the namespaces, it stays open.
+        pass
+
+
+class LMDBStoragePlugin(StoragePluginBase):
+    """
+    Stores all the namespaces in one memory-mapped LMDB environment.
+
+    Readers never block and several bot processes can share the environment and the OS page cache.
+
+    STORAGE_CONFIG parameters:
+        - path: directory of the environment (default: BOT_DATA_DIR/storage.lmdb).
+        - map_size: maximum size of the database in bytes (default: 1GiB).
+        - max_dbs: maximum number of namespaces (default: 256).
+    """
+
+    def __init__(self, bot_config):
+        super().__init__(bot_config)
+        path = self._storage_config.get('path', os.path.join(bot_config.BOT_DATA_DIR, 'storage.lmdb'))
+        log.debug('Open lmdb storage %s' % path)
+        self._env = lmdb.open(path,
+                              map_size=self._storage_config.get('map_size', DEFAULT_MAP_SIZE),
+                              max_dbs=self._storage_config.get('max_dbs', DEFAULT_MAX_DBS))
+
+    def open(self, namespace: str) -> StorageBase:
+        return LMDBStorage(self._env, namespace, self.codec(namespace))
+
+    def namespaces(self) -> Iterable[str]:
+        # the main database of the environment lists the named databases.
+        with self._env.begin() as txn:
+            return [bytes(name).decode() for name in txn.cursor().iternext(keys=True, values=False)]
+
+    def flush(self) -> None:
+        self._env.sync(True)
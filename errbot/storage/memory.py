@@ -30,6 +30,22 @@ class MemoryStorage(StorageBase):
     def keys(self):
         return self.root.keys()
 
+    def contains(self, key: str) -> bool:
+        return key in self.root
+
+    def get_many(self, keys):
+        return {key: self.root[key] for key in keys if key in self.root}
+
+    def set_many(self, entries) -> None:
+        self.root.update(entries)
+
+    def remove_many(self, keys) -> None:
+        for key in keys:
+            self.root.pop(key, None)
+
+    def items(self):
+        return iter(list(self.root.items()))
+
     def close(self) -> None:
         ROOTS[self.namespace] = self.root
 
@@ -38,3 +54,6 @@ class MemoryStoragePlugin(StoragePluginBase):
 
     def open(self, namespace: str) -> StorageBase:
         return MemoryStorage(namespace)
+
+    def namespaces(self):
+        return list(ROOTS)
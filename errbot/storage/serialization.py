@@ -0,0 +1,184 @@
+import json
+import logging
+import pickle
+import zlib
+from typing import Any
+
+log = logging.getLogger(__name__)
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Encoded values start with MAGIC, the serializer id and the compression id.
+# MAGIC is never the first byte of a pickle: values without it are read as the plain pickles
+# written before, so a storage can be migrated gradually.
+MAGIC = b'\xe5'
+HEADER_SIZE = 3
+
+
+# The values the storages write themselves, an Expiring, a PersistedDictMarker or the set of the PersistedDicts of a
+# namespace, are stored as tagged objects in json and as extension types in msgpack.
+JSON_TAG = '__errbot__'
+EXT_EXPIRING, EXT_PERSISTED_DICT, EXT_SET = 1, 2, 3
+
+
+def _internal_types():
+    # imported here, those modules import this one.
+    from errbot.storage import PersistedDictMarker
+    from errbot.storage.base import Expiring
+    return Expiring, PersistedDictMarker
+
+
+def _json_tag(value: Any) -> Any:
+    expiring, persisted_dict_marker = _internal_types()
+    if isinstance(value, expiring):
+        return {JSON_TAG: 'expiring', 'value': _json_tag(value.value), 'deadline': value.deadline}
+    if isinstance(value, persisted_dict_marker):
+        return {JSON_TAG: 'persisted_dict'}
+    if isinstance(value, (set, frozenset)):
+        return {JSON_TAG: 'set', 'items': sorted(value)}
+    return value
+
+
+def _json_untag(value: Any) -> Any:
+    if not isinstance(value, dict) or JSON_TAG not in value:
+        return value
+    expiring, persisted_dict_marker = _internal_types()
+    tag = value[JSON_TAG]
+    if tag == 'expiring':
+        return expiring(_json_untag(value['value']), value['deadline'])
+    if tag == 'persisted_dict':
+        return persisted_dict_marker()
+    if tag == 'set':
+        return set(value['items'])
+    raise ValueError('Unknown tagged value %s.' % tag)
+
+
+def _json_dumps(value: Any) -> bytes:
+    return json.dumps(_json_tag(value), separators=(',', ':')).encode('utf-8')
+
+
+def _json_loads(data) -> Any:
+    return _json_untag(json.loads(bytes(data).decode('utf-8')))
+
+
+def _msgpack_ext(value: Any) -> Any:
+    expiring, persisted_dict_marker = _internal_types()
+    if isinstance(value, expiring):  # a tuple, msgpack would pack it as an array without calling default
+        return msgpack.ExtType(EXT_EXPIRING, _msgpack_dumps([value.value, value.deadline]))
+    if isinstance(value, persisted_dict_marker):
+        return msgpack.ExtType(EXT_PERSISTED_DICT, b'')
+    if isinstance(value, (set, frozenset)):
+        return msgpack.ExtType(EXT_SET, _msgpack_dumps(sorted(value)))
+    raise TypeError('Object of type %s is not msgpack serializable' % type(value).__name__)
+
+
+def _msgpack_ext_hook(code: int, data: bytes) -> Any:
+    expiring, persisted_dict_marker = _internal_types()
+    if code == EXT_EXPIRING:
+        return expiring(*_msgpack_loads(data))
+    if code == EXT_PERSISTED_DICT:
+        return persisted_dict_marker()
+    if code == EXT_SET:
+        return set(_msgpack_loads(data))
+    return msgpack.ExtType(code, data)
+
+
+def _msgpack_dumps(value: Any) -> bytes:
+    if isinstance(value, _internal_types()[0]):
+        value = _msgpack_ext(value)
+    return msgpack.packb(value, use_bin_type=True, default=_msgpack_ext)
+
+
+def _msgpack_loads(data) -> Any:
+    return msgpack.unpackb(data, raw=False, ext_hook=_msgpack_ext_hook)
+
+
+def _zstd_compress(data: bytes) -> bytes:
+    return zstandard.ZstdCompressor().compress(data)
+
+
+def _zstd_decompress(data) -> bytes:
+    return zstandard.ZstdDecompressor().decompress(data)
+
+
+# name -> (id, dumps, loads, available)
+SERIALIZERS = {
+    'pickle': (1, lambda value: pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), pickle.loads, True),
+    'json': (2, _json_dumps, _json_loads, True),
+    'msgpack': (3, _msgpack_dumps, _msgpack_loads, msgpack is not None),
+}
+
+# name -> (id, compress, decompress, available), id 0 is no compression.
+COMPRESSIONS = {
+    'zlib': (1, zlib.compress, zlib.decompress, True),
+    'zstd': (2, _zstd_compress, _zstd_decompress, zstandard is not None),
+}
+
+_LOADS = {id_: loads for id_, _, loads, available in SERIALIZERS.values() if available}
+_DECOMPRESS = {id_: decompress for id_, _, decompress, available in COMPRESSIONS.values() if available}
+
+
+class Codec(object):
+    """
+    Encodes the values of a storage to bytes with a configurable serializer and compression.
+
+    Whatever the configuration, decode reads the values encoded by any codec and the headerless pickles.
+    """
+
+    def __init__(self, serializer: str = 'pickle', compression: str = None, compression_threshold: int = 1024):
+        """
+        :param serializer: 'pickle' (any python object), 'json' or 'msgpack' (portable but limited to the basic types).
+        :param compression: None, 'zlib' or 'zstd'.
+        :param compression_threshold: the values smaller than this number of bytes once serialized are not compressed.
+        """
+        if serializer not in SERIALIZERS:
+            raise ValueError('Unknown serializer %s, it should be one of %s.' % (serializer, ', '.join(SERIALIZERS)))
+        if compression is not None and compression not in COMPRESSIONS:
+            raise ValueError('Unknown compression %s, it should be one of %s.' % (compression, ', '.join(COMPRESSIONS)))
+        serializer_id, self._dumps, _, available = SERIALIZERS[serializer]
+        if not available:
+            raise ValueError('You need to install %s to use it as a storage serializer.' % serializer)
+        self._serializer_id = serializer_id
+        if compression is None:
+            self._compress = None
+        else:
+            self._compression_id, self._compress, _, available = COMPRESSIONS[compression]
+            if not available:
+                raise ValueError('You need to install %s to use it as a storage compression.' % compression)
+        self._compression_threshold = compression_threshold
+        self._header = MAGIC + bytes((serializer_id, 0))
+
+    def encode(self, value: Any) -> bytes:
+        data = self._dumps(value)
+        if self._compress is not None and len(data) >= self._compression_threshold:
+            compressed = self._compress(data)
+            if len(compressed) < len(data):
+                return MAGIC + bytes((self._serializer_id, self._compression_id)) + compressed
+        return self._header + data
+
+    @staticmethod
+    def decode(data) -> Any:
+        """
+        :param data: bytes or any buffer, like a memoryview.
+        """
+        if data[:1] != MAGIC:
+            return pickle.loads(data)
+        serializer_id, compression_id = data[1], data[2]
+        data = memoryview(data)[HEADER_SIZE:]
+        if compression_id:
+            decompress = _DECOMPRESS.get(compression_id)
+            if decompress is None:
+                raise ValueError('Unknown or unavailable compression %d for this value.' % compression_id)
+            data = decompress(data)
+        loads = _LOADS.get(serializer_id)
+        if loads is None:
+            raise ValueError('Unknown or unavailable serializer %d for this value.' % serializer_id)
+        return loads(data)
@@ -1,40 +1,89 @@
+import dbm
 import logging
 from typing import Any
-import shelve
 import os
+import re
 
 import shutil
+from threading import RLock
 
 from errbot.storage.base import StorageBase, StoragePluginBase
+from errbot.storage.serialization import Codec
 
 log = logging.getLogger('errbot.storage.shelf')
 
+DB_FILE = re.compile(r'^(.+)\.db(\.db|\.dat|\.dir|\.bak)?$')
+
 
 class ShelfStorage(StorageBase):
-    def __init__(self, path):
+    """
+    A dbm file, with the same layout as a python shelf: the values written by older versions
+    with shelve are still read.
+    """
+    def __init__(self, path, codec: Codec = None):
         log.debug('Open shelf storage %s' % path)
-        self.shelf = shelve.DbfilenameShelf(path, protocol=2)
+        self.shelf = dbm.open(path, 'c')
+        self._codec = codec or Codec()
+        self._lock = RLock()  # dbm files are not safe to use from several threads at once.
 
     def get(self, key: str) -> Any:
-        return self.shelf[key]
+        with self._lock:
+            return self._codec.decode(self.shelf[key.encode()])
 
     def remove(self, key: str):
-        if key not in self.shelf:
-            raise KeyError("%s doesn't exist." % key)
-        del self.shelf[key]
+        with self._lock:
+            if key.encode() not in self.shelf:
+                raise KeyError("%s doesn't exist." % key)
+            del self.shelf[key.encode()]
 
     def set(self, key: str, value: Any) -> None:
-        self.shelf[key] = value
+        value = self._codec.encode(value)
+        with self._lock:
+            self.shelf[key.encode()] = value
 
     def len(self):
-        return len(self.shelf)
+        with self._lock:
+            return len(self.shelf)
 
     def keys(self):
-        return self.shelf.keys()
+        with self._lock:
+            return [key.decode() for key in self.shelf.keys()]
+
+    def contains(self, key: str) -> bool:
+        with self._lock:
+            return key.encode() in self.shelf  # the dbm lookup doesn't decode the value
+
+    def set_many(self, entries) -> None:
+        entries = [(key.encode(), self._codec.encode(value)) for key, value in entries.items()]
+        with self._lock:
+            for key, value in entries:
+                self.shelf[key] = value
+
+    def remove_many(self, keys) -> None:
+        with self._lock:
+            for key in keys:
+                key = key.encode()
+                if key in self.shelf:
+                    del self.shelf[key]
+
+    def items(self):
+        for key in self.keys():
+            try:
+                yield key, self.get(key)
+            except KeyError:
+                pass  # removed in the meantime
+
+    def compact(self) -> int:
+        removed = super().compact()
+        with self._lock:
+            if removed and hasattr(self.shelf, 'reorganize'):
+                self.shelf.reorganize()  # only gdbm can shrink its file
+        return removed
 
     def close(self) -> None:
-        self.shelf.close()
-        self.shelf = None
+        with self._lock:
+            self.shelf.close()
+            self.shelf = None
 
 
 class ShelfStoragePlugin(StoragePluginBase):
@@ -56,4 +105,9 @@ class ShelfStoragePlugin(StoragePluginBase):
                 log.info('Moving your old v3 DB from %s to %s.' % (old_spot, new_spot))
                 shutil.move(old_spot, new_spot)
 
-        return ShelfStorage(new_spot)
+        return ShelfStorage(new_spot, self.codec(namespace))
+
+    def namespaces(self):
+        # depending on the dbm module, the namespace foo is in foo.db, foo.db.db or foo.db.dat and foo.db.dir
+        names = (DB_FILE.match(name) for name in os.listdir(self._storage_config['basedir']))
+        return sorted({match.group(1) for match in names if match})
@@ -0,0 +1,183 @@
+import logging
+import os
+import sqlite3
+from threading import Lock, local
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, Mapping, Tuple
+
+from errbot.storage.base import StorageBase, StoragePluginBase, MISSING
+
+log = logging.getLogger('errbot.storage.sqlite')
+
+# sqlite3 keeps a cache of compiled statements per connection, those constant queries are prepared only once.
+CREATE_TABLE = 'CREATE TABLE IF NOT EXISTS store (' \
+               'namespace TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL, ' \
+               'PRIMARY KEY (namespace, key)) WITHOUT ROWID'
+GET = 'SELECT value FROM store WHERE namespace = ? AND key = ?'
+SET = 'INSERT OR REPLACE INTO store (namespace, key, value) VALUES (?, ?, ?)'
+REMOVE = 'DELETE FROM store WHERE namespace = ? AND key = ?'
+LEN = 'SELECT COUNT(*) FROM store WHERE namespace = ?'
+KEYS = 'SELECT key FROM store WHERE namespace = ?'
+CONTAINS = 'SELECT 1 FROM store WHERE namespace = ? AND key = ?'
+ITEMS = 'SELECT key, value FROM store WHERE namespace = ?'
+NAMESPACES = 'SELECT DISTINCT namespace FROM store'
+
+
+class SqliteStorage(StorageBase):
+    """
+    One namespace of the database. The connection used depends on the calling thread.
+    """
+
+    def __init__(self, plugin: 'SqliteStoragePlugin', namespace: str):
+        self._plugin = plugin
+        self.namespace = namespace
+        self._codec = plugin.codec(namespace)
+
+    def get(self, key: str) -> Any:
+        row = self._plugin.connection().execute(GET, (self.namespace, key)).fetchone()
+        if row is None:
+            raise KeyError("%s doesn't exist." % key)
+        return self._codec.decode(row[0])
+
+    def set(self, key: str, value: Any) -> None:
+        value = self._codec.encode(value)
+        with self._plugin.write_lock:
+            self._plugin.connection().execute(SET, (self.namespace, key, value))
+
+    def remove(self, key: str) -> None:
+        with self._plugin.write_lock:
+            cursor = self._plugin.connection().execute(REMOVE, (self.namespace, key))
+        if cursor.rowcount == 0:
+            raise KeyError("%s doesn't exist." % key)
+
+    def len(self) -> int:
+        return self._plugin.connection().execute(LEN, (self.namespace,)).fetchone()[0]
+
+    def keys(self) -> Iterable[str]:
+        return [key for key, in self._plugin.connection().execute(KEYS, (self.namespace,))]
+
+    def contains(self, key: str) -> bool:
+        return self._plugin.connection().execute(CONTAINS, (self.namespace, key)).fetchone() is not None
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        conn = self._plugin.connection()
+        result = {}
+        for key in keys:
+            row = conn.execute(GET, (self.namespace, key)).fetchone()
+            if row is not None:
+                result[key] = self._codec.decode(row[0])
+        return result
+
+    def set_many(self, entries: Mapping[str, Any]) -> None:
+        rows = [(self.namespace, key, self._codec.encode(value))
+                for key, value in entries.items()]
+        with self._plugin.write_lock, self._plugin.transaction() as conn:
+            conn.executemany(SET, rows)
+
+    def remove_many(self, keys: Iterable[str]) -> None:
+        with self._plugin.write_lock, self._plugin.transaction() as conn:
+            conn.executemany(REMOVE, [(self.namespace, key) for key in keys])
+
+    def items(self) -> Iterator[Tuple[str, Any]]:
+        for key, value in self._plugin.connection().execute(ITEMS, (self.namespace,)):
+            yield key, self._codec.decode(value)
+
+    def _get_in(self, conn: sqlite3.Connection, key: str) -> Any:
+        row = conn.execute(GET, (self.namespace, key)).fetchone()
+        return MISSING if row is None else self._codec.decode(row[0])
+
+    # update and compare_and_set run in an immediate transaction, so they are also atomic
+    # against the other processes using the database. The key lock makes them atomic against StoreMixin.mutable.
+
+    def update(self, key: str, fn: Callable[[Any], Any], default: Any = MISSING) -> Any:
+        with self.lock(key), self._plugin.write_lock, self._plugin.transaction(immediate=True) as conn:
+            value = self._get_in(conn, key)
+            if value is MISSING:
+                if default is MISSING:
+                    raise KeyError("%s doesn't exist." % key)
+                value = default
+            value = fn(value)
+            conn.execute(SET, (self.namespace, key, self._codec.encode(value)))
+            return value
+
+    def compare_and_set(self, key: str, expected: Any, value: Any) -> bool:
+        with self.lock(key), self._plugin.write_lock, self._plugin.transaction(immediate=True) as conn:
+            current = self._get_in(conn, key)
+            if current is MISSING or expected is MISSING:
+                if current is not expected:
+                    return False
+            elif current != expected:
+                return False
+            conn.execute(SET, (self.namespace, key, self._codec.encode(value)))
+            return True
+
+    def compact(self) -> int:
+        removed = super().compact()
+        if removed:
+            # gives the free pages back to the file system, in databases created with auto_vacuum.
+            with self._plugin.write_lock:
+                self._plugin.connection().execute('PRAGMA incremental_vacuum').fetchall()
+        return removed
+
+    def close(self) -> None:
+        # Every write is committed right away, there is nothing left to sync.
+        pass
+
+
+class SqliteStoragePlugin(StoragePluginBase):
+    """
+    Stores all the namespaces in one SQLite database in WAL mode.
+
+    Each thread gets its own connection so readers never wait on each other nor on the writer,
+    and the writes are serialized by a lock instead of failing on a busy database.
+
+    STORAGE_CONFIG parameters:
+        - file: path of the database (default: BOT_DATA_DIR/storage.sqlite).
+        - timeout: seconds to wait on a database locked by another process (default: 5).
+    """
+
+    def __init__(self, bot_config):
+        super().__init__(bot_config)
+        self._path = self._storage_config.get('file', os.path.join(bot_config.BOT_DATA_DIR, 'storage.sqlite'))
+        self._timeout = self._storage_config.get('timeout', 5)
+        self._local = local()
+        self.write_lock = Lock()
+        log.debug('Open sqlite storage %s' % self._path)
+        conn = self.connection()
+        conn.execute('PRAGMA auto_vacuum=INCREMENTAL')  # only effective on a new database
+        conn.execute(CREATE_TABLE)
+
+    def connection(self) -> sqlite3.Connection:
+        """
+        :return: the connection of the calling thread, opened on first use.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # isolation_level=None: autocommit, each statement is its own transaction.
+            conn = sqlite3.connect(self._path, timeout=self._timeout, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self, immediate=False):
+        """
+        Groups the statements executed on the yielded connection in one transaction.
+
+        :param immediate: take the database write lock right away instead of on the first write.
+        """
+        conn = self.connection()
+        conn.execute('BEGIN IMMEDIATE' if immediate else 'BEGIN')
+        try:
+            yield conn
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def open(self, namespace: str) -> StorageBase:
+        return SqliteStorage(self, namespace)
+
+    def namespaces(self) -> Iterable[str]:
+        return [namespace for namespace, in self.connection().execute(NAMESPACES)]
@@ -1,12 +1,25 @@
-
-import os
+import http.client
 import io
+import logging
+import mmap
+import os
+import re
+import tempfile
+import uuid
+from base64 import b64encode
+from bisect import bisect_right
 from itertools import starmap, repeat
-from threading import Thread
+from threading import Condition, Thread
+from typing import Dict, Iterator, List, Mapping, Optional, Tuple
+from urllib.parse import unquote, urlsplit
+from urllib.request import getproxies, proxy_bypass
+
 from .backends.base import STREAM_WAITING_TO_START, STREAM_TRANSFER_IN_PROGRESS
-import logging
 
-CHUNK_SIZE = 4096
+CHUNK_SIZE = 64 * 1024  # first read from the incoming stream
+MAX_CHUNK_SIZE = 1024 * 1024  # the reads double up to this size while the incoming stream keeps up
+MAX_BUFFERED = 16 * 1024 * 1024  # bytes kept in memory for the slowest consumer, the rest is spilled to disk
+MIMETYPE = re.compile(r'^[\w.+-]+/[\w.+-]+$')
 
 log = logging.getLogger(__name__)
 
@@ -25,12 +38,194 @@ def repeatfunc(func, times=None, *args):  # from the itertools receipes
     return starmap(func, repeat(args, times))
 
 
+def wants_streams(client) -> bool:
+    """ True if client overrides BotPlugin.callback_stream, which rejects every stream. """
+    from .botplugin import BotPlugin
+    return getattr(type(client), 'callback_stream', None) is not BotPlugin.callback_stream
+
+
+class Broadcast(object):
+    """
+    A single writer / multiple readers buffer: the data is written once and each reader has its own cursor.
+
+    The data all the readers have read is dropped. When a reader lags behind by more than max_buffered bytes,
+    the oldest data is spilled to a temporary file so the memory stays bounded and the other readers never wait
+    for the slow one.
+    """
+
+    def __init__(self, max_buffered: int = None, spill_dir: str = None):
+        """
+        :param max_buffered: the maximum number of bytes kept in memory, MAX_BUFFERED by default.
+        :param spill_dir: where the temporary spill file is created, the default temporary directory if None.
+        """
+        self._max_buffered = MAX_BUFFERED if max_buffered is None else max_buffered
+        self._spill_dir = spill_dir
+        self._condition = Condition()
+        self._chunks = []  # the data in memory, it starts at self._spilled_end
+        self._offsets = []  # the stream offset of each chunk, for bisect
+        self._buffered = 0  # the number of bytes in memory
+        self._end = 0  # offset of the end of the data written so far
+        self._eof = False
+        self._spill = None  # temporary file
+        self._spill_start = 0  # offset of the first byte of the spill file
+        self._spilled_end = 0  # offset of the end of the spill file, the memory starts there
+        self._cursors = {}  # reader -> offset
+
+    def reader(self) -> 'BroadcastReader':
+        """
+        A new reader starting at the beginning of the data, it needs to be created before the first write.
+        """
+        reader = BroadcastReader(self)
+        with self._condition:
+            self._cursors[reader] = 0
+        return reader
+
+    def write(self, data: bytes) -> None:
+        with self._condition:
+            if not self._cursors:
+                self._end += len(data)  # nobody is reading anymore
+                return
+            self._offsets.append(self._end)
+            self._chunks.append(bytes(data))
+            self._buffered += len(data)
+            self._end += len(data)
+            while self._buffered > self._max_buffered and len(self._chunks) > 1:
+                self._spill_oldest()
+            self._condition.notify_all()
+
+    def close(self) -> None:
+        """ Signal the end of the data. """
+        with self._condition:
+            self._eof = True
+            self._condition.notify_all()
+
+    def _spill_oldest(self):
+        if self._spill is None:
+            self._spill = tempfile.TemporaryFile(prefix='errbot-stream-', dir=self._spill_dir)
+            log.debug('A stream consumer is slow, spilling the buffer to disk.')
+        chunk = self._chunks.pop(0)
+        self._offsets.pop(0)
+        self._spill.seek(0, os.SEEK_END)
+        self._spill.write(chunk)
+        self._buffered -= len(chunk)
+        self._spilled_end += len(chunk)
+
+    def _trim(self):
+        """ Forget the data every reader went past. """
+        lowest = min(self._cursors.values(), default=self._end)
+        if self._spill is not None and self._spill_start < self._spilled_end <= lowest:
+            self._spill.seek(0)
+            self._spill.truncate()
+            self._spill_start = self._spilled_end
+        if self._spill_start < self._spilled_end:
+            return  # a reader is still in the spill file, the memory is contiguous with it
+        while self._chunks and self._offsets[0] + len(self._chunks[0]) <= lowest:
+            chunk = self._chunks.pop(0)
+            self._offsets.pop(0)
+            self._buffered -= len(chunk)
+            self._spill_start = self._spilled_end = self._spilled_end + len(chunk)
+
+    def _read(self, reader: 'BroadcastReader', size: int) -> bytes:
+        with self._condition:
+            offset = self._cursors[reader]
+            while offset >= self._end and not self._eof:
+                self._condition.wait()
+            if offset >= self._end:
+                return b''
+            if offset < self._spilled_end:
+                self._spill.seek(offset - self._spill_start)
+                data = self._spill.read(min(size, self._spilled_end - offset))
+            else:
+                index = bisect_right(self._offsets, offset) - 1
+                start = offset - self._offsets[index]
+                data = memoryview(self._chunks[index])[start:start + size]
+            self._cursors[reader] = offset + len(data)
+            self._trim()
+            return data
+
+    def _detach(self, reader: 'BroadcastReader'):
+        with self._condition:
+            if self._cursors.pop(reader, None) is not None:
+                self._trim()
+                if not self._cursors and self._spill is not None:
+                    self._spill.close()
+                    self._spill = None
+
+
+class BroadcastReader(io.RawIOBase):
+    """ A reader of a Broadcast, closing it releases the data it didn't read. """
+
+    def __init__(self, broadcast: Broadcast):
+        super().__init__()
+        self._broadcast = broadcast
+
+    def readable(self):
+        return True
+
+    def readinto(self, b) -> int:
+        data = self._broadcast._read(self, len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self._broadcast._detach(self)
+        super().close()
+
+
+class MappedReader(io.RawIOBase):
+    """ A read-only and seekable reader of a buffer, typically a memory map shared by several readers. """
+
+    def __init__(self, buffer: memoryview):
+        super().__init__()
+        self._buffer = buffer
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b) -> int:
+        data = self._buffer[self._position:self._position + len(b)]
+        b[:len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += len(self._buffer)
+        if offset < 0:
+            raise ValueError('negative seek position %d' % offset)
+        self._position = offset
+        return offset
+
+    def tell(self) -> int:
+        return self._position
+
+    def getbuffer(self) -> memoryview:
+        """ The whole content, without copy. """
+        return self._buffer
+
+
 class Tee(object):
     """ Tee implements a multi reader / single writer """
-    def __init__(self, incoming_stream, clients):
-        """ clients is a list of objects implementing callback_stream """
+    def __init__(self, incoming_stream, clients, spill_dir: str = None, spool: bool = False):
+        """
+        :param incoming_stream: the stream to read.
+        :param clients: a list of objects implementing callback_stream, only the ones overriding
+                        BotPlugin.callback_stream get the stream.
+        :param spill_dir: where the data not read yet by the slow clients is spilled, or spooled.
+        :param spool: receive the whole stream in a temporary file first, then give the clients seekable
+                      streams sharing a read-only memory map of it.
+        """
         self.incoming_stream = incoming_stream
-        self.clients = clients
+        self.clients = [client for client in clients if wants_streams(client)]
+        self.spill_dir = spill_dir
+        self.spool = spool
 
     def start(self):
         """ starts the transfer asynchronously """
@@ -38,11 +233,23 @@ class Tee(object):
         t.start()
         return t
 
-    def run(self):
-        """ streams to all the clients synchronously """
-        nb_clients = len(self.clients)
-        pipes = [(io.open(r, 'rb'), io.open(w, 'wb')) for r, w in repeatfunc(os.pipe, nb_clients)]
-        streams = [self.incoming_stream.clone(pipe[0]) for pipe in pipes]
+    def _chunks(self):
+        """ Reads the incoming stream, in chunks growing while the source keeps up. """
+        chunk_size = CHUNK_SIZE
+        while True:
+            if self.incoming_stream.closed:
+                break
+            chunk = self.incoming_stream.read(chunk_size)
+            log.debug("dispatch %d bytes", len(chunk))
+            if not chunk:
+                break
+            yield chunk
+            if len(chunk) == chunk_size and chunk_size < MAX_CHUNK_SIZE:
+                chunk_size *= 2
+        log.debug("EOF detected")
+
+    def _start_streamers(self, readers: List[io.RawIOBase]) -> List[Thread]:
+        streams = [self.incoming_stream.clone(reader) for reader in readers]
 
         def streamer(index):
             try:
@@ -60,31 +267,148 @@ class Tee(object):
                     # if the plugin didn't do it by itself, mark the transfer as a success.
                     streams[index].success()
             # stop the stream if the callback_stream returns
-            read, write = pipes[index]
-            pipes[index] = (None, None)  # signal the main thread to stop streaming
-            read.close()
-            write.close()
-
-        threads = [Thread(target=streamer, args=(i,)) for i in range(nb_clients)]
+            readers[index].close()
 
+        threads = [Thread(target=streamer, args=(i,)) for i in range(len(self.clients))]
         for thread in threads:
             thread.start()
+        return threads
 
-        while True:
-            if self.incoming_stream.closed:
-                break
-            chunk = self.incoming_stream.read(CHUNK_SIZE)
-            log.debug("dispatch %d bytes", len(chunk))
-            if not chunk:
-                break
-            for (_, w) in pipes:
-                if w:
-                    w.write(chunk)
-        log.debug("EOF detected")
-        for (r, w) in pipes:
-            if w:
-                w.close()  # close should flush too
+    def run(self):
+        """ streams to all the clients synchronously """
+        if not self.clients:
+            log.debug("No plugin wants the incoming stream.")
+            return
+        if self.spool:
+            self._run_spooled()
+            return
+        broadcast = Broadcast(spill_dir=self.spill_dir)
+        threads = self._start_streamers([broadcast.reader() for _ in self.clients])
+        for chunk in self._chunks():
+            broadcast.write(chunk)
+        broadcast.close()
         # we want to be sure that if we join on the main thread,
         # everything is either fully transfered or errored
         for thread in threads:
             thread.join()
+
+    def _run_spooled(self):
+        with tempfile.TemporaryFile(prefix='errbot-transfer-', dir=self.spill_dir) as spool:
+            for chunk in self._chunks():
+                spool.write(chunk)
+            spool.flush()
+            mapped = mmap.mmap(spool.fileno(), 0, access=mmap.ACCESS_READ) if spool.tell() else None
+            buffer = memoryview(mapped) if mapped is not None else memoryview(b'')
+            threads = self._start_streamers([MappedReader(buffer) for _ in self.clients])
+            for thread in threads:
+                thread.join()
+            buffer.release()
+            if mapped is not None:
+                try:
+                    mapped.close()
+                except BufferError:
+                    log.warning("A plugin still holds a view of the incoming transfer, it stays mapped.")
+
+
+def _remaining_size(stream) -> Optional[int]:
+    """ The number of bytes left in stream if it can be found without reading it. """
+    try:
+        if not stream.seekable():
+            return None
+        position = stream.tell()
+        size = stream.seek(0, io.SEEK_END) - position
+        stream.seek(position)
+        return size
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+def _connect(url: str, proxies: Optional[Mapping[str, str]],
+             timeout: float) -> Tuple[http.client.HTTPConnection, str, Dict[str, str]]:
+    """
+    A connection to the server of url, through the proxy configured for its scheme, the path to request and the
+    headers for the proxy.
+    """
+    parts = urlsplit(url)
+    path = (parts.path or '/') + ('?' + parts.query if parts.query else '')
+    proxies = getproxies() if proxies is None else proxies
+    proxy = None if proxy_bypass(parts.hostname or '') else proxies.get(parts.scheme)
+    if not proxy:
+        connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        return connection_class(parts.netloc, timeout=timeout), path, {}
+    proxy = urlsplit(proxy if '://' in proxy else 'http://' + proxy)
+    headers = {}
+    if proxy.username:
+        credentials = '%s:%s' % (unquote(proxy.username), unquote(proxy.password or ''))
+        headers['Proxy-Authorization'] = 'Basic ' + b64encode(credentials.encode()).decode()
+    proxy_address = '%s:%d' % (proxy.hostname, proxy.port or 8080)
+    if parts.scheme == 'https':  # tunneled with CONNECT, the TLS session is with the server
+        connection = http.client.HTTPSConnection(proxy_address, timeout=timeout)
+        connection.set_tunnel(parts.hostname, parts.port or 443, headers=headers)
+        return connection, path, {}
+    # a plain http proxy gets the absolute URL.
+    return http.client.HTTPConnection(proxy_address, timeout=timeout), url, headers
+
+
+def _quote(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\r', '').replace('\n', '')
+
+
+def upload_multipart(url: str, fields: Mapping[str, str], file_field: str, stream, filename: str = None,
+                     content_type: str = None, timeout: float = 300,
+                     proxies: Mapping[str, str] = None) -> Tuple[int, bytes]:
+    """
+    POST fields and the content of stream as multipart/form-data, read and sent in chunks.
+
+    Only one chunk of the file is in memory at a time. When the size of the content can be found by seeking, the
+    request has a Content-Length, otherwise it is sent with the chunked transfer encoding.
+
+    :param url: the http or https URL to post to.
+    :param fields: the other form fields.
+    :param file_field: the name of the form field of the file.
+    :param stream: the content to upload, a binary file-like object. If it is a Stream, the progress of the upload
+                   is reported with Stream.ack_data.
+    :param filename: the name of the file given to the server.
+    :param content_type: the mimetype of the file, application/octet-stream if it is None or not a mimetype.
+    :param timeout: the timeout of the socket operations, in seconds.
+    :param proxies: the proxy URL per scheme, like the proxies of requests. By default, the proxies of the
+                    environment (HTTP_PROXY, HTTPS_PROXY, NO_PROXY).
+    :return: the status and the body of the response.
+    """
+    if content_type is None or not MIMETYPE.match(content_type):
+        content_type = 'application/octet-stream'
+    boundary = uuid.uuid4().hex
+    preamble = b''.join(('--%s\r\nContent-Disposition: form-data; name="%s"\r\n\r\n%s\r\n'
+                         % (boundary, _quote(name), value)).encode() for name, value in fields.items())
+    preamble += ('--%s\r\nContent-Disposition: form-data; name="%s"; filename="%s"\r\nContent-Type: %s\r\n\r\n'
+                 % (boundary, _quote(file_field), _quote(filename or file_field), content_type)).encode()
+    epilogue = ('\r\n--%s--\r\n' % boundary).encode()
+
+    ack_data = getattr(stream, 'ack_data', None)
+
+    def body() -> Iterator[bytes]:
+        yield preamble
+        sent = 0
+        while True:
+            chunk = stream.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+            sent += len(chunk)
+            if ack_data is not None:
+                ack_data(sent)
+        yield epilogue
+
+    headers = {'Content-Type': 'multipart/form-data; boundary=%s' % boundary}
+    size = _remaining_size(stream)
+    if size is not None:
+        headers['Content-Length'] = str(len(preamble) + size + len(epilogue))
+
+    connection, path, proxy_headers = _connect(url, proxies, timeout)
+    headers.update(proxy_headers)
+    try:
+        connection.request('POST', path, body=body(), headers=headers)
+        response = connection.getresponse()
+        return response.status, response.read()
+    finally:
+        connection.close()
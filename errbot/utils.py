@@ -9,6 +9,8 @@ import time
 from platform import system
 from functools import wraps
 from html import entities
+from typing import NamedTuple, Tuple
+from weakref import WeakKeyDictionary
 
 log = logging.getLogger(__name__)
 
@@ -74,6 +76,48 @@ def get_class_for_method(meth):
     return None
 
 
+class DecoratedMembers(NamedTuple):
+    """ The names of the methods of a class tagged by the errbot decorators.
+    """
+    commands: Tuple[str, ...]  # botcmd, re_botcmd, botmatch and arg_botcmd
+    command_filters: Tuple[str, ...]
+    flows: Tuple[str, ...]
+    webhooks: Tuple[str, ...]
+
+
+_decorated_members_cache = WeakKeyDictionary()
+
+
+def decorated_members(obj) -> DecoratedMembers:
+    """
+    Find the methods of obj tagged by the errbot decorators.
+
+    The scan is done once per class, on the class itself so the properties of obj are not evaluated.
+    The names are given in alphabetical order, like inspect.getmembers.
+
+    :param obj: typically a plugin instance.
+    """
+    cls = type(obj)
+    members = _decorated_members_cache.get(cls)
+    if members is None:
+        commands, command_filters, flows, webhooks = [], [], [], []
+        for name in dir(cls):
+            func = getattr(cls, name, None)
+            if not (inspect.isfunction(func) or inspect.ismethod(func)):
+                continue
+            if getattr(func, '_err_command', False):
+                commands.append(name)
+            if getattr(func, '_err_command_filter', False):
+                command_filters.append(name)
+            if getattr(func, '_err_flow', False):
+                flows.append(name)
+            if getattr(func, '_err_webhook_uri_rule', False):
+                webhooks.append(name)
+        members = DecoratedMembers(tuple(commands), tuple(command_filters), tuple(flows), tuple(webhooks))
+        _decorated_members_cache[cls] = members
+    return members
+
+
 INVALID_VERSION_EXCEPTION = 'version %s in not in format "x.y.z" or "x.y.z-{beta,alpha,rc1,rc2...}" for example "1.2.2"'
 
 
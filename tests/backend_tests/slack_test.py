@@ -2,9 +2,11 @@ import sys
 import unittest
 import logging
 import os
+from io import BytesIO
 from tempfile import mkdtemp
-from mock import MagicMock
+from mock import MagicMock, patch
 
+from errbot.backends.base import STREAM_ERROR, STREAM_SUCCESSFULLY_TRANSFERED, Stream
 from errbot.bootstrap import bot_config_defaults
 
 log = logging.getLogger(__name__)
@@ -317,3 +319,19 @@ class SlackTests(unittest.TestCase):
                 [self.slack.build_identifier('<@UABCDE>'),
                  self.slack.build_identifier('<@UFGHIJ>')])
         )
+
+    def test_upload_is_streamed(self):
+        stream = Stream(self.slack.build_identifier('<#C12345>'), BytesIO(b'content'), 'file.txt')
+        with patch.object(slack, 'upload_multipart', return_value=(200, b'{"ok": true}')) as upload:
+            self.slack._slack_upload(stream)
+        url, fields, file_field, source = upload.call_args[0][:4]
+        self.assertEqual(url, 'https://slack.com/api/files.upload')
+        self.assertEqual(fields, {'token': '___', 'channels': stream.identifier.channelid, 'filename': 'file.txt'})
+        self.assertIs(source, stream)
+        self.assertIsNone(upload.call_args[1]['proxies'])  # from BOT_IDENTITY, like for SlackClient
+        self.assertEqual(stream.status, STREAM_SUCCESSFULLY_TRANSFERED)
+
+        stream = Stream(self.slack.build_identifier('<#C12345>'), BytesIO(b'content'), 'file.txt')
+        with patch.object(slack, 'upload_multipart', return_value=(200, b'{"ok": false, "error": "nope"}')):
+            self.slack._slack_upload(stream)
+        self.assertEqual(stream.status, STREAM_ERROR)
@@ -0,0 +1,85 @@
+import os
+from tempfile import mkdtemp
+
+import pytest
+
+from errbot import backup
+from errbot.backup import BackupError, read_header, restore_backup, write_backup
+from errbot.storage import PersistedDict, StoreMixin
+from errbot.storage.memory import MemoryStoragePlugin
+
+
+@pytest.fixture
+def stores():
+    plugin = MemoryStoragePlugin(None)
+    stores = {}
+    for namespace in ('core', 'Weather'):
+        store = StoreMixin()
+        store.open_storage(plugin, namespace)
+        stores[namespace] = store
+    stores['core']['configs'] = PersistedDict({'Weather': {'city': 'Paris'}})
+    stores['Weather']['cache'] = {('Paris', 'today'): 'sunny'}  # repr of this would not round trip everywhere
+    stores['Weather'].set_with_ttl('forecast', 'rainy', 3600)
+    return stores
+
+
+def restore(filename):
+    restored = {}
+
+    def storage(namespace):
+        return restored.setdefault(namespace, MemoryStoragePlugin(None).open('restored-' + namespace))
+
+    count = restore_backup(filename, storage)
+    return restored, count
+
+
+def raw(store):
+    return dict(store._store.items())
+
+
+def test_backup_and_restore(stores):
+    filename = os.path.join(mkdtemp(), 'backup.errbak')
+    written = write_backup(filename, {namespace: store._store for namespace, store in stores.items()})
+    restored, count = restore(filename)
+    assert written == count == len(raw(stores['core'])) + len(raw(stores['Weather']))
+    assert dict(restored['core'].items()) == raw(stores['core'])
+    assert dict(restored['Weather'].items()) == raw(stores['Weather'])
+
+
+def test_incremental_backup(stores):
+    directory = mkdtemp()
+    full, incremental = os.path.join(directory, 'backup-1.errbak'), os.path.join(directory, 'backup-2.errbak')
+    namespaces = {namespace: store._store for namespace, store in stores.items()}
+    write_backup(full, namespaces)
+    stores['Weather']['cache'] = {}
+    stores['Weather']['new'] = 1
+    del stores['Weather']['forecast']
+
+    assert write_backup(incremental, namespaces, base=full) == 3
+    assert read_header(incremental)['base'] == 'backup-1.errbak'
+    restored, _ = restore(incremental)
+    assert dict(restored['Weather'].items()) == raw(stores['Weather'])
+    assert dict(restored['core'].items()) == raw(stores['core'])
+
+
+def test_incremental_backup_doesnt_rely_on_the_crc(stores, monkeypatch):
+    monkeypatch.setattr(backup.zlib, 'crc32', lambda data: 0)  # every value has the same CRC
+    directory = mkdtemp()
+    full, incremental = os.path.join(directory, 'backup-1.errbak'), os.path.join(directory, 'backup-2.errbak')
+    namespaces = {namespace: store._store for namespace, store in stores.items()}
+    write_backup(full, namespaces)
+    stores['Weather']['cache'] = {('Paris', 'today'): 'cloudy'}
+
+    assert write_backup(incremental, namespaces, base=full) == 1
+    restored, _ = restore(incremental)
+    assert dict(restored['Weather'].items()) == raw(stores['Weather'])
+
+
+def test_corrupted_backup(stores):
+    filename = os.path.join(mkdtemp(), 'backup.errbak')
+    write_backup(filename, {'Weather': stores['Weather']._store})
+    with open(filename, 'r+b') as f:
+        f.seek(60)
+        f.write(b'\xff\xff')
+    with pytest.raises(BackupError):
+        restore(filename)
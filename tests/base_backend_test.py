@@ -10,6 +10,9 @@ import os  # noqa
 import re  # noqa
 from collections import OrderedDict
 from queue import Queue, Empty  # noqa
+from threading import Event, Thread
+from time import monotonic, sleep
+from types import MethodType
 from errbot.core import ErrBot
 from errbot.backends.base import Message, Room, Identifier, ONLINE
 from errbot.backends.test import TestPerson, TestOccupant, TestRoom, ShallowConfig
@@ -43,6 +46,7 @@ SIMPLE_JSON_PLUGINS_INDEX = """
 
 
 class DummyBackend(ErrBot):
+    BROADCAST_MIN_INTERVAL = 0
 
     def change_presence(self, status: str = ONLINE, message: str = '') -> None:
         pass
@@ -55,6 +59,7 @@ class DummyBackend(ErrBot):
 
     def __init__(self, extra_config=None):
         self.outgoing_message_queue = Queue()
+        self.cached_count_calls = 0
         if extra_config is None:
             extra_config = {}
         # make up a config.
@@ -204,6 +209,11 @@ class DummyBackend(ErrBot):
         for i in range(2):
             yield LONG_TEXT_STRING * 3
 
+    @botcmd(cache_ttl=60)
+    def cached_count(self, msg, args):
+        self.cached_count_calls += 1
+        return "%s %d" % (args, self.cached_count_calls)
+
     ##
     # arg_botcmd test commands
     ##
@@ -359,6 +369,139 @@ def test_output_longer_than_max_msg_size_is_split_into_multiple_msgs_when_yielde
         dummy.pop_message(block=False)
 
 
+def test_output_longer_than_upload_threshold_is_uploaded(dummy_execute_and_send):
+    dummy, m = dummy_execute_and_send
+    dummy.bot_config.MESSAGE_SIZE_LIMIT = len(LONG_TEXT_STRING)
+    dummy.bot_config.MESSAGE_UPLOAD_THRESHOLD = len(LONG_TEXT_STRING) * 2
+    uploads = []
+    dummy.send_stream_request = lambda user, fsource, name=None, size=None, stream_type=None: uploads.append(
+        (user, fsource.read(), name, size))
+
+    dummy._execute_and_send(cmd='return_long_output', args=['foo', 'bar'], match=None, msg=m,
+                            template_name=dummy.return_long_output._err_command_template)
+    user, content, name, size = uploads[0]
+    assert content == (LONG_TEXT_STRING * 3).encode()
+    assert size == len(content)
+    assert name in dummy.pop_message().body
+    with pytest.raises(Empty):
+        dummy.pop_message(block=False)
+
+    # Under the threshold, it is sent inline.
+    dummy._execute_and_send(cmd='command', args='', match=None, msg=m)
+    assert 'Regular command' == dummy.pop_message().body
+    assert len(uploads) == 1
+
+
+def test_output_longer_than_upload_threshold_is_split_without_stream_support(dummy_execute_and_send):
+    dummy, m = dummy_execute_and_send
+    dummy.bot_config.MESSAGE_SIZE_LIMIT = len(LONG_TEXT_STRING)
+    dummy.bot_config.MESSAGE_UPLOAD_THRESHOLD = len(LONG_TEXT_STRING)
+
+    dummy._execute_and_send(cmd='return_long_output', args=['foo', 'bar'], match=None, msg=m,
+                            template_name=dummy.return_long_output._err_command_template)
+    for i in range(3):
+        assert LONG_TEXT_STRING.strip() == dummy.pop_message().body
+
+
+def test_broadcast(dummy_backend):
+    botmessages = []
+    dummy_backend._dispatch_botmessage = botmessages.append
+    recipients = [dummy_backend.build_identifier('user%d' % i) for i in range(20)]
+
+    results = dummy_backend.broadcast(recipients, 'Announcement')
+
+    assert [identifier for identifier, _ in results] == recipients
+    assert all(error is None for _, error in results)
+    assert len(botmessages) == 1
+    sent = [dummy_backend.pop_message() for _ in recipients]
+    assert {str(msg.to) for msg in sent} == {str(identifier) for identifier in recipients}
+    assert all(msg.body == 'Announcement' for msg in sent)
+
+
+def test_broadcast_reports_failures(dummy_backend):
+    send_message = dummy_backend.send_message
+
+    def failing_send_message(msg):
+        if msg.to.person == 'broken':
+            raise Exception('Kaboom!')
+        send_message(msg)
+
+    dummy_backend.send_message = failing_send_message
+    recipients = [dummy_backend.build_identifier(name) for name in ('ok', 'broken')]
+
+    (_, ok_error), (_, broken_error) = dummy_backend.broadcast(recipients, 'Announcement')
+    assert ok_error is None
+    assert str(broken_error) == 'Kaboom!'
+    assert dummy_backend.pop_message().to.person == 'ok'
+
+
+def test_broadcast_is_paced_by_the_backend(dummy_backend):
+    assert ErrBot.BROADCAST_MIN_INTERVAL > 0 and ErrBot.BROADCAST_BURST > 1
+    assert dummy_backend.bot_config.BOT_BROADCAST_MIN_INTERVAL is None
+    assert dummy_backend.bot_config.BOT_BROADCAST_BURST is None
+    dummy_backend.BROADCAST_MIN_INTERVAL, dummy_backend.BROADCAST_BURST = 0.1, 3
+    send_message, sent_at = dummy_backend.send_message, []
+
+    def timed_send_message(msg):
+        sent_at.append(monotonic())
+        send_message(msg)
+
+    dummy_backend.send_message = timed_send_message
+    start = monotonic()
+    dummy_backend.broadcast([dummy_backend.build_identifier('user%d' % i) for i in range(5)], 'Announcement')
+    sent_at.sort()
+    assert all(at - start < 0.08 for at in sent_at[:3])  # the burst
+    assert sent_at[3] - start >= 0.09 and sent_at[4] - start >= 0.19  # then one every interval
+
+
+def test_broadcast_min_interval_overrides_the_backend():
+    dummy = DummyBackend(extra_config={'BOT_BROADCAST_MIN_INTERVAL': 0, 'BOT_BROADCAST_BURST': 1})
+    dummy.BROADCAST_MIN_INTERVAL, dummy.BROADCAST_BURST = 60, 100
+    results = dummy.broadcast([dummy.build_identifier('user%d' % i) for i in range(5)], 'Announcement')
+    assert all(error is None for _, error in results)
+
+
+def test_commands_with_cache_ttl_are_served_from_the_cache(dummy_execute_and_send):
+    dummy, m = dummy_execute_and_send
+    for args in ('foo', 'foo', 'bar'):
+        dummy._execute_and_send(cmd='cached_count', args=args, match=None, msg=m)
+    assert [dummy.pop_message().body for _ in range(3)] == ['foo 1', 'foo 1', 'bar 2']
+    assert dummy.command_cache.stats() == {'cached_count': {'hits': 1, 'misses': 2}}
+
+    dummy.command_cache.invalidate('cached_count')
+    dummy._execute_and_send(cmd='cached_count', args='foo', match=None, msg=m)
+    assert 'foo 3' == dummy.pop_message().body
+
+
+def test_commands_with_cache_ttl_are_executed_once_concurrently(dummy_execute_and_send):
+    dummy, m = dummy_execute_and_send
+    started, release = Event(), Event()
+
+    def slow(msg, args):
+        started.set()
+        release.wait(3)
+        return 'done'
+
+    slow._err_command_cache_ttl = 60
+    slow._err_command_cache_key = None
+    slow._err_command_flow_only = False
+    dummy.commands['slow'] = slow
+
+    first = Thread(target=dummy._execute_and_send, kwargs=dict(cmd='slow', args='', match=None, msg=m))
+    first.start()
+    started.wait(3)
+    second = Thread(target=dummy._execute_and_send, kwargs=dict(cmd='slow', args='', match=None, msg=m))
+    second.start()
+    while dummy.command_cache.stats()['slow']['hits'] == 0:
+        sleep(0.01)
+    release.set()
+    first.join()
+    second.join()
+
+    assert [dummy.pop_message().body for _ in range(2)] == ['done', 'done']
+    assert dummy.command_cache.stats()['slow'] == {'hits': 1, 'misses': 1}
+
+
 def makemessage(dummy, message, from_=None, to=None):
     if not from_:
         from_ = dummy.build_identifier("noterr")
@@ -386,6 +529,57 @@ def test_inject_and_remove_re_botcmd(dummy_backend):
     assert len(dummy_backend.re_commands) == 0
 
 
+def test_inject_builds_the_command_plans(dummy_backend):
+    plan = dummy_backend._command_plans['admin_command']
+    assert plan.method == dummy_backend.admin_command
+    assert plan.admin_only and plan.historize and plan.split_args is None and not plan.generator
+
+    plan = dummy_backend._command_plans['yield_args_as_md']
+    assert plan.generator and plan.template == 'args_as_md'
+
+    plan = dummy_backend._re_command_plans['regex_command_without_prefix']
+    assert plan.re_pattern.pattern == '^regex command without prefix$'
+    assert not plan.prefix_required and not plan.matchall
+    assert dummy_backend._re_command_plans['regex_command_with_matchall'].matchall
+
+
+def test_remove_drops_the_command_plans(dummy_backend):
+    dummy_backend.remove_commands_from(dummy_backend)
+    assert dummy_backend._command_plans == {}
+    assert dummy_backend._re_command_plans == {}
+
+
+def test_command_plan_is_rebuilt_when_the_command_is_changed_directly(dummy_backend):
+    @botcmd(split_args_with=',')
+    def command(self, msg, args):
+        return ' '.join(args)
+
+    command = MethodType(command, dummy_backend)
+    dummy_backend.commands['command'] = command
+    dummy_backend.callback_message(makemessage(dummy_backend, "!command one,two"))
+    assert "one two" == dummy_backend.pop_message().body
+    assert dummy_backend._command_plans['command'].method is command
+
+
+def test_command_removed_before_its_execution_gets_an_error_reply(dummy_execute_and_send):
+    dummy, m = dummy_execute_and_send
+    del dummy.commands['command']
+    dummy._execute_and_send(cmd='command', args='', match=None, msg=m)
+    assert dummy.pop_message().body.startswith(dummy.MSG_ERROR_OCCURRED)
+
+
+def test_command_plan_of_an_untagged_function_takes_the_botcmd_defaults(dummy_backend):
+    def untagged(self, msg, args):
+        return 'args: ' + args
+
+    dummy_backend.commands['untagged'] = MethodType(untagged, dummy_backend)
+    dummy_backend._execute_and_send(cmd='untagged', args='one two', match=None,
+                                    msg=makemessage(dummy_backend, "!untagged one two"))
+    assert "args: one two" == dummy_backend.pop_message().body
+    plan = dummy_backend._command_plans['untagged']
+    assert not plan.admin_only and plan.historize and plan.template is None and plan.cache_ttl is None
+
+
 def test_callback_message(dummy_backend):
     dummy_backend.callback_message(makemessage(dummy_backend, "!return_args_as_str one two"))
     assert "one two" == dummy_backend.pop_message().body
@@ -0,0 +1,34 @@
+import pytest
+
+from errbot.cache import ResultCache
+
+
+def test_results_expire():
+    cache = ResultCache()
+    assert cache.get_or_compute('cmd', 'key', 60, lambda: 1) == 1
+    assert cache.get_or_compute('cmd', 'key', 60, lambda: 2) == 1
+    assert cache.get_or_compute('cmd', 'other', -1, lambda: 3) == 3
+    assert cache.get_or_compute('cmd', 'other', 60, lambda: 4) == 4
+    assert cache.stats() == {'cmd': {'hits': 1, 'misses': 3}}
+
+
+def test_least_recently_used_results_are_evicted():
+    cache = ResultCache(maxsize=2)
+    cache.get_or_compute('cmd', 1, 60, lambda: 'one')
+    cache.get_or_compute('cmd', 2, 60, lambda: 'two')
+    cache.get_or_compute('cmd', 1, 60, lambda: 'ONE')
+    cache.get_or_compute('cmd', 3, 60, lambda: 'three')
+    assert len(cache) == 2
+    assert cache.get_or_compute('cmd', 1, 60, lambda: 'ONE') == 'one'
+    assert cache.get_or_compute('cmd', 2, 60, lambda: 'TWO') == 'TWO'
+
+
+def test_errors_are_not_cached():
+    cache = ResultCache()
+
+    def fail():
+        raise ValueError('Kaboom!')
+
+    with pytest.raises(ValueError):
+        cache.get_or_compute('cmd', 'key', 60, fail)
+    assert cache.get_or_compute('cmd', 'key', 60, lambda: 'ok') == 'ok'
@@ -0,0 +1,98 @@
+from errbot.storage.caching import CachingStorage, CachingStoragePlugin
+from errbot.storage.memory import MemoryStoragePlugin, MemoryStorage
+
+import pytest
+
+
+class CountingStorage(MemoryStorage):
+    def __init__(self, namespace):
+        super().__init__(namespace)
+        self.gets = 0
+        self.sets = 0
+
+    def get(self, key):
+        self.gets += 1
+        return super().get(key)
+
+    def set(self, key, value):
+        self.sets += 1
+        super().set(key, value)
+
+    def set_many(self, entries):
+        self.sets += len(entries)
+        super().set_many(entries)
+
+
+def test_reads_are_cached():
+    inner = CountingStorage('reads')
+    inner.set('key', 'value')
+    storage = CachingStorage(inner, cache_size=1, write_behind=False)
+    assert storage.get('key') == 'value'
+    assert storage.get('key') == 'value'
+    assert inner.gets == 1
+
+    storage.set('other', 'value')  # evicts 'key'
+    assert inner.sets == 2
+    storage.get('key')
+    assert inner.gets == 2
+
+
+def test_writes_are_coalesced_until_flushed():
+    inner = CountingStorage('writes')
+    storage = CachingStorage(inner, cache_size=10, write_behind=True)
+    for i in range(100):
+        storage.set('counter', i)
+    storage.set('gone', 1)
+    storage.remove('gone')
+    with pytest.raises(KeyError):
+        storage.get('gone')
+    assert storage.get('counter') == 99
+    assert inner.sets == 0
+
+    storage.close()
+    assert inner.sets == 1
+    assert inner.get('counter') == 99
+    assert 'gone' not in inner.keys()
+
+
+def test_plugin_flushes_open_storages():
+    plugin = CachingStoragePlugin(MemoryStoragePlugin(None), cache_size=10, flush_interval=3600)
+    storage = plugin.open('flushed')
+    storage.set('key', 'value')
+    assert 'key' not in storage._storage.keys()
+    plugin.flush()
+    assert storage._storage.get('key') == 'value'
+
+
+class FailingStorage(MemoryStorage):
+    failures = 1
+
+    def set_many(self, entries):
+        if self.failures:
+            self.failures -= 1
+            raise IOError('disk full')
+        super().set_many(entries)
+
+
+def test_failed_flush_keeps_the_writes():
+    inner = FailingStorage('failing')
+    storage = CachingStorage(inner, cache_size=10, write_behind=True)
+    storage.set('key', 'old')
+    storage.set('other', 1)
+    with pytest.raises(IOError):
+        storage.flush()
+    storage.set('key', 'new')  # newer than the write that failed
+    storage.flush()
+    assert (inner.get('key'), inner.get('other')) == ('new', 1)
+
+
+def test_plugin_flush_stops_the_flusher():
+    plugin = CachingStoragePlugin(MemoryStoragePlugin(None), cache_size=10, flush_interval=3600)
+    plugin.open('flushed')
+    flusher = plugin._flusher
+    assert flusher.is_alive()
+    plugin.flush()
+    assert not flusher.is_alive()
+    plugin.open('again')
+    assert plugin._flusher.is_alive()
+    plugin.flush()
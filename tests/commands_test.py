@@ -10,6 +10,8 @@ from tempfile import mkdtemp
 import pytest
 import tarfile
 
+from errbot.storage import EXPIRING_INDEX, EXPIRING_MARKER
+
 extra_plugin_dir = path.join(path.dirname(path.realpath(__file__)), 'dummy_plugin')
 
 
@@ -60,6 +62,10 @@ def test_status_gc(testbot):
     assert 'GC 0->' in testbot.exec_command('!status gc')
 
 
+def test_status_cache(testbot):
+    assert 'No command has been served from the cache yet.' in testbot.exec_command('!status cache')
+
+
 def test_config_cycle(testbot):
     testbot.push_message('!plugin config Webserver')
     m = testbot.pop_message()
@@ -196,6 +202,11 @@ def test_backup(testbot):
     testbot.push_message('!repos uninstall errbotio/err-helloworld')
 
 
+def test_backup_rejects_unknown_arguments(testbot):
+    assert testbot.exec_command('!backup incremantal') == 'Usage: !backup [incremental]'
+    assert not [name for name in os.listdir(testbot.bot_config.BOT_DATA_DIR) if name.startswith('backup-')]
+
+
 def test_encoding_preservation(testbot):
     testbot.push_message('!echo へようこそ')
     assert 'へようこそ' == testbot.pop_message()
@@ -354,3 +365,11 @@ def test_command_not_found_with_space_in_bot_prefix(testbot):
     testbot.bot_config.BOT_PREFIX = '! '
     assert 'Command "blah" not found.' in testbot.exec_command('! blah')
     assert 'Command "blah" / "blah toto" not found.' in testbot.exec_command('! blah toto')
+
+
+def test_compact_storages(testbot):
+    plugin = testbot.bot.plugin_manager.get_plugin_obj_by_name('Health')
+    plugin.set_with_ttl('stale', 1, 0)
+    plugin.set_with_ttl('fresh', 2, 3600)
+    testbot.bot.compact_storages()
+    assert sorted(plugin._store.keys()) == [EXPIRING_MARKER, EXPIRING_INDEX + 'fresh', 'fresh']
@@ -31,7 +31,7 @@ def test_autotrigger(testbot):
     assert 'You are in the flow w2, you can continue with' in flow_message
     assert '!b' in flow_message
     assert len(testbot.bot.flow_executor.in_flight) == 1
-    assert testbot.bot.flow_executor.in_flight[0].name == 'w2'
+    assert next(iter(testbot.bot.flow_executor.in_flight)).name == 'w2'
 
 
 def test_no_duplicate_autotrigger(testbot):
@@ -40,7 +40,7 @@ def test_no_duplicate_autotrigger(testbot):
     assert 'You are in the flow w2, you can continue with' in flow_message
     assert 'c' in testbot.exec_command('!c')
     assert len(testbot.bot.flow_executor.in_flight) == 1
-    assert testbot.bot.flow_executor.in_flight[0].name == 'w2'
+    assert next(iter(testbot.bot.flow_executor.in_flight)).name == 'w2'
 
 
 def test_secondary_autotrigger(testbot):
@@ -49,7 +49,7 @@ def test_secondary_autotrigger(testbot):
     assert 'You are in the flow w2, you can continue with' in second_message
     assert '!d' in second_message
     assert len(testbot.bot.flow_executor.in_flight) == 1
-    assert testbot.bot.flow_executor.in_flight[0].name == 'w2'
+    assert next(iter(testbot.bot.flow_executor.in_flight)).name == 'w2'
 
 
 def test_manual_flow(testbot):
@@ -1,9 +1,13 @@
 import logging
+from time import monotonic, sleep, time
+from threading import Event
+from types import SimpleNamespace
 
 import pytest
 
 from errbot.backends.test import TestPerson
-from errbot.flow import Flow, FlowRoot, InvalidState
+from errbot.flow import Flow, FlowExecutor, FlowRoot, InvalidState, TimerWheel, merge_contexts
+from errbot.storage.memory import MemoryStoragePlugin
 
 log = logging.getLogger(__name__)
 
@@ -43,3 +47,184 @@ def test_autotrigger():
     root = FlowRoot("test", "This is my flowroot")
     node = root.connect("a", lambda ctx: 'toto' in ctx and ctx['toto'] == 'titui', auto_trigger=True)
     assert node.command in root.auto_triggers
+
+
+def test_executor_indexes_in_flight_flows():
+    executor = FlowExecutor(bot=None)
+    executor.execute = lambda flow: None  # only the bookkeeping is tested here
+    root = FlowRoot("test", "This is my flowroot")
+    a = root.connect("a", auto_trigger=True)
+    a.connect("b")
+    executor.add_flow(root)
+    people = [TestPerson('user%d' % i) for i in range(100)]
+
+    for person in people:
+        assert executor.trigger('a', person).requestor == person
+    assert len(executor.in_flight) == 100
+    assert executor.check_inflight_already_running(people[42])
+    assert executor.check_inflight_flow_triggered('a', people[42]) == (None, None)
+    flow, step = executor.check_inflight_flow_triggered('b', people[42])
+    assert flow.requestor == people[42] and step.command == 'b'
+    assert executor.check_inflight_flow_triggered('b', TestPerson('nobody')) == (None, None)
+
+    assert executor.trigger('b', people[42]) is flow
+    assert executor.check_inflight_flow_triggered('b', people[42]) == (None, None)
+
+    assert executor.stop_flow('test', people[0]).requestor == people[0]
+    assert not executor.check_inflight_already_running(people[0])
+    assert len(executor.in_flight) == 99
+
+
+def test_timer_wheel():
+    wheel = TimerWheel(tick=1, slots=8, now=0)
+    wheel.schedule('a', 3)
+    wheel.schedule('b', 20)  # more than a turn of the wheel
+    wheel.schedule('c', 5)
+    wheel.cancel('c')
+    assert wheel.advance(2) == []
+    assert wheel.advance(4) == ['a']
+    assert wheel.advance(12) == []  # b is in the slot of tick 12 but 2 turns later
+    wheel.schedule('b', 30)  # rescheduled
+    assert wheel.advance(25) == []
+    assert wheel.advance(1000) == ['b']
+    assert len(wheel) == 0
+
+
+def _executor(**config):
+    sent = []
+    bot_config = SimpleNamespace(**config)
+    bot = SimpleNamespace(bot_config=bot_config, storage_plugin=MemoryStoragePlugin(bot_config),
+                          send=lambda identifier, text: sent.append((identifier, text)))
+    executor = FlowExecutor(bot)
+    executor.execute = lambda flow: None
+    root = FlowRoot("test", "This is my flowroot")
+    root.connect("a").connect("b")
+    executor.add_flow(root)
+    return executor, sent
+
+
+def test_executor_stops_idle_and_old_flows():
+    executor, sent = _executor(FLOW_IDLE_TIMEOUT=60, FLOW_MAX_LIFETIME=600)
+    try:
+        idle = executor.start_flow('test', TestPerson('idle'), {})
+        busy = executor.start_flow('test', TestPerson('busy'), {})
+        now = monotonic()
+        busy.last_activity = now + 50  # as if busy advanced 50s later
+        executor._schedule_idle_timers(busy)
+        assert executor.expire_flows(now + 70) == [idle]
+        assert sent == [(idle.requestor, 'The flow **test** has been stopped: it was idle for too long.')]
+        assert executor.in_flight == {busy}
+        for t in range(100, 700, 50):  # busy keeps advancing but runs for too long
+            busy.last_activity = now + t
+            executor._schedule_idle_timers(busy)
+            assert executor.expire_flows(now + t) == ([busy] if t == 600 else [])
+        assert not executor.in_flight
+    finally:
+        executor.shutdown()
+
+
+def test_executor_caps_flows():
+    executor, _ = _executor(FLOW_MAX_IN_FLIGHT=3, FLOW_MAX_IN_FLIGHT_PER_USER=1)
+    executor.flow_roots['test'].room_flow = True
+    executor.start_flow('test', TestPerson('user1'), {})
+    with pytest.raises(ValueError):
+        executor.start_flow('test', TestPerson('user1'), {})
+    executor.start_flow('test', TestPerson('user2'), {})
+    executor.start_flow('test', TestPerson('user3'), {})
+    with pytest.raises(ValueError):
+        executor.start_flow('test', TestPerson('user4'), {})
+
+
+def test_executor_spills_idle_contexts():
+    executor, _ = _executor(FLOW_SPILL_AFTER=30)
+    try:
+        flow = executor.start_flow('test', TestPerson('user'), {'answer': 42})
+        executor.expire_flows(monotonic() + 40)
+        storage = executor._spill_storage
+        assert flow.spilled and storage.len() == 1
+        assert flow.ctx == {'answer': 42}
+        assert not flow.spilled and storage.len() == 0
+
+        executor.expire_flows(monotonic() + 80)  # not rescheduled until the flow advances
+        assert not flow.spilled
+        executor.trigger('a', flow.requestor)
+        executor.expire_flows(monotonic() + 120)
+        assert flow.spilled
+        executor.stop_flow('test', flow.requestor)
+        assert storage.len() == 0
+    finally:
+        executor.shutdown()
+
+
+def test_executor_does_not_spill_executing_flows():
+    executor, sent = _executor(FLOW_SPILL_AFTER=30)
+    del executor.execute  # back to the real one
+    started, release = Event(), Event()
+
+    def slow(msg, args):
+        started.set()
+        release.wait(3)
+        msg.ctx['done'] = True
+
+    bot = executor._bot
+    bot.commands, bot.prefix = {'slow': slow}, '!'
+    bot.all_commands = {'a': SimpleNamespace(_err_re_command=False, _err_command_syntax=None)}
+    root = FlowRoot('slow', 'A flow with an automatic step')
+    root.connect('slow', predicate=lambda ctx: 'done' not in ctx).connect('a')
+    executor.add_flow(root)
+    try:
+        flow = executor.start_flow('slow', TestPerson('user'), {'answer': 42})
+        assert started.wait(3)
+        now = monotonic()
+        executor.expire_flows(now + 40)
+        assert not flow.spilled
+        release.set()
+        for _ in range(300):
+            if flow not in executor._executing:
+                break
+            sleep(.01)
+        executor.expire_flows(now + 80)
+        assert flow.spilled
+        assert flow.ctx == {'answer': 42, 'done': True}  # the changes of the step are kept
+    finally:
+        executor.shutdown()
+
+
+def test_merge_contexts():
+    base = {'kept': 1, 'changed': 2, 'removed': 3}
+    merged = merge_contexts(base, [{'kept': 1, 'changed': 20, 'removed': 3, 'new': 4},
+                                   {'kept': 1, 'changed': 2, 'new': 40}])
+    assert merged == {'kept': 1, 'changed': 20, 'new': 40}
+    assert base == {'kept': 1, 'changed': 2, 'removed': 3}
+
+
+def test_executor_runs_branches_concurrently():
+    def lookup(name):
+        def command(msg, args):
+            sleep(0.3)
+            msg.ctx[name] = name.upper()
+        return command
+
+    def failing(msg, args):
+        msg.ctx['failed'] = True
+        raise Exception('boom')
+
+    sent = []
+    bot = SimpleNamespace(bot_config=SimpleNamespace(FLOW_BRANCH_THREADS=4),
+                          commands={'a': lookup('a'), 'b': lookup('b'), 'c': lookup('c'), 'd': failing},
+                          send=lambda identifier, text: sent.append(text))
+    executor = FlowExecutor(bot)
+    root = FlowRoot("test", "This is my flowroot")
+    for cmd in 'abcd':
+        root.connect(cmd, predicate=lambda ctx: True)
+    executor.add_flow(root)
+
+    start = time()
+    flow = executor.start_flow('test', TestPerson('user'), {'start': True})
+    while executor.in_flight and time() - start < 5:
+        sleep(0.01)
+    assert time() - start < 0.8  # and not 0.9 sequentially
+    assert flow.ctx == {'start': True, 'a': 'A', 'b': 'B', 'c': 'C'}
+    assert flow.current_step.command == 'a'
+    assert len(sent) == 1 and 'boom' in sent[0]
+    assert not executor.in_flight
@@ -0,0 +1,73 @@
+from tempfile import mkdtemp
+from threading import Thread
+
+import pytest
+
+from errbot.backends.test import ShallowConfig
+from errbot.storage import StoreMixin, MISSING
+
+pytest.importorskip('lmdb')
+from errbot.storage.lmdbstore import LMDBStoragePlugin  # noqa
+
+
+@pytest.fixture
+def config():
+    config = ShallowConfig()
+    config.BOT_DATA_DIR = mkdtemp()
+    return config
+
+
+def test_set_get_remove(config):
+    storage = LMDBStoragePlugin(config).open('ns')
+    storage.set('key', {'a': [1, 2]})
+    assert storage.get('key') == {'a': [1, 2]}
+    assert storage.len() == 1
+    assert list(storage.keys()) == ['key']
+    storage.remove('key')
+    with pytest.raises(KeyError):
+        storage.get('key')
+    with pytest.raises(KeyError):
+        storage.remove('key')
+
+
+def test_namespaces_share_the_environment_but_not_the_keys(config):
+    plugin = LMDBStoragePlugin(config)
+    one, two = plugin.open('one'), plugin.open('two')
+    one.set('key', 1)
+    two.set('key', 2)
+    assert (one.get('key'), two.get('key')) == (1, 2)
+    assert one.len() == 1
+
+    sm = StoreMixin()
+    sm.open_storage(plugin, 'one')
+    assert sm['key'] == 1
+    assert len(sm) == 1
+
+
+def test_bulk_operations(config):
+    storage = LMDBStoragePlugin(config).open('ns')
+    storage.set_many({'a': 1, 'b': 2, 'c': 3})
+    assert storage.contains('a')
+    assert not storage.contains('z')
+    assert storage.get_many(['a', 'c', 'z']) == {'a': 1, 'c': 3}
+    storage.remove_many(['a', 'z'])
+    assert sorted(storage.items()) == [('b', 2), ('c', 3)]
+
+
+def test_atomic_operations(config):
+    storage = LMDBStoragePlugin(config).open('ns')
+
+    def increment():
+        for _ in range(50):
+            storage.update('count', lambda count: count + 1, default=0)
+
+    threads = [Thread(target=increment) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert storage.get('count') == 200
+    assert storage.compare_and_set('new', MISSING, 1)
+    assert not storage.compare_and_set('new', MISSING, 2)
+    assert storage.compare_and_set('new', 1, 2)
+    assert storage.get('new') == 2
@@ -1,5 +1,15 @@
-from errbot.storage import StoreMixin
+from itertools import count
+from tempfile import mkdtemp
+from threading import Barrier, Event, Thread
+
+import pytest
+
+from errbot.backends.test import ShallowConfig
+from errbot.storage import StoreMixin, PersistedDict, MISSING, Expiring, EXPIRING_INDEX, EXPIRING_MARKER
+from errbot.storage.caching import CachingStoragePlugin
 from errbot.storage.memory import MemoryStoragePlugin
+from errbot.storage.shelf import ShelfStoragePlugin
+from errbot.storage.sqlite import SqliteStoragePlugin
 
 
 def test_simple_store_retreive():
@@ -18,3 +28,259 @@ def test_mutable():
         titi[1] = 5
 
     assert sm['toto'] == [1, 5]
+
+
+def test_bulk_operations():
+    sm = StoreMixin()
+    sm.open_storage(MemoryStoragePlugin(None), 'bulk')
+    sm.update({'a': 1, 'b': 2}, c=3)
+    assert 'a' in sm
+    assert 'z' not in sm
+    assert sm.get_many(['a', 'c', 'z']) == {'a': 1, 'c': 3}
+    assert sorted(sm.items()) == [('a', 1), ('b', 2), ('c', 3)]
+    sm.clear()
+    assert len(sm) == 0
+
+
+def test_shelf_bulk_operations():
+    config = ShallowConfig()
+    config.BOT_DATA_DIR = mkdtemp()
+    storage = ShelfStoragePlugin(config).open('bulk')
+    storage.set_many({'a': 1, 'b': 2})
+    assert storage.contains('a')
+    storage.remove_many(['a', 'z'])
+    assert list(storage.items()) == [('b', 2)]
+    storage.close()
+
+
+class CountingMemoryStoragePlugin(MemoryStoragePlugin):
+    def open(self, namespace):
+        storage = super().open(namespace)
+        storage.written = []
+        set_many = storage.set_many
+
+        def counting_set_many(entries):
+            storage.written.extend(entries)
+            set_many(entries)
+        storage.set_many = counting_set_many
+        return storage
+
+
+def test_persisted_dict_only_writes_the_changed_entries():
+    sm = StoreMixin()
+    sm.open_storage(CountingMemoryStoragePlugin(None), 'persisted')
+    sm['big'] = PersistedDict({'a': [1], 'b': [2]})
+    sm['small'] = 'value'
+    assert sorted(sm.keys()) == ['big', 'small']
+    assert len(sm) == 2
+
+    sm._store.written = []
+    with sm.mutable('big') as big:
+        big['c'] = [3]
+        del big['b']
+        big['a'].append(4)
+    assert sorted(key.split('\x00')[-1] for key in sm._store.written) == ['a', 'c']
+    assert dict(sm['big']) == {'a': [1, 4], 'c': [3]}
+    assert 'b' not in sm['big']
+
+    sm['big'] = 'not a dict anymore'
+    assert sorted(sm._store.keys()) == ['\x00', 'big', 'small']
+
+
+def test_persisted_dict_on_sqlite():
+    config = ShallowConfig()
+    config.BOT_DATA_DIR = mkdtemp()
+    sm = StoreMixin()
+    sm.open_storage(SqliteStoragePlugin(config), 'persisted')
+    sm['big'] = PersistedDict(a=1)
+    with sm.mutable('big') as big:
+        big['b'] = 2
+    sm.close_storage()
+
+    sm.open_storage(SqliteStoragePlugin(config), 'persisted')
+    assert dict(sm['big']) == {'a': 1, 'b': 2}
+    assert list(sm) == ['big']
+
+
+@pytest.mark.parametrize('storage_plugin', ['memory', 'shelf', 'sqlite'])
+def test_concurrent_updates_are_not_lost(storage_plugin):
+    config = ShallowConfig()
+    config.BOT_DATA_DIR = mkdtemp()
+    plugin = {'memory': MemoryStoragePlugin, 'shelf': ShelfStoragePlugin, 'sqlite': SqliteStoragePlugin}[storage_plugin]
+    sm = StoreMixin()
+    sm.open_storage(plugin(config), 'concurrent-' + storage_plugin)
+    sm['mutable'] = [0]
+
+    def increment():
+        for _ in range(100):
+            sm.atomic_update('updated', lambda count: count + 1, default=0)
+            with sm.mutable('mutable') as counter:
+                counter[0] += 1
+
+    threads = [Thread(target=increment) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sm['updated'] == 400
+    assert sm['mutable'] == [400]
+    sm.close_storage()
+
+
+@pytest.mark.parametrize('storage_plugin', ['memory', 'shelf', 'sqlite', 'cached sqlite'])
+def test_mutable_and_atomic_update_exclude_each_other(storage_plugin):
+    config = ShallowConfig()
+    config.BOT_DATA_DIR = mkdtemp()
+    if storage_plugin == 'cached sqlite':
+        plugin = CachingStoragePlugin(SqliteStoragePlugin(config), cache_size=10)
+    else:
+        plugin = {'memory': MemoryStoragePlugin, 'shelf': ShelfStoragePlugin,
+                  'sqlite': SqliteStoragePlugin}[storage_plugin](config)
+    sm = StoreMixin()
+    sm.open_storage(plugin, 'exclusive-' + storage_plugin)
+    sm['counter'] = {'n': 0}
+    in_mutable, release = Event(), Event()
+
+    def mutate():
+        with sm.mutable('counter') as counter:
+            in_mutable.set()
+            release.wait(5)
+            counter['n'] += 1
+
+    mutator = Thread(target=mutate)
+    mutator.start()
+    in_mutable.wait(5)
+    updater = Thread(target=sm.atomic_update, args=('counter', lambda counter: {'n': counter['n'] + 1}))
+    updater.start()
+    updater.join(0.2)
+    assert updater.is_alive()  # waits for the mutable block
+    release.set()
+    mutator.join()
+    updater.join()
+    assert sm['counter'] == {'n': 2}
+    sm.close_storage()
+
+
+def test_writes_in_mutable_blocks_on_different_keys_dont_deadlock():
+    sm = StoreMixin()
+    sm.open_storage(MemoryStoragePlugin(None), 'nested')
+    by_stripe = {}  # 4 different keys that used to share 2 of 64 hash-striped locks
+    for key in ('key%d' % i for i in count()):
+        keys = by_stripe.setdefault(hash(key) % 64, [])
+        keys.append(key)
+        pairs = [keys for keys in by_stripe.values() if len(keys) >= 2]
+        if len(pairs) == 2:
+            break
+    (a, a_twin), (b, b_twin) = pairs[0][:2], pairs[1][:2]
+    both_in_mutable = Barrier(2, timeout=5)
+
+    def mutate_then_write(mutated, written):
+        with sm.mutable(mutated):
+            both_in_mutable.wait()
+            sm[written] = 'value'
+
+    sm[a], sm[b_twin] = 'a', 'b'
+    threads = [Thread(target=mutate_then_write, args=(a, b), daemon=True),
+               Thread(target=mutate_then_write, args=(b_twin, a_twin), daemon=True)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert not any(thread.is_alive() for thread in threads)
+    assert sm[b] == sm[a_twin] == 'value'
+    assert sm._store._key_locks[0] == {}  # the locks are dropped once released
+
+
+def test_compare_and_set():
+    sm = StoreMixin()
+    sm.open_storage(MemoryStoragePlugin(None), 'cas')
+    assert sm.compare_and_set('key', MISSING, 1)
+    assert not sm.compare_and_set('key', MISSING, 2)
+    assert not sm.compare_and_set('key', 2, 3)
+    assert sm.compare_and_set('key', 1, 3)
+    assert sm['key'] == 3
+
+
+@pytest.mark.parametrize('storage_plugin', ['memory', 'shelf', 'sqlite'])
+def test_expiring_keys(storage_plugin):
+    config = ShallowConfig()
+    config.BOT_DATA_DIR = mkdtemp()
+    plugin = {'memory': MemoryStoragePlugin, 'shelf': ShelfStoragePlugin, 'sqlite': SqliteStoragePlugin}[storage_plugin]
+    sm = StoreMixin()
+    sm.open_storage(plugin(config), 'ttl-' + storage_plugin)
+    sm['forever'] = 1
+    sm.set_with_ttl('fresh', 2, 3600)
+    sm.set_with_ttl('stale', 3, 0)
+    assert sm['fresh'] == 2
+    assert 'fresh' in sm and 'stale' not in sm
+    with pytest.raises(KeyError):
+        sm['stale']
+    assert sorted(sm.keys()) == ['forever', 'fresh']
+    assert len(sm) == 2
+    assert dict(sm.items()) == {'forever': 1, 'fresh': 2}
+    assert sm.get_many(['fresh', 'stale']) == {'fresh': 2}
+
+    assert sm.compact_storage() == 1
+    assert sm.compact_storage() == 0
+    assert sorted(sm._store.keys()) == [EXPIRING_MARKER, EXPIRING_INDEX + 'fresh', 'forever', 'fresh']
+
+
+def test_expiring_keys_keep_their_deadline():
+    sm = StoreMixin()
+    sm.open_storage(MemoryStoragePlugin(None), 'ttl')
+    sm.set_with_ttl('list', [1], 3600)
+    deadline = sm._store.get('list').deadline
+    with sm.mutable('list') as items:
+        items.append(2)
+    assert sm.atomic_update('list', lambda items: items + [3]) == [1, 2, 3]
+    assert sm._store.get('list') == Expiring([1, 2, 3], deadline)
+
+    sm.set_with_ttl('count', 10, 0)
+    assert sm.atomic_update('count', lambda count: count + 1, default=0) == 1
+    with pytest.raises(KeyError):
+        sm.atomic_update('count2', lambda count: count + 1)
+
+
+def test_compaction_does_not_remove_a_refreshed_key():
+    sm = StoreMixin()
+    sm.open_storage(MemoryStoragePlugin(None), 'refresh')
+    sm.set_with_ttl('key', 'old', 0)
+    remove = sm._store.remove
+    refresher = Thread(target=sm.set_with_ttl, args=('key', 'new', 3600))
+
+    def remove_while_refreshed(key):
+        if key == 'key':
+            refresher.start()
+            refresher.join(0.2)  # waits for the compaction to be done with the key
+        remove(key)
+
+    sm._store.remove = remove_while_refreshed
+    assert sm.compact_storage() == 1
+    refresher.join()
+    assert sm['key'] == 'new'
+
+
+def test_keys_only_decode_the_expired_values():
+    sm = StoreMixin()
+    sm.open_storage(MemoryStoragePlugin(None), 'index')
+    sm['forever'] = 1
+    sm.set_with_ttl('fresh', 2, 3600)
+    sm.set_with_ttl('stale', 3, 0)
+    sm.set_with_ttl('reset', 4, 0)
+    sm['reset'] = 5  # doesn't expire anymore, its index entry is stale
+    get_many = sm._store.get_many
+    requested = []
+
+    def spy(keys):
+        keys = list(keys)
+        requested.extend(keys)
+        return get_many(keys)
+
+    sm._store.get_many = spy
+    assert sorted(sm.keys()) == ['forever', 'fresh', 'reset']
+    assert len(sm) == 3
+    assert not {'forever', 'fresh'} & set(requested)
+    sm._store.get_many = get_many
+
+    assert sm.compact_storage() == 1
+    assert sorted(sm._store.keys()) == [EXPIRING_MARKER, EXPIRING_INDEX + 'fresh', 'forever', 'fresh', 'reset']
@@ -2,10 +2,13 @@ import os
 import pytest
 import tempfile
 from configparser import ConfigParser
+from pathlib import Path
+from types import SimpleNamespace
 
-from errbot import plugin_manager
+from errbot import BotPlugin, plugin_manager
 from errbot.plugin_info import PluginInfo
 from errbot.plugin_manager import IncompatiblePluginException
+from errbot.storage.memory import MemoryStoragePlugin
 from errbot.utils import find_roots, collect_roots
 
 CORE_PLUGINS = plugin_manager.CORE_PLUGINS
@@ -136,3 +139,15 @@ def test_errbot_version_check():
             plugin_manager.check_errbot_version(pi)
     finally:
         plugin_manager.VERSION = real_version
+
+
+def test_plugins_cant_use_the_storage_of_the_flows(tmpdir):
+    tmpdir.join('reserved.plug').write('[Core]\nName = Core_Flow_Contexts\nModule = reserved\n')
+    tmpdir.join('reserved.py').write('from errbot import BotPlugin\n\n\nclass Reserved(BotPlugin):\n    pass\n')
+    storage_plugin = MemoryStoragePlugin(SimpleNamespace(STORAGE_CONFIG={}))
+    manager = plugin_manager.BotPluginManager(storage_plugin, None, None, False, None, (None,))
+    feedback = {}
+    manager._load_plugins_generic(Path(str(tmpdir)), 'plug', 'errbot.plugins', BotPlugin,
+                                  manager.plugins, manager.plugin_infos, feedback)
+    assert manager.plugins == {}
+    assert feedback == {Path(str(tmpdir)): 'The name Core_Flow_Contexts is reserved for the storage of the flows.'}
@@ -21,3 +21,13 @@ def test_delayed_hello_loop(testbot):
     assert delayed_msg in testbot.pop_message(timeout=1)
     # Assert that only one message has been enqueued
     assert testbot.bot.outgoing_message_queue.empty()
+
+
+def test_status_pollers(testbot):
+    assert 'No poller is running' in testbot.exec_command('!status pollers')
+    plugin = testbot.bot.plugin_manager.get_plugin_obj_by_name('PollerPlugin')
+    plugin.start_poller(100, plugin.delayed_hello, kwargs={'frm': None})
+    try:
+        assert 'PollerPlugin PollerPlugin.delayed_hello' in testbot.exec_command('!status pollers')
+    finally:
+        plugin.stop_poller(plugin.delayed_hello, kwargs={'frm': None})
@@ -0,0 +1,140 @@
+from threading import Event
+from time import monotonic, sleep
+
+import pytest
+
+from errbot.scheduler import PollerScheduler
+
+
+def test_fixed_rate_and_times():
+    scheduler = PollerScheduler(poolsize=2)
+    calls = []
+    done = Event()
+
+    def poll():
+        calls.append(monotonic())
+        sleep(0.03)  # doesn't delay the next calls
+        if len(calls) == 5:
+            done.set()
+
+    try:
+        start = monotonic()
+        scheduler.start('owner', 0.05, poll, times=5)
+        assert done.wait(2)
+        assert abs(calls[-1] - start - 0.25) < 0.1
+        sleep(0.1)
+        assert len(calls) == 5
+        assert scheduler.pollers('owner') == []
+    finally:
+        scheduler.shutdown()
+
+
+def test_skip_if_still_running():
+    scheduler = PollerScheduler(poolsize=4)
+    running, calls = [], []
+
+    def slow_poll():
+        running.append(1)
+        calls.append(len(running))
+        sleep(0.12)
+        running.pop()
+
+    try:
+        scheduler.start('owner', 0.02, slow_poll)
+        sleep(0.4)
+        assert calls and max(calls) == 1  # never 2 calls at the same time
+        assert len(calls) <= 4
+    finally:
+        scheduler.shutdown()
+
+
+def test_stop():
+    scheduler = PollerScheduler()
+    calls = []
+    try:
+        for i in range(100):
+            scheduler.start('owner', 0.05, calls.append, args=(i,))
+        scheduler.start('other', 0.05, calls.append, args=('other',))
+        assert scheduler.stop('owner', calls.append, args=[42])
+        assert not scheduler.stop('owner', calls.append, args=(1000,))
+        assert scheduler.stop_all('owner') == 99
+        sleep(0.12)
+        assert set(calls) == {'other'}
+        assert len(scheduler.pollers('other')) == 1
+    finally:
+        scheduler.shutdown()
+
+
+def _overlapping_calls(overlap):
+    scheduler = PollerScheduler(poolsize=4)
+    calls, ends = [], []
+
+    def slow_poll():
+        calls.append(monotonic())
+        sleep(0.1)
+        ends.append(monotonic())
+
+    try:
+        scheduler.start('owner', 0.04, slow_poll, overlap=overlap)
+        sleep(0.3)
+        stats = scheduler.stats()[0]
+    finally:
+        scheduler.shutdown()
+    return calls, ends, stats
+
+
+def test_overlap_queue():
+    calls, ends, stats = _overlapping_calls('queue')
+    # each call starts right when the previous one ends
+    assert len(calls) >= 2 and abs(calls[1] - ends[0]) < 0.02
+    assert stats['skipped'] >= 1
+    assert stats['overruns'] == stats['runs'] and stats['max_duration'] >= 0.1
+
+
+def test_overlap_allow():
+    calls, ends, stats = _overlapping_calls('allow')
+    assert len(calls) >= 5 and len(ends) < len(calls)  # several calls at the same time
+    assert stats['skipped'] == 0 and stats['running'] >= 2
+
+
+def test_stats():
+    scheduler = PollerScheduler()
+
+    def failing_poll():
+        raise Exception('boom')
+
+    try:
+        scheduler.start('owner', 0.02, failing_poll, times=3)
+        scheduler.start('owner', 0.03, failing_poll)
+        sleep(0.15)
+        stats = scheduler.stats()
+        assert len(stats) == 1  # the first one is done
+        assert stats[0]['interval'] == 0.03 and stats[0]['runs'] >= 3
+        assert stats[0]['failures'] == stats[0]['runs'] and stats[0]['avg_duration'] < 0.03
+    finally:
+        scheduler.shutdown()
+    with pytest.raises(ValueError):
+        scheduler.start('owner', 1, failing_poll, overlap='whatever')
+
+
+def test_interval_should_be_positive():
+    scheduler = PollerScheduler()
+    for interval in (0, -1):
+        with pytest.raises(ValueError):
+            scheduler.start('owner', interval, print)
+    assert scheduler.pollers('owner') == []
+
+
+def test_a_broken_poller_doesnt_stop_the_others():
+    scheduler = PollerScheduler()
+    calls = []
+    try:
+        broken = scheduler.start('owner', 0.02, lambda: None)
+        broken.interval = 0  # can't be scheduled anymore
+        scheduler.start('owner', 0.05, calls.append, args=('healthy',))
+        sleep(0.3)
+        assert len(calls) >= 3
+        assert scheduler._thread.is_alive()
+        assert len(scheduler.pollers('owner')) == 1 and broken not in scheduler.pollers('owner')
+    finally:
+        scheduler.shutdown()
@@ -0,0 +1,95 @@
+import pickle
+import shelve
+from os import path
+from tempfile import mkdtemp
+
+import pytest
+
+from errbot.backends.test import ShallowConfig
+from errbot.storage import Expiring, PersistedDict, PersistedDictMarker, StoreMixin
+from errbot.storage.serialization import Codec, MAGIC
+from errbot.storage.shelf import ShelfStoragePlugin
+from errbot.storage.sqlite import SqliteStoragePlugin
+
+
+@pytest.mark.parametrize('serializer', ['pickle', 'json'])
+def test_round_trip(serializer):
+    codec = Codec(serializer)
+    value = {'name': 'gbin', 'karma': [1, 2.5, None, True]}
+    data = codec.encode(value)
+    assert data.startswith(MAGIC)
+    assert Codec.decode(data) == value
+    assert Codec.decode(memoryview(data)) == value
+
+
+def test_compression_above_threshold():
+    codec = Codec('json', 'zlib', compression_threshold=100)
+    small, big = 'a' * 10, 'a' * 1000
+    assert len(codec.encode(small)) > len(small)
+    assert len(codec.encode(big)) < 100
+    assert Codec.decode(codec.encode(big)) == big
+
+
+def test_reads_any_codec_and_plain_pickles():
+    values = [Codec('json').encode([1]), Codec('pickle', 'zlib', 0).encode((1,)), pickle.dumps({1}, protocol=2)]
+    assert [Codec().decode(data) for data in values] == [[1], (1,), {1}]
+
+
+def test_unknown_codec():
+    with pytest.raises(ValueError):
+        Codec('yaml')
+    with pytest.raises(ValueError):
+        Codec('pickle', 'lzma')
+
+
+@pytest.mark.parametrize('plugin', [ShelfStoragePlugin, SqliteStoragePlugin])
+def test_codec_per_namespace(plugin):
+    config = ShallowConfig()
+    config.BOT_DATA_DIR = mkdtemp()
+    config.STORAGE_CONFIG = {'codec': {'compression': 'zlib', 'compression_threshold': 0},
+                             'namespace_codecs': {'portable': {'serializer': 'json'}}}
+    plugin = plugin(config)
+    storage, portable = plugin.open('ns'), plugin.open('portable')
+    storage.set('key', ('tuple', 'a' * 100))
+    portable.set('key', ('tuple', 'a' * 100))
+    assert storage.get('key') == ('tuple', 'a' * 100)
+    assert portable.get('key') == ['tuple', 'a' * 100]  # json has no tuples
+
+
+def test_shelf_reads_shelve_files():
+    config = ShallowConfig()
+    config.BOT_DATA_DIR = mkdtemp()
+    with shelve.DbfilenameShelf(path.join(config.BOT_DATA_DIR, 'old.db'), protocol=2) as old:
+        old['key'] = {'a': 1}
+    storage = ShelfStoragePlugin(config).open('old')
+    assert storage.get('key') == {'a': 1}
+    storage.set('new', 2)
+    assert sorted(storage.keys()) == ['key', 'new']
+    assert dict(storage.items()) == {'key': {'a': 1}, 'new': 2}
+
+
+@pytest.mark.parametrize('serializer', ['json', 'msgpack'])
+def test_internal_values_round_trip(serializer):
+    if serializer == 'msgpack':
+        pytest.importorskip('msgpack')
+    codec = Codec(serializer)
+    for value in (Expiring({'a': [1]}, 12.5), PersistedDictMarker(), {'users', 'rooms'}):
+        assert Codec.decode(codec.encode(value)) == value
+    assert type(Codec.decode(codec.encode(Expiring('v', 1.0)))) is Expiring
+
+
+@pytest.mark.parametrize('serializer', ['json', 'msgpack'])
+def test_store_on_portable_codecs(serializer):
+    if serializer == 'msgpack':
+        pytest.importorskip('msgpack')
+    config = ShallowConfig()
+    config.BOT_DATA_DIR = mkdtemp()
+    config.STORAGE_CONFIG = {'codec': {'serializer': serializer}}
+    sm = StoreMixin()
+    sm.open_storage(SqliteStoragePlugin(config), 'portable')
+    sm.set_with_ttl('cached', 'v', 3600)
+    sm['configs'] = PersistedDict({'Webserver': {'PORT': 3141}})
+    assert sm['cached'] == 'v'
+    assert dict(sm['configs']) == {'Webserver': {'PORT': 3141}}
+    assert sorted(sm.keys()) == ['cached', 'configs']
+    sm.close_storage()
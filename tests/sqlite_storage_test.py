@@ -0,0 +1,69 @@
+from tempfile import mkdtemp
+from threading import Thread
+
+import pytest
+
+from errbot.backends.test import ShallowConfig
+from errbot.storage import StoreMixin
+from errbot.storage.sqlite import SqliteStoragePlugin
+
+
+@pytest.fixture
+def config():
+    config = ShallowConfig()
+    config.BOT_DATA_DIR = mkdtemp()
+    return config
+
+
+def test_set_get_remove(config):
+    storage = SqliteStoragePlugin(config).open('ns')
+    storage.set('key', {'a': [1, 2]})
+    assert storage.get('key') == {'a': [1, 2]}
+    assert storage.len() == 1
+    assert list(storage.keys()) == ['key']
+    storage.remove('key')
+    with pytest.raises(KeyError):
+        storage.get('key')
+    with pytest.raises(KeyError):
+        storage.remove('key')
+
+
+def test_namespaces_share_the_file_but_not_the_keys(config):
+    plugin = SqliteStoragePlugin(config)
+    one, two = plugin.open('one'), plugin.open('two')
+    one.set('key', 1)
+    two.set('key', 2)
+    assert (one.get('key'), two.get('key')) == (1, 2)
+    one.close()
+    two.close()
+
+    sm = StoreMixin()
+    sm.open_storage(SqliteStoragePlugin(config), 'one')
+    assert sm['key'] == 1
+    assert len(sm) == 1
+
+
+def test_concurrent_writers(config):
+    storage = SqliteStoragePlugin(config).open('ns')
+
+    def write(n):
+        for i in range(50):
+            storage.set('%d-%d' % (n, i), i)
+
+    threads = [Thread(target=write, args=(n,)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert storage.len() == 200
+    assert storage.get('3-49') == 49
+
+
+def test_bulk_operations(config):
+    storage = SqliteStoragePlugin(config).open('ns')
+    storage.set_many({'a': 1, 'b': 2, 'c': 3})
+    assert storage.contains('a')
+    assert not storage.contains('z')
+    assert storage.get_many(['a', 'c', 'z']) == {'a': 1, 'c': 3}
+    storage.remove_many(['a', 'z'])
+    assert sorted(storage.items()) == [('b', 2), ('c', 3)]
@@ -0,0 +1,96 @@
+from io import BytesIO
+from tempfile import mkdtemp
+
+import pytest
+
+from errbot.backends.test import ShallowConfig
+from errbot.bootstrap import get_storage_plugin
+from errbot.storage import StoreMixin, PersistedDict
+from errbot.storage.export import export_storage, import_storage, migrate_storage
+from errbot.storage.shelf import ShelfStoragePlugin
+from errbot.storage.sqlite import SqliteStoragePlugin
+
+
+@pytest.fixture
+def config():
+    config = ShallowConfig()
+    config.BOT_DATA_DIR = mkdtemp()
+    config.STORAGE_CONFIG = {}
+    return config
+
+
+def fill(storage_plugin):
+    for namespace in ('core', 'Weather'):
+        store = StoreMixin()
+        store.open_storage(storage_plugin, namespace)
+        store['json'] = {'city': 'Paris', 'days': [1, 2]}
+        store['tuple'] = ('not', 'json')
+        store['big'] = PersistedDict({str(i): i for i in range(2500)})
+        store.close_storage()
+
+
+def dump(storage_plugin, namespace):
+    storage = storage_plugin.open(namespace)
+    try:
+        return dict(storage.items())
+    finally:
+        storage.close()
+
+
+def test_export_import(config):
+    source = ShelfStoragePlugin(config)
+    fill(source)
+    assert source.namespaces() == ['Weather', 'core']
+    stream = BytesIO()
+    assert export_storage(source, ['Weather'], stream) == 2504
+    assert b'"city": "Paris"' in stream.getvalue()
+
+    target = SqliteStoragePlugin(config)
+    progress = []
+    stream.seek(0)
+    assert import_storage(target, stream, progress=lambda namespace, count: progress.append(count)) == 2504
+    assert progress == [1000, 2000, 2504]
+    assert dump(target, 'Weather') == dump(source, 'Weather')
+    assert target.namespaces() == ['Weather']
+
+
+def test_migrate(config):
+    source, target = ShelfStoragePlugin(config), SqliteStoragePlugin(config)
+    fill(source)
+    assert migrate_storage(source, target) == 2 * 2504
+    for namespace in ('core', 'Weather'):
+        assert dump(target, namespace) == dump(source, namespace)
+
+    store = StoreMixin()
+    store.open_storage(target, 'core')
+    assert store['tuple'] == ('not', 'json')
+    assert store['big']['2499'] == 2499
+
+
+def test_migrate_again_catches_up_with_the_deletions(config):
+    source, target = ShelfStoragePlugin(config), SqliteStoragePlugin(config)
+    fill(source)
+    assert migrate_storage(source, target, ['core']) == 2504
+    store = StoreMixin()
+    store.open_storage(source, 'core')
+    del store['json']
+    store['new'] = 'entry'
+    store.close_storage()
+
+    assert migrate_storage(source, target, ['core']) == 2504
+    assert dump(target, 'core') == dump(source, 'core')
+    assert 'json' not in dump(target, 'core')
+
+
+def test_migrate_with_a_target_config(config):
+    config.STORAGE_CONFIG = {'file': config.BOT_DATA_DIR + '/source.sqlite'}
+    source = get_storage_plugin(config, 'Sqlite')
+    target_config = {'file': config.BOT_DATA_DIR + '/target.sqlite', 'codec': {'serializer': 'json'}}
+    target = get_storage_plugin(config, 'Sqlite', target_config)
+    assert config.STORAGE_CONFIG == {'file': config.BOT_DATA_DIR + '/source.sqlite'}
+    fill(source)
+    assert migrate_storage(source, target, ['Weather']) == 2504
+    copied = dump(target, 'Weather')
+    assert copied['json'] == {'city': 'Paris', 'days': [1, 2]}
+    assert copied['tuple'] == ['not', 'json']  # written with the json codec of the target
+    assert target.namespaces() == ['Weather'] and sorted(source.namespaces()) == ['Weather', 'core']
@@ -95,3 +95,40 @@ def test_split_string_after_returns_two_chunks_when_chunksize_equals_half_length
     splitter = split_string_after(str_, int(len(str_) / 2))
     split = [chunk for chunk in splitter]
     assert ['foobar2000', 'foobar2000'] == split
+
+
+def test_decorated_members_are_scanned_once_per_class_without_evaluating_properties():
+    from errbot import botcmd, re_botcmd, cmdfilter, botflow, webhook
+
+    class Decorated(object):
+        @property
+        def expensive(self):
+            raise AssertionError('properties should not be evaluated')
+
+        @botcmd
+        def b_command(self, msg, args):
+            pass
+
+        @re_botcmd(pattern='a')
+        def a_re_command(self, msg, match):
+            pass
+
+        @cmdfilter
+        def a_filter(self, msg, cmd, args, dry_run):
+            pass
+
+        @botflow
+        def a_flow(self, flow):
+            pass
+
+        @webhook
+        def a_webhook(self, payload):
+            pass
+
+        def not_decorated(self):
+            pass
+
+    members = decorated_members(Decorated())
+    assert members == DecoratedMembers(commands=('a_re_command', 'b_command'), command_filters=('a_filter',),
+                                       flows=('a_flow',), webhooks=('a_webhook',))
+    assert decorated_members(Decorated()) is members
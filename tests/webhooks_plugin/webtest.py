@@ -53,3 +53,8 @@ class WebTest(BotPlugin):
     def raw2(self, payload):
         log.debug(str(payload))
         return str(type(payload))
+
+    @webhook(r'/async', async_ack=True)
+    def async_webhook(self, payload):
+        self.received = payload
+        return 'ignored'
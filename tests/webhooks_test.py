@@ -1,11 +1,15 @@
 import json
 import logging
 import os
+from http.client import HTTPConnection
+from threading import Event
 
 import pytest
 import requests
 import socket
 from errbot.backends.test import FullStackTest, testbot
+from errbot.core_plugins.webserver import WorkerPool
+from errbot.core_plugins.wsview import WebhookQueue
 from time import sleep
 
 log = logging.getLogger(__name__)
@@ -182,3 +186,84 @@ def test_lambda_webhook(webhook_testbot):
     assert requests.post(
         'http://localhost:{}/lambda'.format(WEBSERVER_PORT)
     ).status_code == 200
+
+
+def test_keep_alive_and_body_limit(webhook_testbot):
+    webhook_testbot.push_message("!plugin config Webserver {'HOST': 'localhost', 'PORT': %s, 'SSL': None, "
+                                 "'MAX_BODY_SIZE': 1024}" % WEBSERVER_PORT)
+    assert 'Plugin configuration done.' in webhook_testbot.pop_message(timeout=2)
+    wait_for_server(WEBSERVER_PORT)
+
+    connection = HTTPConnection('localhost', WEBSERVER_PORT, timeout=5)
+    for _ in range(2):  # the same connection is reused, even if the body isn't read.
+        connection.request('POST', '/lambda', body=b'x' * 100)
+        response = connection.getresponse()
+        assert response.status == 200 and response.version == 11
+        response.read()
+    # chunked bodies are dechunked, and the connection is still usable after them.
+    connection.request('POST', '/webhook1', body=iter([b'{"a":', b' 1}']))
+    response = connection.getresponse()
+    assert response.read() == b"{'a': 1}"
+    connection.request('POST', '/webhook1', body=iter([b'x' * 1000, b'x' * 1000]))
+    response = connection.getresponse()
+    assert response.status == 413
+    response.read()
+    connection.close()
+
+    connection = HTTPConnection('localhost', WEBSERVER_PORT, timeout=5)
+    connection.request('POST', '/webhook1', body=b'x' * 2048)
+    assert connection.getresponse().status == 413
+    connection.close()
+
+
+def test_worker_pool_rejects_when_full():
+    release = Event()
+
+    class BlockingServer(object):
+        def finish_request(self, request, client_address):
+            release.wait(5)
+
+        def shutdown_request(self, request):
+            pass
+
+    server = BlockingServer()
+    pool = WorkerPool(workers=1, queue_size=1)
+    assert pool.submit(server, None, None)  # taken by the worker
+    sleep(0.1)
+    assert pool.submit(server, None, None)  # waits in the queue
+    assert not pool.submit(server, None, None)
+    release.set()
+    pool.shutdown()
+
+
+def test_async_ack_webhook(webhook_testbot):
+    response = requests.post('http://localhost:{}/async'.format(WEBSERVER_PORT), JSONOBJECT)
+    assert response.status_code == 202 and response.text == ''
+    plugin = webhook_testbot.bot.plugin_manager.get_plugin_obj_by_name('Test hooks for webhooks testing')
+    for _ in range(50):
+        if hasattr(plugin, 'received'):
+            break
+        sleep(0.1)
+    assert plugin.received == json.loads(JSONOBJECT)
+
+    stats = requests.get('http://localhost:{}/status/webhooks'.format(WEBSERVER_PORT)).json()
+    assert stats['processed'] == 1 and stats['depth'] == 0 and stats['avg_latency'] >= 0
+
+
+def test_webhook_queue_rejects_when_full():
+    release = Event()
+    calls = []
+
+    def func(payload):
+        release.wait(5)
+        calls.append(payload)
+
+    queue = WebhookQueue(workers=1, size=1)
+    assert queue.submit(func, 1, {})  # taken by the worker
+    sleep(0.1)
+    assert queue.submit(func, 2, {})  # waits in the queue
+    assert not queue.submit(func, 3, {})
+    release.set()
+    queue.shutdown()  # processes the waiting request first
+    assert calls == [1, 2]
+    assert queue.stats()['rejected'] == 1 and queue.stats()['processed'] == 2
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Measures the dispatch of the commands, from the incoming message to the reply, on a backend without I/O.
+
+usage: command_benchmark.py [number of calls]   (default: 100000, the best of 5 runs is reported)
+"""
+import sys
+from tempfile import mkdtemp
+from time import perf_counter
+
+from errbot import botcmd, re_botcmd
+from errbot.backends.base import ONLINE
+from errbot.backends.test import TestPerson, ShallowConfig
+from errbot.bootstrap import bot_config_defaults
+from errbot.core import ErrBot
+
+
+class BenchBackend(ErrBot):
+    def __init__(self):
+        config = ShallowConfig()
+        config.BOT_ADMINS = ('admin',)
+        bot_config_defaults(config)
+        config.BOT_DATA_DIR = mkdtemp()
+        config.BOT_IDENTITY = {}
+        config.BOT_ASYNC = False
+        config.BOT_PREFIX = '!'
+        config.CHATROOM_FN = 'bench'
+        super().__init__(config)
+        self.bot_identifier = TestPerson('err')
+        self.replies = 0
+        self.name = 'Bench'
+        self.inject_commands_from(self)
+
+    def _dispatch_to_plugins(self, method, *args, **kwargs):
+        pass  # only the commands are measured, there is no plugin
+
+    def build_identifier(self, text_representation):
+        return TestPerson(text_representation)
+
+    def build_reply(self, msg, text=None, private=False, threaded=False):
+        reply = self.build_message(text)
+        reply.frm = self.bot_identifier
+        reply.to = msg.frm
+        return reply
+
+    def send_message(self, msg):
+        self.replies += 1
+
+    def change_presence(self, status=ONLINE, message=''):
+        pass
+
+    def prefix_groupchat_reply(self, message, identifier):
+        pass
+
+    def query_room(self, room):
+        pass
+
+    def rooms(self):
+        return []
+
+    @property
+    def mode(self):
+        return 'bench'
+
+    @botcmd
+    def plain(self, msg, args):
+        return args
+
+    @botcmd(split_args_with=',')
+    def split(self, msg, args):
+        return ' '.join(args)
+
+    @botcmd
+    def generator(self, msg, args):
+        yield args
+
+    @re_botcmd(pattern=r'^regex (\w+)$', prefixed=False)
+    def regex(self, msg, match):
+        return match.group(1)
+
+
+def bench(bot, text, calls):
+    msg = bot.build_message(text)
+    msg.frm = TestPerson('user')
+    msg.to = bot.bot_identifier
+    start = perf_counter()
+    for _ in range(calls):
+        bot.callback_message(msg)
+    elapsed = perf_counter() - start
+    assert bot.replies >= calls, 'no reply to %r' % text
+    bot.replies = 0
+    return elapsed
+
+
+def main(calls, repeat=5):
+    bot = BenchBackend()
+    print('%-24s %10s' % ('message', 'us/call'))
+    for text in ('!plain one two', '!split one,two', '!generator one two', 'regex one'):
+        best = min(bench(bot, text, calls) for _ in range(repeat))
+        print('%-24s %10.2f' % (text, best / calls * 1e6))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
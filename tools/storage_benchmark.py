@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Measures set, get and keys on the core storage plugins.
+
+usage: storage_benchmark.py [number of keys ...]   (default: 10000 100000 1000000)
+"""
+import sys
+from tempfile import mkdtemp
+from time import perf_counter
+
+from errbot.backends.test import ShallowConfig
+from errbot.storage.memory import MemoryStoragePlugin
+from errbot.storage.shelf import ShelfStoragePlugin
+from errbot.storage.sqlite import SqliteStoragePlugin
+
+PLUGINS = [('Memory', MemoryStoragePlugin), ('Shelf', ShelfStoragePlugin), ('Sqlite', SqliteStoragePlugin)]
+
+try:
+    import lmdb  # noqa
+    from errbot.storage.lmdbstore import LMDBStoragePlugin
+    PLUGINS.append(('LMDB', LMDBStoragePlugin))
+except ImportError:
+    pass
+
+
+def timed(fn):
+    start = perf_counter()
+    fn()
+    return perf_counter() - start
+
+
+def bench(plugin_class, size):
+    config = ShallowConfig()
+    config.BOT_DATA_DIR = mkdtemp()
+    config.STORAGE_CONFIG = {}
+    storage = plugin_class(config).open('bench%d' % size)
+    keys = ['key%d' % i for i in range(size)]
+    value = {'a': 'value', 'b': list(range(10))}
+
+    def set_all():
+        for key in keys:
+            storage.set(key, value)
+
+    def get_all():
+        for key in keys:
+            storage.get(key)
+
+    def list_keys():
+        list(storage.keys())
+
+    results = (timed(set_all), timed(get_all), timed(list_keys))
+    storage.close()
+    return results
+
+
+def main(sizes):
+    print('%-8s %9s %12s %12s %10s' % ('storage', 'keys', 'set us/key', 'get us/key', 'keys ms'))
+    for size in sizes:
+        for name, plugin_class in PLUGINS:
+            set_time, get_time, keys_time = bench(plugin_class, size)
+            print('%-8s %9d %12.2f %12.2f %10.1f' % (name, size, set_time / size * 1e6, get_time / size * 1e6,
+                                                     keys_time * 1e3))
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [10000, 100000, 1000000])